@@ -0,0 +1 @@
+Worker log records are forwarded to the launcher in batches instead of one message per record.
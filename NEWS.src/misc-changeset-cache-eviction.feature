@@ -0,0 +1 @@
+The changeset cache on worker nodes can be bounded with cacheMaxSize; least recently used changesets are evicted, and cache hit, miss and download counters are reported in worker heartbeats.
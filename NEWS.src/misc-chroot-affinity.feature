@@ -0,0 +1 @@
+Workers advertise the chroots in their chroot cache, and the dispatcher prefers sending builds to workers that already have a matching chroot cached.
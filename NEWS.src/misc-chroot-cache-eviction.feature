@@ -0,0 +1 @@
+The chroot cache can be bounded with chrootCacheMaxSize and chrootCacheMaxEntries; the least recently restored chroots are evicted first, and per-chroot hit counts, sizes and ages are tracked.
@@ -0,0 +1 @@
+Build results from the chroot cook process are picked up as soon as the process exits instead of on a 0.1 second poll.
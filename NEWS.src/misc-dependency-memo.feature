@@ -0,0 +1 @@
+Dependency solutions are now memoized per job and shared by all of its resolve tasks.
@@ -0,0 +1 @@
+Decoded job and task data is now cached instead of being unpickled on every access.
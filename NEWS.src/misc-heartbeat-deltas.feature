@@ -0,0 +1 @@
+Worker heartbeats now send only what changed, with a full snapshot every third beat so older dispatchers that ignore the deltas don't expire the worker, and interface addresses are rescanned only when netlink reports a change.
@@ -0,0 +1 @@
+Worker log forwarding is now bounded by the new logBufferSize option and holds back while the dispatcher link is congested.
@@ -0,0 +1 @@
+RPC clients now keep HTTP connections open between calls instead of reconnecting (and renegotiating TLS) for every request.
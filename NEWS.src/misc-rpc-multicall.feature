@@ -0,0 +1 @@
+Pickle RPC clients can batch several calls into a single request with PickleServerProxy._batch().
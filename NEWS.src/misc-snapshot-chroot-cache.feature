@@ -0,0 +1 @@
+Worker nodes can keep cached chroots as unpacked trees (chrootCache snapshot <path>) that are restored with copy-on-write clones instead of unpacking a tarball.
@@ -0,0 +1 @@
+Trove state changes are now saved as individual rows in build.trove_states instead of rewriting the whole frozen job on every status change.
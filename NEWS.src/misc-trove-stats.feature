@@ -0,0 +1 @@
+The dispatcher now records how long each trove takes to resolve and build on each worker, and exposes the aggregated durations through the build.getTroveStats RPC call.
@@ -0,0 +1 @@
+UUIDs are now stored as 16-byte strings, making them cheaper to hash, compare and format.
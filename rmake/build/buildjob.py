@@ -60,6 +60,11 @@ class _AbstractBuildJob(object):
         data.  Most setting of this data (after creation) should be through 
         methods that are defined in BuildJob subclass.
     """
+
+    # For a job that loads only part of a larger job, the (name, version,
+    # flavor) of every loadable trove in the larger job.
+    loadInstalledTroves = None
+
     def __init__(self, jobUUID=None, jobId=None, jobName=None, troveList=(),
             state=JOB_STATE_INIT, status='', owner=None, failure=None,
             configs=(), timeStarted=None, timeUpdated=None, timeFinished=None):
@@ -126,6 +131,25 @@ class _AbstractBuildJob(object):
         self.addTrove(buildTrove=buildTrove,
                       *buildTrove.getNameVersionFlavor(withContext=True))
 
+    def getSubJob(self, troveTups):
+        """
+            Return a new job with the same identity and configuration as this
+            one, but holding only the given troves.
+
+            Loading the subjob still lets loadInstalled find any trove in
+            this job, so its recipes load the same as they would here.
+        """
+        subJob = type(self)(self.jobUUID, self.jobId, self.jobName,
+                configs=self.configs)
+        subJob.loadInstalledTroves = self.getLoadInstalledTroveList()
+        # Not addBuildTrove(), which would point the troves' publisher, still
+        # shared with this job, at the subjob.
+        for troveTup in troveTups:
+            n, v, f, c = troveTup
+            subJob.troves[troveTup] = self.getTrove(*troveTup)
+            subJob.troveContexts.setdefault((n, v, f), []).append(c)
+        return subJob
+
     def setBuildTroves(self, buildTroves):
         self.troves = {}
         self.troveContexts = {}
@@ -147,6 +171,15 @@ class _AbstractBuildJob(object):
     def iterLoadableTroves(self):
         return (x for x in self.troves.itervalues())
 
+    def getLoadInstalledTroveList(self):
+        """
+            Return the (name, version, flavor) of each trove that
+            loadInstalled may find while loading this job.
+        """
+        if self.loadInstalledTroves is not None:
+            return list(self.loadInstalledTroves)
+        return [x.getNameVersionFlavor() for x in self.iterLoadableTroves()]
+
     def getTrove(self, name, version, flavor, context=''):
         return self.troves[name, version, flavor, context]
 
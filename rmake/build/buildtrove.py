@@ -24,7 +24,7 @@ from conary.repository import changeset
 
 from rmake import failure
 from rmake.lib import flavorutil
-from rmake.lib.ninamori.types import constants
+from rmake.lib.ninamori.types import constants, namedtuple
 
 
 TroveState = constants('TroveState',
@@ -69,6 +69,11 @@ stateNames.update({
 })
 
 
+LoadTroveResult = namedtuple('LoadTroveResult',
+        'flavor recipeType loadedSpecsList loadedTroves packages '
+        'delayedRequirements buildRequirements crossRequirements')
+
+
 def getRecipeType(recipeClass):
     if recipe.isPackageRecipe(recipeClass):
         return RecipeType.PACKAGE
@@ -426,6 +431,13 @@ class BuildTrove(_AbstractBuildTrove):
         """
         return self._publisher
 
+    def getLoadResult(self):
+        """Return the information loaded from this trove's recipe."""
+        return LoadTroveResult(self.flavor, self.recipeType,
+                self.loadedSpecsList, self.loadedTroves, self.packages,
+                self.delayedRequirements, self.buildRequirements,
+                self.crossRequirements)
+
     def troveLoaded(self, results):
         self.setFlavor(results.flavor)
         self.setRecipeType(results.recipeType)
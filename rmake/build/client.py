@@ -69,6 +69,14 @@ class rMakeClient(object):
             cfg.conaryProxy['http'] = info['conaryProxy']
             cfg.conaryProxy['https'] = info['conaryProxy']
 
+    def getTroveStats(self, names=None, phase=None):
+        """Return historical build phase durations for the named troves."""
+        return self.proxy.build.getTroveStats(names, phase)
+
+    def getTroveStates(self, jobUUID):
+        """Return the current state of each trove in a running job."""
+        return self.proxy.build.getTroveStates(jobUUID)
+
     def buildJob(self, job, subscribe=True):
         sid = subscribe and self.firehose.sid or None
         import pickle; pickle.dump(job, open('job.pickle', 'wb'), 2)
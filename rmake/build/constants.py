@@ -21,3 +21,7 @@ LOAD_TASK       = _PREFIX + '.load'
 RESOLVE_TASK    = _PREFIX + '.resolve'
 BUILD_TASK      = _PREFIX + '.build'
 COMMIT_TASK     = _PREFIX + '.commit'
+
+# Phases tracked in the trove timing statistics
+PHASE_RESOLVE   = 'resolve'
+PHASE_BUILD     = 'build'
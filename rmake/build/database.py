@@ -20,6 +20,8 @@ This module holds the database interface used by the trove build system, as an
 extension of the core build system.
 """
 
+from twisted.internet import defer
+
 
 class JobStore(object):
 
@@ -52,3 +54,156 @@ class JobStore(object):
         # Just return the new jobId
         d.addCallback(lambda _: ret[0])
         return d
+
+    ## Trove states
+
+    def updateTroveStates(self, job_uuid, states):
+        """Record the current state of some of a job's troves.
+
+        C{states} is a list of (name, version, flavor, context, state, status)
+        tuples with the version and flavor frozen. Only the given rows are
+        written, so this is cheap enough to call on every state change.
+        """
+        def interaction(cu):
+            d = defer.succeed(None)
+            for name, version, flavor, context, state, status in states:
+                args = dict(job_uuid=job_uuid, name=name, version=version,
+                        flavor=flavor, context=context, state=state,
+                        status=status)
+                d.addCallback(lambda _, args=args: cu.execute("""
+                    UPDATE build.trove_states SET state = %(state)s,
+                        status = %(status)s, time_updated = now()
+                    WHERE job_uuid = %(job_uuid)s AND source_name = %(name)s
+                        AND source_version = %(version)s
+                        AND build_flavor = %(flavor)s
+                        AND build_context = %(context)s
+                    """, args))
+                d.addCallback(lambda _, args=args: cu.execute("""
+                    INSERT INTO build.trove_states ( job_uuid, source_name,
+                        source_version, build_flavor, build_context, state,
+                        status )
+                    SELECT %(job_uuid)s, %(name)s, %(version)s, %(flavor)s,
+                        %(context)s, %(state)s, %(status)s
+                    WHERE NOT EXISTS ( SELECT * FROM build.trove_states
+                        WHERE job_uuid = %(job_uuid)s
+                        AND source_name = %(name)s
+                        AND source_version = %(version)s
+                        AND build_flavor = %(flavor)s
+                        AND build_context = %(context)s )
+                    """, args))
+            d.addCallback(lambda _: None)
+            return d
+        return self.pool.runInteraction(interaction)
+
+    def getTroveStates(self, job_uuid):
+        """Return the last recorded state of each trove in a job."""
+        d = self.pool.runQuery("""
+            SELECT source_name, source_version, build_flavor, build_context,
+                state, status, time_updated
+            FROM build.trove_states WHERE job_uuid = %s
+            """, (job_uuid,))
+        d.addCallback(lambda rows: [dict(x) for x in rows])
+        return d
+
+    ## Trove statistics
+
+    def addTroveTiming(self, name, flavor, worker, phase, duration):
+        """Record how long one phase of building a trove took.
+
+        Samples are buffered in a raw table and folded into the aggregated
+        statistics by L{aggregateTroveStats}.
+        """
+        return self.pool.runOperation("""
+            INSERT INTO build.trove_timings ( source_name, build_flavor,
+                worker, phase, duration )
+            VALUES ( %s, %s, %s, %s, %s )
+            """, (name, flavor, worker, phase, duration))
+
+    def aggregateTroveStats(self):
+        """Roll all pending timing samples up into build.trove_stats.
+
+        Only samples that exist when the aggregation starts are consumed, so
+        timings recorded concurrently are left for the next run.
+        """
+        def interaction(cu):
+            ret = []
+            d = cu.execute("SELECT max(timing_id) FROM build.trove_timings")
+            @d.addCallback
+            def got_max(_):
+                maxId = cu.fetchone()[0]
+                if maxId is None:
+                    return
+                ret.append(maxId)
+                return cu.execute("""
+                    UPDATE build.trove_stats AS s SET
+                        samples = s.samples + a.samples,
+                        total_duration = s.total_duration + a.total_duration,
+                        min_duration = least(s.min_duration, a.min_duration),
+                        max_duration = greatest(s.max_duration, a.max_duration),
+                        last_duration = a.last_duration,
+                        time_updated = now()
+                    FROM (""" + _AGGREGATE_TIMINGS + """) a
+                    WHERE s.source_name = a.source_name
+                        AND s.build_flavor = a.build_flavor
+                        AND s.worker = a.worker AND s.phase = a.phase
+                    """, dict(max_id=maxId))
+            @d.addCallback
+            def insert_new(_):
+                if not ret:
+                    return
+                return cu.execute("""
+                    INSERT INTO build.trove_stats ( source_name, build_flavor,
+                        worker, phase, samples, total_duration, min_duration,
+                        max_duration, last_duration )
+                    SELECT a.* FROM (""" + _AGGREGATE_TIMINGS + """) a
+                    WHERE NOT EXISTS ( SELECT * FROM build.trove_stats s
+                        WHERE s.source_name = a.source_name
+                        AND s.build_flavor = a.build_flavor
+                        AND s.worker = a.worker AND s.phase = a.phase )
+                    """, dict(max_id=ret[0]))
+            @d.addCallback
+            def delete_old(_):
+                if not ret:
+                    return
+                return cu.execute("""DELETE FROM build.trove_timings
+                    WHERE timing_id <= %s""", (ret[0],))
+            d.addCallback(lambda _: None)
+            return d
+        return self.pool.runInteraction(interaction)
+
+    def getTroveStats(self, names=None, phase=None):
+        """Return aggregated phase durations, optionally limited to the given
+        trove names and phase."""
+        stmt = """
+            SELECT source_name, build_flavor, worker, phase, samples,
+                total_duration / samples AS mean_duration, min_duration,
+                max_duration, last_duration, time_updated
+            FROM build.trove_stats WHERE true
+            """
+        args = ()
+        if names:
+            stmt += " AND source_name IN %s"
+            args += (tuple(names),)
+        if phase:
+            stmt += " AND phase = %s"
+            args += (phase,)
+        d = self.pool.runQuery(stmt, args)
+        d.addCallback(lambda rows: [dict(x) for x in rows])
+        return d
+
+
+# Per-key summary of all samples up to and including the given timing_id. The
+# last sample is picked by taking the duration of the highest timing_id.
+_AGGREGATE_TIMINGS = """
+    SELECT t.source_name, t.build_flavor, t.worker, t.phase,
+        count(*) AS samples, sum(t.duration) AS total_duration,
+        min(t.duration) AS min_duration, max(t.duration) AS max_duration,
+        (SELECT l.duration FROM build.trove_timings l
+            WHERE l.source_name = t.source_name
+            AND l.build_flavor = t.build_flavor AND l.worker = t.worker
+            AND l.phase = t.phase AND l.timing_id <= %(max_id)s
+            ORDER BY l.timing_id DESC LIMIT 1
+            ) AS last_duration
+    FROM build.trove_timings t WHERE t.timing_id <= %(max_id)s
+    GROUP BY t.source_name, t.build_flavor, t.worker, t.phase
+    """
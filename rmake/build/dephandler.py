@@ -19,6 +19,7 @@
 Dependency Handler and DependencyState classes
 """
 
+import array
 import errno
 import itertools
 import os
@@ -28,7 +29,6 @@ import xmlrpclib
 
 from conary.deps import deps
 from conary.lib import digestlib
-from conary.lib import graph
 from conary.trove import Trove
 from conary.lib import util
 from conary import display
@@ -39,6 +39,8 @@ from rmake import failure
 from rmake.build.buildstate import AbstractBuildState
 
 from rmake.lib import flavorutil
+from rmake.lib.apiutils import freeze, thaw, register
+from rmake.worker import resolvesource
 
 FAILURE_REASON_FAILED = 0
 FAILURE_REASON_BUILDREQ = 1
@@ -46,7 +48,7 @@ FAILURE_REASON_DEP = 2
 
 class ResolveJob(object):
     def __init__(self, trove, buildCfg, builtTroves=None, crossTroves=None,
-                 inCycle=False):
+                 inCycle=False, depMemo=None):
         self.trove = trove
         self.buildCfg = buildCfg
         if builtTroves is None:
@@ -56,6 +58,7 @@ class ResolveJob(object):
             crossTroves = []
         self.crossTroves = crossTroves
         self.inCycle = inCycle
+        self.depMemo = depMemo
 
     def getConfig(self):
         return self.buildCfg
@@ -73,6 +76,9 @@ class ResolveJob(object):
         # only important when cross compiling for your current arch.
         return self.crossTroves
 
+    def getDependencyMemo(self):
+        return self.depMemo
+
     def getJobHash(self):
         # Disqualify anything other than a simple, isolated build.
         if self.inCycle or self.builtTroves or self.crossTroves:
@@ -93,6 +99,8 @@ class ResolveJob(object):
                  builtTroves=freeze('troveTupleList', self.builtTroves),
                  crossTroves=freeze('troveTupleList', self.crossTroves),
                  inCycle=self.inCycle)
+        if self.depMemo is not None:
+            d['depMemo'] = freeze('DependencySolutionMemo', self.depMemo)
         return d
 
     @classmethod
@@ -102,13 +110,277 @@ class ResolveJob(object):
         self.buildCfg = thaw('BuildConfiguration', self.buildCfg)
         self.builtTroves = thaw('troveTupleList', self.builtTroves)
         self.crossTroves = thaw('troveTupleList', self.crossTroves)
+        if self.depMemo is not None:
+            self.depMemo = thaw('DependencySolutionMemo', self.depMemo)
         return self
 register(ResolveJob)
 
-class DependencyGraph(graph.DirectedGraph):
-    # FIXME: remove with next release of conary
-    def __contains__(self, trove):
-        return trove in self.data.hashedData
+class DependencyGraph(object):
+    """
+        Directed graph of build troves.
+
+        Nodes are numbered as they are added and adjacency is kept as arrays
+        of node indexes, with edge values interned in a side table, so that
+        large jobs stay small in memory and cheap to pickle.
+    """
+
+    def __init__(self):
+        self._nodes = []
+        self._index = {}
+        self._children = []
+        self._parents = []
+        self._edges = {}
+        self._values = []
+        self._valueIds = {}
+
+    def __contains__(self, item):
+        return item in self._index
+
+    def __iter__(self):
+        return (x for x in self._nodes if x is not None)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getstate__(self):
+        # Drop deleted slots and flatten the edges into parallel arrays.
+        nodes = [ x for x in self._nodes if x is not None ]
+        index = dict((x, idx) for idx, x in enumerate(nodes))
+        fromIdx, toIdx, valueIdx = (array.array('i'), array.array('i'),
+                                    array.array('i'))
+        for (fromNode, toNode), valueId in self._edges.iteritems():
+            fromIdx.append(index[self._nodes[fromNode]])
+            toIdx.append(index[self._nodes[toNode]])
+            valueIdx.append(valueId)
+        return dict(nodes=nodes, values=self._values, fromIdx=fromIdx,
+                    toIdx=toIdx, valueIdx=valueIdx)
+
+    def __setstate__(self, state):
+        self.__init__()
+        if 'data' in state:
+            self._setOldState(state)
+            return
+        for node in state['nodes']:
+            self.addNode(node)
+        self._values = state['values']
+        for idx, value in enumerate(self._values):
+            try:
+                self._valueIds.setdefault(value, idx)
+            except TypeError:
+                pass
+        for fromNode, toNode, valueId in itertools.izip(state['fromIdx'],
+                state['toIdx'], state['valueIdx']):
+            self._children[fromNode].append(toNode)
+            self._parents[toNode].append(fromNode)
+            self._edges[fromNode, toNode] = valueId
+
+    def _setOldState(self, state):
+        # Graphs pickled by earlier versions, which used conary's
+        # DirectedGraph: node slots (None where deleted) and a dict of
+        # {fromIdx: {toIdx: value}}.
+        nodes = state['data'].data
+        for node in nodes:
+            if node is not None:
+                self.addNode(node)
+        for fromIdx, children in sorted(state['edges'].iteritems()):
+            for toIdx, value in sorted(children.iteritems()):
+                if nodes[fromIdx] is None or nodes[toIdx] is None:
+                    continue
+                self.addEdge(nodes[fromIdx], nodes[toIdx], value)
+
+    def _internValue(self, value):
+        try:
+            valueId = self._valueIds.get(value)
+        except TypeError:
+            # unhashable edge values are stored without sharing
+            self._values.append(value)
+            return len(self._values) - 1
+        if valueId is None:
+            valueId = self._valueIds[value] = len(self._values)
+            self._values.append(value)
+        return valueId
+
+    def getIndex(self, item):
+        return self._index[item]
+
+    def get(self, idx):
+        return self._nodes[idx]
+
+    def isEmpty(self):
+        return not self._index
+
+    def addNode(self, item):
+        idx = self._index.get(item)
+        if idx is None:
+            idx = self._index[item] = len(self._nodes)
+            self._nodes.append(item)
+            self._children.append(array.array('i'))
+            self._parents.append(array.array('i'))
+        return idx
+
+    def addEdge(self, fromItem, toItem, value=1):
+        fromNode = self.addNode(fromItem)
+        toNode = self.addNode(toItem)
+        if (fromNode, toNode) not in self._edges:
+            self._children[fromNode].append(toNode)
+            self._parents[toNode].append(fromNode)
+        self._edges[fromNode, toNode] = self._internValue(value)
+
+    def _deleteEdge(self, fromNode, toNode):
+        del self._edges[fromNode, toNode]
+        self._children[fromNode].remove(toNode)
+        self._parents[toNode].remove(fromNode)
+
+    def deleteEdges(self, item):
+        """Remove all edges leading out of C{item}."""
+        fromNode = self._index.get(item)
+        if fromNode is None:
+            return
+        for toNode in list(self._children[fromNode]):
+            self._deleteEdge(fromNode, toNode)
+
+    def delete(self, item):
+        node = self._index.pop(item, None)
+        if node is None:
+            return
+        for toNode in list(self._children[node]):
+            self._deleteEdge(node, toNode)
+        for fromNode in list(self._parents[node]):
+            self._deleteEdge(fromNode, node)
+        self._nodes[node] = None
+        self._children[node] = self._parents[node] = None
+
+    def iterChildren(self, item, withEdges=False):
+        node = self._index.get(item)
+        if node is None:
+            return
+        for toNode in self._children[node]:
+            if withEdges:
+                yield (self._nodes[toNode],
+                       self._values[self._edges[node, toNode]])
+            else:
+                yield self._nodes[toNode]
+
+    def getChildren(self, item, withEdges=False):
+        return list(self.iterChildren(item, withEdges=withEdges))
+
+    def getParents(self, item, withEdges=False):
+        node = self._index.get(item)
+        if node is None:
+            return []
+        if withEdges:
+            return [ (self._nodes[x], self._values[self._edges[x, node]])
+                     for x in self._parents[node] ]
+        return [ self._nodes[x] for x in self._parents[node] ]
+
+    def getLeaves(self):
+        return [ item for item, children in
+                 itertools.izip(self._nodes, self._children)
+                 if item is not None and not children ]
+
+    def doDFS(self, start=None):
+        """
+            Depth first search over the whole graph, beginning at C{start}
+            if given.  Returns (starts, finishes, trees) where starts and
+            finishes are indexed by node index and trees maps each root
+            index to the node indexes reached from it.
+        """
+        starts = [None] * len(self._nodes)
+        finishes = [None] * len(self._nodes)
+        trees = {}
+        roots = [ x for x in xrange(len(self._nodes))
+                  if self._nodes[x] is not None ]
+        if start is not None:
+            roots.insert(0, self._index[start])
+        time = 0
+        for root in roots:
+            if starts[root] is not None:
+                continue
+            tree = trees[root] = [root]
+            starts[root] = time
+            time += 1
+            stack = [(root, iter(self._children[root]))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if starts[child] is None:
+                        starts[child] = time
+                        time += 1
+                        tree.append(child)
+                        stack.append((child, iter(self._children[child])))
+                        break
+                else:
+                    stack.pop()
+                    finishes[node] = time
+                    time += 1
+        return starts, finishes, trees
+
+    def getStronglyConnectedComponents(self):
+        """
+            Returns a list of frozensets of nodes, one per strongly
+            connected component (Tarjan's algorithm, without recursion).
+        """
+        index = {}
+        lowLink = {}
+        onStack = set()
+        stack = []
+        components = []
+        counter = 0
+        for root in xrange(len(self._nodes)):
+            if self._nodes[root] is None or root in index:
+                continue
+            work = [(root, iter(self._children[root]))]
+            index[root] = lowLink[root] = counter
+            counter += 1
+            stack.append(root)
+            onStack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowLink[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        onStack.add(child)
+                        work.append((child, iter(self._children[child])))
+                        break
+                    elif child in onStack:
+                        lowLink[node] = min(lowLink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowLink[parent] = min(lowLink[parent], lowLink[node])
+                    if lowLink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            onStack.discard(member)
+                            component.append(self._nodes[member])
+                            if member == node:
+                                break
+                        components.append(frozenset(component))
+        return components
+
+    def getStronglyConnectedGraph(self):
+        """
+            Returns a graph whose nodes are the strongly connected components
+            of this one, with an edge wherever a member of one component
+            depends on a member of another.
+        """
+        components = self.getStronglyConnectedComponents()
+        sccGraph = self.__class__()
+        componentByNode = {}
+        for component in components:
+            sccGraph.addNode(component)
+            for item in component:
+                componentByNode[self._index[item]] = component
+        for (fromNode, toNode) in self._edges:
+            fromComp = componentByNode[fromNode]
+            toComp = componentByNode[toNode]
+            if fromComp is not toComp:
+                sccGraph.addEdge(fromComp, toComp)
+        return sccGraph
 
     def generateDotFile(self, out, filterFn=None):
         def formatNode(node):
@@ -141,8 +413,114 @@ class DependencyGraph(graph.DirectedGraph):
             else:
                 return str(value[1])
 
-        graph.DirectedGraph.generateDotFile(self, out, formatNode, formatEdge, 
-                                            filterFn)
+        out.write('digraph graphName {\n')
+        for idx, node in enumerate(self._nodes):
+            if node is None or (filterFn and not filterFn(node)):
+                continue
+            out.write('   n%s [label="%s"]\n' % (idx, formatNode(node)))
+        for (fromNode, toNode), valueId in sorted(self._edges.iteritems()):
+            fromItem, toItem = self._nodes[fromNode], self._nodes[toNode]
+            if filterFn and not (filterFn(fromItem) and filterFn(toItem)):
+                continue
+            out.write('   n%s -> n%s [label="%s"];\n' % (fromNode, toNode,
+                formatEdge(fromItem, toItem, self._values[valueId])))
+        out.write('}\n')
+
+
+class FlavorMatcher(object):
+    """
+        Memoizes the flavor arithmetic used to decide whether a providing
+        trove is likely to satisfy a build requirement.  Flavors are interned
+        so that the derived values (arch flavor, strong flavors) are computed
+        once per distinct flavor instead of once per trove/requirement pair.
+    """
+
+    def __init__(self):
+        self._flavors = {}
+        self._archFlavors = {}
+        self._reqFlavors = {}
+        self._provHasArch = {}
+        self._provFlavors = {}
+        self._strongFlavors = {}
+        self._satisfies = {}
+
+    def intern(self, flavor):
+        if flavor is None:
+            return None
+        return self._flavors.setdefault(flavor, flavor)
+
+    def getArchFlavor(self, troveFlavor, isCross):
+        key = self.intern(troveFlavor), isCross
+        archFlavor = self._archFlavors.get(key)
+        if archFlavor is None:
+            if isCross:
+                troveFlavor = flavorutil.getSysRootFlavor(troveFlavor)
+            archFlavor = self.intern(flavorutil.getBuiltFlavor(
+                flavorutil.getArchFlags(troveFlavor, getTarget=False,
+                                        withFlags=False)))
+            self._archFlavors[key] = archFlavor
+        return archFlavor
+
+    def getReqFlavor(self, archFlavor, reqFlavor):
+        key = archFlavor, self.intern(reqFlavor)
+        strongFlavor = self._reqFlavors.get(key)
+        if strongFlavor is None:
+            if reqFlavor is not None:
+                reqFlavor = deps.overrideFlavor(archFlavor, reqFlavor)
+            else:
+                reqFlavor = archFlavor
+            strongFlavor = self.intern(reqFlavor.toStrongFlavor())
+            self._reqFlavors[key] = strongFlavor
+        return strongFlavor
+
+    def getProvFlavor(self, archFlavor, provFlavor):
+        provFlavor = self.intern(provFlavor)
+        hasArch = self._provHasArch.get(provFlavor)
+        if hasArch is None:
+            hasArch = not flavorutil.getArchFlags(provFlavor).isEmpty()
+            self._provHasArch[provFlavor] = hasArch
+        if hasArch:
+            # The arch flavor only matters when the provider doesn't have one.
+            key = provFlavor, None
+        else:
+            key = provFlavor, archFlavor
+        strongFlavor = self._provFlavors.get(key)
+        if strongFlavor is None:
+            if not hasArch:
+                provFlavor = deps.overrideFlavor(archFlavor, provFlavor)
+            strongFlavor = self.intern(
+                flavorutil.getBuiltFlavor(provFlavor).toStrongFlavor())
+            self._provFlavors[key] = strongFlavor
+        return strongFlavor
+
+    def getStrongFlavor(self, flavor):
+        flavor = self.intern(flavor)
+        strongFlavor = self._strongFlavors.get(flavor)
+        if strongFlavor is None:
+            strongFlavor = self.intern(flavor.toStrongFlavor())
+            self._strongFlavors[flavor] = strongFlavor
+        return strongFlavor
+
+    def satisfies(self, provFlavor, reqFlavor):
+        key = provFlavor, reqFlavor
+        result = self._satisfies.get(key)
+        if result is None:
+            result = self._satisfies[key] = provFlavor.satisfies(reqFlavor)
+        return result
+
+    def flavorsMatch(self, troveFlavor, provFlavor, reqFlavor, isCross):
+        return self.matchProviders(troveFlavor, [provFlavor], reqFlavor,
+                                   isCross)[0]
+
+    def matchProviders(self, troveFlavor, provFlavors, reqFlavor, isCross):
+        """
+            Compare one requirement against a list of providing flavors,
+            returning a list of booleans in the same order.
+        """
+        archFlavor = self.getArchFlavor(troveFlavor, isCross)
+        reqFlavor = self.getReqFlavor(archFlavor, reqFlavor)
+        return [ self.satisfies(self.getProvFlavor(archFlavor, x), reqFlavor)
+                 for x in provFlavors ]
 
 
 class DependencyBasedBuildState(AbstractBuildState):
@@ -163,6 +541,7 @@ class DependencyBasedBuildState(AbstractBuildState):
         self.rejectedDeps = {}
         self.disallowed = set()
         self.hasPrimaryTroves = False
+        self.flavorMatcher = FlavorMatcher()
 
         AbstractBuildState.__init__(self, sourceTroves)
         self.addSourceTrovesToGraph(sourceTroves)
@@ -172,14 +551,17 @@ class DependencyBasedBuildState(AbstractBuildState):
         name, label, flavor = buildReq
         pkg = name.split(':')[0]
         providingTroves = self.trovesByPackage.get(pkg, [])
-        for provTrove in providingTroves:
+        if not providingTroves:
+            return
+        matches = self.flavorMatcher.matchProviders(trove.getFlavor(),
+                [ x.getFlavor() for x in providingTroves ], flavor, isCross)
+        for provTrove, match in itertools.izip(providingTroves, matches):
             # this trove must be built after the providing trove,
             # which means that provTrove should be a leaf first.
             if (not isCross and trove.hasTargetArch()
                 and provTrove.isCrossCompiled()):
                 self.rejectDep(trove, provTrove, isCross)
-            elif self._flavorsMatch(trove.getFlavor(), provTrove.getFlavor(),
-                                  flavor, isCross):
+            elif match:
                 # only add edges for nodes that are
                 # likely to be on a satisfying branch or flavor,
                 # otherwise we'll create unnecessary cycles.
@@ -200,22 +582,8 @@ class DependencyBasedBuildState(AbstractBuildState):
         self.depGraph.delete(duplicateTrove)
 
     def _flavorsMatch(self, troveFlavor, provFlavor, reqFlavor, isCross):
-        if isCross:
-            troveFlavor = flavorutil.getSysRootFlavor(troveFlavor)
-        archFlavor = flavorutil.getBuiltFlavor(flavorutil.getArchFlags(
-                                               troveFlavor, getTarget=False,
-                                               withFlags=False))
-        if reqFlavor is None:
-            reqFlavor = archFlavor
-        else:
-            reqFlavor = deps.overrideFlavor(archFlavor, reqFlavor)
-        if flavorutil.getArchFlags(provFlavor).isEmpty():
-            provFlavor = deps.overrideFlavor(archFlavor, provFlavor)
-
-        if flavorutil.getBuiltFlavor(provFlavor).toStrongFlavor().satisfies(
-                                                reqFlavor.toStrongFlavor()):
-            return True
-        return False
+        return self.flavorMatcher.flavorsMatch(troveFlavor, provFlavor,
+                                               reqFlavor, isCross)
 
     def addSourceTrovesToGraph(self, sourceTroves):
         sourceTroves = [ x for x in sourceTroves if not x.isFailed() ]
@@ -251,13 +619,15 @@ class DependencyBasedBuildState(AbstractBuildState):
             # loadInstalled line secondly
             for loadSpec, sourceTup in trove.iterAllLoadedSpecs():
                 name, label, flavor = loadSpec
-                providingTroves = self.trovesByPackage.get(name, [])
-                for provTrove in providingTroves:
-                    if provTrove.getVersion() != sourceTup[1]:
-                        continue
-                    elif self._flavorsMatch(trove.getFlavor(),
-                                            provTrove.getFlavor(),
-                                            flavor, False):
+                providingTroves = [ x for x in
+                                    self.trovesByPackage.get(name, [])
+                                    if x.getVersion() == sourceTup[1] ]
+                matches = self.flavorMatcher.matchProviders(trove.getFlavor(),
+                        [ x.getFlavor() for x in providingTroves ], flavor,
+                        False)
+                for provTrove, match in itertools.izip(providingTroves,
+                                                       matches):
+                    if match:
                         # FIXME: we really shouldn't allow loadInstalled
                         # loops to occur.  It means that we're building
                         # two recipes that loadInstall each other which
@@ -284,9 +654,10 @@ class DependencyBasedBuildState(AbstractBuildState):
                 for provTrove in providingTroves:
                     if provTrove.getVersion() != sourceTup[1]:
                         continue
-                    if (flavor is None or
-                        provTrove.getFlavor().toStrongFlavor().satisfies(
-                                                flavor.toStrongFlavor())):
+                    matcher = self.flavorMatcher
+                    if (flavor is None or matcher.satisfies(
+                            matcher.getStrongFlavor(provTrove.getFlavor()),
+                            matcher.getStrongFlavor(flavor))):
                         self.dependsOn(trove, provTrove,
                                         (False, (name, version, flavor)))
         for troveList in self.groupsByNameVersion.values():
@@ -327,8 +698,8 @@ class DependencyBasedBuildState(AbstractBuildState):
     def areRelated(self, trove1, trove2):
         if trove1 == trove2:
             return
-        index1 = self.depGraph.data.getIndex(trove1)
-        index2 = self.depGraph.data.getIndex(trove2)
+        index1 = self.depGraph.getIndex(trove1)
+        index2 = self.depGraph.getIndex(trove2)
         starts, finishes, trees = self.depGraph.doDFS(start=trove1)
         # this should move in to graph.py at some point.  Basically checks
         # to see if two troves are linked by seeing if you can follow a DFS
@@ -459,6 +830,8 @@ class DependencyHandler(object):
         self._possibleDuplicates = {}
         self._prebuiltBinaries = set()
         self._hasPrimaryTroves = self.depState.hasPrimaryTroves
+        # Dependency solutions shared by all resolve jobs of this build
+        self._depMemo = resolvesource.DependencySolutionMemo()
         if resolverCachePath:
             self._resolverCache = ResolverCache(resolverCachePath)
         else:
@@ -545,6 +918,11 @@ class DependencyHandler(object):
         # FIXME: this could be a much more fine-grained test if we had the
         # deps provided by the newly built troves.
         self._delayed = {}
+        # Solutions found against the old set of built troves are stale, and
+        # so are repository queries on the labels the new troves went to.
+        self._depMemo.discard('built:')
+        for label in set(x[1].trailingLabel() for x in troveList):
+            self._depMemo.discard(resolvesource.getLabelPrefix(label))
 
         if trove in self._possibleDuplicates:
             # there were troves that returned as "duplicate"
@@ -704,8 +1082,10 @@ class DependencyHandler(object):
             builtTroves = self.depState.getAllBinaries()
             crossTroves = []
 
+        depMemo = self._depMemo.subset(resolvesource.getMemoPrefixes(
+            buildTrove.cfg, buildTrove.getLabel(), builtTroves, crossTroves))
         job = ResolveJob(buildTrove, buildTrove.cfg, builtTroves, crossTroves,
-                          inCycle=inCycle)
+                          inCycle=inCycle, depMemo=depMemo)
         if self._resolverCache:
             hash = job.getJobHash()
             result = self._resolverCache.get(hash)
@@ -923,6 +1303,9 @@ class DependencyHandler(object):
 
         if trv in self.priorities:
             self.priorities.remove(trv)
+        if results.depSolutions is not None:
+            self._depMemo.update(results.depSolutions)
+            results.depSolutions = None
         if results.success:
             if self._resolverCache:
                 self._resolverCache.put(results)
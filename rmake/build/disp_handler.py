@@ -27,8 +27,11 @@ from rmake.build import buildjob
 from rmake.build import constants as buildconst
 from rmake.build import dephandler
 from rmake.build.publisher import JobStatusPublisher
+from rmake.core import constants as core_const
 from rmake.core import handler
 from rmake.core import types
+from rmake.lib import chrootcache
+from rmake.lib import logger
 
 log = logging.getLogger(__name__)
 
@@ -38,11 +41,32 @@ class BuildHandler(handler.JobHandler):
     jobType = buildconst.BUILD_JOB
     firstState = 'load_troves'
 
+    # Score bonus for workers that have a chroot cached with exactly the
+    # troves a build needs, or with the same troves at other versions.
+    exactChrootBonus = 100
+    nearChrootBonus = 10
+
     def setup(self):
         self.build_plugin = self.dispatcher.plugins.getPlugin('build')
         self.cfg = self.build_plugin.cfg
         self.dh = None
         self.build_pending = None
+        # task_uuid -> chroot affinity keys of pending build tasks
+        self.chrootKeys = {}
+        # trove -> (state, status) not yet written to build.trove_states
+        self.pendingStates = {}
+        self.flushPending = None
+
+    def scoreTask(self, task, worker):
+        result, score = handler.JobHandler.scoreTask(self, task, worker)
+        keys = self.chrootKeys.get(task.task_uuid)
+        if result == core_const.A_NOW and keys:
+            exact, near = keys
+            if exact in worker.affinity:
+                score += self.exactChrootBonus
+            elif near in worker.affinity:
+                score += self.nearChrootBonus
+        return result, score
 
     def load_troves(self):
         job = self.getData()
@@ -55,24 +79,62 @@ class BuildHandler(handler.JobHandler):
         for troveTup in job.getMainConfig().primaryTroves:
             job.getTrove(*troveTup).setPrimaryTrove()
 
-        # Start a load trove task
-        loadTroves = job.troves.values()
+        # Start load tasks, splitting large jobs so they can be loaded by
+        # several workers at once.
+        loadTroves = list(job.iterLoadableTroveList())
         self.setStatus(buildjob.JOB_STATE_LOADING,
                 'Loading %d troves' % len(loadTroves))
-        task = self.newTask('load', buildconst.LOAD_TASK, job)
-
-        d = self.waitForTask(task)
-        def cb_loaded(task):
-            if task.status.failed:
-                self.setStatus(400, task.status.text, task.status.detail)
-                return 'done'
-            return self._finish_load(task.task_data.thaw())
-        d.addCallback(cb_loaded)
-        return d
+        shards = self._split_load(loadTroves)
+        if len(shards) == 1:
+            tasks = [self.newTask('load', buildconst.LOAD_TASK, job)]
+        else:
+            tasks = []
+            for n, troveTups in enumerate(shards):
+                tasks.append(self.newTask('load %d' % n, buildconst.LOAD_TASK,
+                    job.getSubJob(troveTups)))
+
+        def cb_loaded(results):
+            if len(results) == 1:
+                return self._finish_load(results[0].task_data.getObject())
+            self._merge_load(job, [x.task_data.getObject() for x in results])
+            return self._finish_load(job)
+        return self.gatherTasks(tasks, cb_loaded)
+
+    def _split_load(self, troveTups):
+        """Split troves to be loaded into groups of no more than
+        C{loadTroveLimit} each.
+
+        Troves with the same context and label share a config and mostly the
+        same loadInstalled sources, so they are kept together where possible.
+        """
+        limit = self.cfg.loadTroveLimit
+        if not limit or len(troveTups) <= limit:
+            return [troveTups]
+        groups = {}
+        for troveTup in sorted(troveTups):
+            n, v, f, c = troveTup
+            groups.setdefault((c, v.trailingLabel()), []).append(troveTup)
+        shards = []
+        for key, group in sorted(groups.items()):
+            for n in range(0, len(group), limit):
+                shards.append(group[n:n+limit])
+        return shards
+
+    def _merge_load(self, job, subJobs):
+        """Merge the results of each load shard back into the main job.
+
+        Troves change flavor as they are loaded, so they are matched by the
+        original trove tuple that the shard was keyed on.
+        """
+        for subJob in subJobs:
+            for troveTup, loaded in subJob.troves.iteritems():
+                job.getTrove(*troveTup).troveLoaded(loaded.getLoadResult())
 
     def _finish_load(self, job):
         publisher = JobStatusPublisher()
         job.setPublisher(publisher)
+        publisher.addObserver(publisher.TROVE_STATE_UPDATED,
+                self._troveStateUpdated)
         self.buildJob = job
 
         troves = sorted(job.iterTroves())
@@ -129,6 +191,7 @@ class BuildHandler(handler.JobHandler):
 
         task = self.newTask('resolve %s' % trv.getTroveString(),
                 buildconst.RESOLVE_TASK, resolveJob)
+        self._watchTiming(task, trv, buildconst.PHASE_RESOLVE)
 
         d = self.waitForTask(task)
         def cb_done(task):
@@ -137,7 +200,7 @@ class BuildHandler(handler.JobHandler):
                         task.status.detail or '')
                 trv.troveFailed(fail)
             else:
-                trv.troveResolved(task.task_data.thaw())
+                trv.troveResolved(task.task_data.getObject())
             self.clock.callLater(0, self._do_loop)
         d.addCallback(cb_done)
         d.addErrback(self.failJob, message="Internal error resolving trove:")
@@ -155,15 +218,19 @@ class BuildHandler(handler.JobHandler):
 
         task = self.newTask('build ' + trv.getTroveString(),
                 buildconst.BUILD_TASK, job)
+        self._watchTiming(task, trv, buildconst.PHASE_BUILD)
+        self.chrootKeys[task.task_uuid] = chrootcache.getAffinityKeys(
+                buildReqs, crossReqs)
 
         d = self.waitForTask(task)
         def cb_done(task):
+            self.chrootKeys.pop(task.task_uuid, None)
             if task.status.failed:
                 fail = failure.InternalError(task.status.text,
                         task.status.detail or '')
                 trv.troveFailed(fail)
             else:
-                upd = task.task_data.thaw().trove
+                upd = task.task_data.getObject().trove
                 if upd.isFailed():
                     trv.troveFailed(upd.getFailureReason())
                 elif upd.isBuilt():
@@ -174,7 +241,58 @@ class BuildHandler(handler.JobHandler):
         d.addCallback(cb_done)
         d.addErrback(self.failJob, message="Internal error building trove:")
 
+    def _watchTiming(self, task, trv, phase):
+        """Record how long C{task} ran on its worker once it completes.
+
+        The clock starts when the task is assigned to a worker, so time spent
+        waiting in the dispatcher queue is not counted. If the task is moved
+        to another worker, only the run on the last one is counted.
+        """
+        started = []
+        def on_update(task):
+            if task.node_assigned and (not started
+                    or started[0] != task.node_assigned):
+                started[:] = [task.node_assigned, self.clock.seconds()]
+            if not (task.status.completed and started):
+                return
+            duration = self.clock.seconds() - started[1]
+            d = self.build_plugin.server.db.addTroveTiming(trv.getName(),
+                    trv.getFlavor().freeze(), task.node_assigned, phase,
+                    duration)
+            d.addErrback(logger.logFailure, "Error recording trove timing:")
+        self.watchTask(task, on_update)
+
+    def _troveStateUpdated(self, trv, state, status):
+        """Queue a trove's new state to be written to the database.
+
+        Changes made in the same pass through the reactor are written
+        together, and the frozen job is left alone until the next phase
+        boundary.
+        """
+        self.pendingStates[trv] = (state, status)
+        if self.flushPending is None:
+            self.flushPending = self.clock.callLater(0,
+                    self._flushTroveStates)
+
+    def _flushTroveStates(self):
+        if self.flushPending is not None and self.flushPending.active():
+            self.flushPending.cancel()
+        self.flushPending = None
+        if not self.pendingStates:
+            return
+        states = [(trv.getName(), trv.getVersion().freeze(),
+                    trv.getFlavor().freeze(), trv.getContext(), state,
+                    status or '')
+                for trv, (state, status) in self.pendingStates.iteritems()]
+        self.pendingStates = {}
+        d = self.build_plugin.server.db.updateTroveStates(self.job.job_uuid,
+                states)
+        d.addErrback(logger.logFailure, "Error recording trove states:")
+
     def _finish_build(self):
+        self._flushTroveStates()
+        # End of the build phase, so save the final state of every trove.
+        self.setData(self.buildJob)
         if self.dh.jobPassed():
             self.setStatus(200, "Build complete")
         else:
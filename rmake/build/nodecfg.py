@@ -47,9 +47,27 @@ class rMakeBuilderConfiguration(ConfigFile):
     helperDir         = (CfgPath, "/usr/libexec/rmake")
     slots             = (CfgInt, 1)
     useCache          = (CfgBool, False)
+    cacheMaxSize      = (CfgInt, 0,
+            "Maximum size of the changeset cache in megabytes. The least "
+            "recently used changesets are removed to stay under the limit. "
+            "0 means no limit.")
+    useLoadCache      = (CfgBool, True,
+            "Reuse the results of loading recipes whose source trove, flavor "
+            "and configuration have not changed since a previous job.")
+    loadCacheMaxSize  = (CfgInt, 256,
+            "Maximum size of the loaded recipe cache in megabytes. The least "
+            "recently used entries are removed to stay under the limit. "
+            "0 means no limit.")
     useTmpfs          = (CfgBool, False)
     chrootLimit       = (CfgInt, 4)
     chrootCache       = CfgChrootCache
+    chrootCacheMaxSize = (CfgInt, 0,
+            "Maximum total size of the chroot cache in megabytes. The least "
+            "recently used chroots are removed to stay under the limit. "
+            "0 means no limit.")
+    chrootCacheMaxEntries = (CfgInt, 0,
+            "Maximum number of chroots to keep in the chroot cache. "
+            "0 means no limit.")
     chrootCaps        = (CfgBool, False,
             "Set capability masks as directed by chroot contents. "
             "This has the potential to be unsafe.")
@@ -68,6 +86,9 @@ class rMakeBuilderConfiguration(ConfigFile):
     def getCacheDir(self):
         return self.buildDir + '/cscache'
 
+    def getLoadCacheDir(self):
+        return self.buildDir + '/loadcache'
+
     def getChrootDir(self):
         return self.buildDir + '/chroots'
 
@@ -88,15 +109,20 @@ class rMakeBuilderConfiguration(ConfigFile):
     def getChrootCache(self):
         if not self.chrootCache:
             return None
-        elif self.chrootCache[0] == 'local':
-            return chrootcache.LocalChrootCache(self.chrootCache[1])
+        limits = dict(maxSize=self.chrootCacheMaxSize * 1048576 or None,
+                maxEntries=self.chrootCacheMaxEntries or None)
+        if self.chrootCache[0] == 'local':
+            return chrootcache.LocalChrootCache(self.chrootCache[1], **limits)
+        elif self.chrootCache[0] == 'snapshot':
+            return chrootcache.SnapshotChrootCache(self.chrootCache[1],
+                    **limits)
         else:
             raise errors.RmakeError('unknown chroot cache type of "%s" specified' %self.chrootCache[0])
 
     def _getChrootCacheDir(self):
         if not self.chrootCache:
             return None
-        elif self.chrootCache[0] == 'local':
+        elif self.chrootCache[0] in ('local', 'snapshot'):
             return self.chrootCache[1]
         return None
 
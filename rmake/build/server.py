@@ -29,6 +29,7 @@ import urllib
 import xmlrpclib
 
 from conary.lib import util
+from twisted.application.internet import TimerService
 
 from rmake import errors
 from rmake.core.types import RmakeJob
@@ -38,6 +39,7 @@ from rmake.build import database
 from rmake.server import auth
 from rmake.lib.apirpc import RPCServer, expose
 from rmake.lib import logger
+from rmake.lib.logger import logFailure
 from rmake.lib.rpcproxy import ShimAddress
 
 
@@ -84,6 +86,41 @@ class BuildServer(RPCServer):
                 'conaryProxy': self.tbs_cfg.getProxyUrl() or '',
                 }
 
+    @expose
+    def getTroveStats(self, names=None, phase=None):
+        """Return historical phase durations for the given trove names.
+
+        Each result is a dictionary keyed by source_name, build_flavor,
+        worker, phase, samples, mean_duration, min_duration, max_duration,
+        last_duration and time_updated. Durations are in seconds.
+        """
+        return self.db.getTroveStats(names, phase)
+
+    @expose
+    def getTroveStates(self, job_uuid):
+        """Return the current state of each trove in a running job.
+
+        Each result is a dictionary keyed by source_name, source_version,
+        build_flavor, build_context, state, status and time_updated. Version
+        and flavor are frozen.
+        """
+        return self.db.getTroveStates(job_uuid)
+
+
+class TroveStatsAggregator(TimerService):
+    """Periodically fold raw trove timing samples into the stats table."""
+
+    def __init__(self, server, interval=60):
+        TimerService.__init__(self, interval, self.aggregate)
+        self.server = server
+
+    def aggregate(self):
+        if self.server.db is None:
+            return
+        d = self.server.db.aggregateTroveStats()
+        d.addErrback(logFailure, "Error aggregating trove statistics:")
+        return d
+
 
 class BuildServer_UNPORTED(object):
 
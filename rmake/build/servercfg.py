@@ -24,7 +24,7 @@ import urllib
 
 from conary import dbstore
 from conary.lib import log, cfg, util
-from conary.lib.cfgtypes import CfgPath, CfgString
+from conary.lib.cfgtypes import CfgBool, CfgInt, CfgPath, CfgString
 from conary.lib.cfgtypes import ParseError
 from conary.conarycfg import CfgUserInfo
 
@@ -70,6 +70,9 @@ class rMakeConfiguration(cfg.ConfigFile):
     dbPath            = dbstore.CfgDriver
     chrootServerPorts = (CfgPortRange, (63000, 64000),
             "Port range to be used for 'rmake chroot' sessions.")
+    loadTroveLimit    = (CfgInt, 200,
+            "Maximum number of troves loaded by a single load task. Larger "
+            "jobs are split into several tasks that can run in parallel.")
 
     def __init__(self, readConfigFiles = False, ignoreErrors=False):
         cfg.ConfigFile.__init__(self)
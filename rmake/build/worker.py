@@ -45,13 +45,22 @@ class LoadTask(_BuilderTask):
 
         repos = conaryclient.ConaryClient(job.getMainConfig()).getRepos()
         if self.cfg.useCache:
-           repos = repocache.CachingTroveSource(repos, self.cfg.getCacheDir())
+           repos = repocache.CachingTroveSource(repos, self.cfg.getCacheDir(),
+                   maxSize=self.cfg.cacheMaxSize * 1048576 or None)
+        repos = recipeutil.ContentsCachingSource(repos)
+
+        if self.cfg.useLoadCache:
+            loadCache = recipeutil.LoadedRecipeCache(
+                    self.cfg.getLoadCacheDir(),
+                    maxSize=self.cfg.loadCacheMaxSize * 1048576 or None)
+        else:
+            loadCache = None
 
         troves = [job.getTrove(*x) for x in job.iterLoadableTroveList()]
         if troves:
             self.sendStatus(101, "Loading troves")
             recipeutil.loadSourceTrovesForJob(job, troves, repos,
-                    job.configs[''].reposName)
+                    job.configs[''].reposName, loadCache=loadCache)
 
         # Check if any troves failed to load
         errors = []
@@ -84,7 +93,8 @@ class ResolveTask(_BuilderTask):
         client = conaryclient.ConaryClient(resolveJob.getConfig())
         repos = client.getRepos()
         if self.cfg.useCache:
-           repos = repocache.CachingTroveSource(repos, self.cfg.getCacheDir())
+           repos = repocache.CachingTroveSource(repos, self.cfg.getCacheDir(),
+                   maxSize=self.cfg.cacheMaxSize * 1048576 or None)
 
         rsv = resolver.DependencyResolver(self.log, repos)
         result = rsv.resolve(resolveJob)
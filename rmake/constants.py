@@ -0,0 +1,23 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+version          = "@version@"        # rmake version
+changeset        = "@changeset@"      # mercurial changeset id
+rmakeUser        = "@rmakeuser@"      # rmake user to run rmake server
+chrootUser       = "@chrootuser@"     # rmake user to build packages with
+chrootRmakePath  = "@chrootrmake@"    # path to rMake in the chroot (/usr/share)
+chrootServerPath = "@chrootserver@"   # path to rMake server command
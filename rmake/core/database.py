@@ -98,16 +98,22 @@ class CoreDB(object):
         d.addCallback(_grabOne, func=_oneJob)
         return d
 
-    def updateJob(self, job, frozen_handler=None):
+    def updateJob(self, job, frozen_handler=None, withData=True):
+        """Persist a job's status.
+
+        The frozen job data is only written if C{withData} is set, so callers
+        that know it has not changed can skip rewriting a potentially large
+        blob.
+        """
         stmt = SQL("""
             UPDATE jobs.jobs SET
                 status_code = %s, status_text = %s, status_detail = %s,
-                time_updated = now(), time_ticks = %s, frozen_data = %s,
-                job_priority = %s
+                time_updated = now(), time_ticks = %s, job_priority = %s
                 """, job.status.code, job.status.text, job.status.detail,
-                job.times.ticks, self._coerceBuffer(job.data),
-                job.job_priority,
+                job.times.ticks, job.job_priority,
                 )
+        if withData:
+            stmt += SQL(", frozen_data = %s", self._coerceBuffer(job.data))
         if job.status.final:
             stmt += SQL(", time_finished = now()")
         elif frozen_handler is not None:
@@ -56,7 +56,8 @@ from twisted.web.server import Site
 log = logging.getLogger(__name__)
 
 # Protocol versions of the launcher that are supported by the dispatcher
-PROTOCOL_VERSIONS = set([3])
+# 4 - heartbeat-delta messages
+PROTOCOL_VERSIONS = set([3, 4])
 
 
 class Dispatcher(deferred_service.MultiService, RPCServer):
@@ -200,10 +201,12 @@ class Dispatcher(deferred_service.MultiService, RPCServer):
 
     @expose
     def getWorkerList(self):
-        # In the future, this will return some information about each worker,
-        # but for now it's just the JID.
-        return dict((x.full(), None)
-                for x in self.bus.getNeighborList())
+        # Map each worker's JID to the statistics from its last heartbeat.
+        result = {}
+        for jid in self.bus.getNeighborList():
+            worker = self.workers.get(jid)
+            result[jid.full()] = worker and worker.stats or None
+        return result
 
     def _publish(self, job, category, data):
         if not isinstance(job, uuid.UUID):
@@ -265,8 +268,9 @@ class Dispatcher(deferred_service.MultiService, RPCServer):
             logManager.close()
         del self.jobs[job_uuid]
 
-    def updateJob(self, job, frozen_handler=None):
-        d = self.db.updateJob(job, frozen_handler=frozen_handler)
+    def updateJob(self, job, frozen_handler=None, withData=True):
+        d = self.db.updateJob(job, frozen_handler=frozen_handler,
+                withData=withData)
         @d.addCallback
         def post_update(newJob):
             if not newJob:
@@ -355,6 +359,12 @@ class Dispatcher(deferred_service.MultiService, RPCServer):
     def workerHeartbeat(self, jid, msg):
         worker = self.workers.get(jid)
         if worker is None:
+            if isinstance(msg, message.HeartbeatDelta):
+                # The worker will send a full heartbeat soon; until then
+                # there isn't enough to go on.
+                log.debug("Ignoring partial heartbeat from unknown worker %s",
+                        jid.full())
+                return
             log.info("Worker %s connected", jid.full())
             worker = self.workers[jid] = WorkerInfo(jid)
             # We need to fully initialize the worker before the worker_up hook
@@ -498,6 +508,8 @@ class WorkerInfo(object):
         self.tasks = {}
         self.slots = {}
         self.addresses = set()
+        self.affinity = frozenset()
+        self.stats = {}
         self.protocol = 0
         self.active = None
         # expiring is incremented each time WorkerChecker runs and zeroed each
@@ -506,14 +518,31 @@ class WorkerInfo(object):
         self.expiring = 0
 
     def setCaps(self, msg):
-        self.caps = types.CapabilitySet(msg.caps)
-        if isinstance(msg.slots, (int, long)):
-            self.slots = {None: msg.slots}
-        else:
-            self.slots = msg.slots
-        self.addresses = msg.addresses
-        self.expiring = 0
+        """Update the worker's state from a heartbeat.
 
+        A L{message.HeartbeatDelta} leaves alone any field that is C{None}.
+        """
+        self.expiring = 0
+        delta = isinstance(msg, message.HeartbeatDelta)
+        if msg.caps is not None:
+            self.caps = types.CapabilitySet(msg.caps)
+            self._checkVersion()
+        if msg.slots is not None:
+            if isinstance(msg.slots, (int, long)):
+                self.slots = {None: msg.slots}
+            else:
+                self.slots = msg.slots
+        if msg.addresses is not None:
+            self.addresses = msg.addresses
+        # Older workers don't send affinity keys or stats.
+        affinity = getattr(msg, 'affinity', None)
+        if affinity is not None or not delta:
+            self.affinity = frozenset(affinity or ())
+        stats = getattr(msg, 'stats', None)
+        if stats is not None or not delta:
+            self.stats = stats or {}
+
+    def _checkVersion(self):
         vcap = self.caps[types.VersionCapability]
         if vcap:
             assert len(vcap) == 1
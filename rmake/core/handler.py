@@ -57,7 +57,8 @@ def getHandlerClass(jobType):
 
 
 class JobHandler(object):
-    __slots__ = ('dispatcher', 'job', 'state', 'tasks', 'clock', 'log')
+    __slots__ = ('dispatcher', 'job', 'state', 'tasks', 'clock', 'log',
+            'savedData')
 
     jobType = None
     jobVersion = 1
@@ -71,6 +72,8 @@ class JobHandler(object):
         self.log = log
         self.state = None
         self.tasks = {}
+        # The frozen job data as of the last write to the database
+        self.savedData = None
         self.setup()
 
     ## State machine methods
@@ -99,7 +102,7 @@ class JobHandler(object):
         # Wait for the job status to be updated successfully before moving to
         # the next state.
         log.debug("Job %s changing state to %s", self.job.job_uuid, state)
-        d = self.dispatcher.updateJob(self.job)
+        d = self._updateJob()
         d.addCallback(self._runState)
         def eb_failure(reason):
             # Try to fail a job; if it suceeds then change state to 'done'
@@ -154,11 +157,27 @@ class JobHandler(object):
         log.debug("Job %s status is: %s %s", self.job.job_uuid,
                 self.job.status.code, self.job.status.text)
 
-        d = self.dispatcher.updateJob(self.job)
+        d = self._updateJob()
         d.addErrback(self.failJob, message="Error setting job status:",
                 failHard=self.job.status.failed)
         return d
 
+    def _updateJob(self):
+        """Persist the job, rewriting its frozen data only if it changed."""
+        data = self.job.data
+        withData = data is not self.savedData
+        self.savedData = data
+        d = self.dispatcher.updateJob(self.job, withData=withData)
+        if withData:
+            def check_saved(result):
+                # Superseded or failed, so write the data again next time.
+                if (result is None or isinstance(result, tw_failure.Failure)
+                        ) and self.savedData is data:
+                    self.savedData = None
+                return result
+            d.addBoth(check_saved)
+        return d
+
     def failJob(self, failure, message="Unhandled error in job handler:",
             failHard=False):
         """Log an exception and set the job status to 'failed'.
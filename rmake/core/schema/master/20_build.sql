@@ -28,3 +28,54 @@ CREATE TABLE jobs (
     job_id bigserial UNIQUE NOT NULL,
     job_name text UNIQUE
 );
+
+
+-- build.trove_timings
+-- Raw phase durations reported as tasks finish. These are periodically rolled
+-- up into build.trove_stats and then deleted.
+CREATE TABLE trove_timings (
+    timing_id bigserial PRIMARY KEY,
+    source_name text NOT NULL,
+    build_flavor text NOT NULL,
+    worker text NOT NULL,
+    phase text NOT NULL,
+    duration double precision NOT NULL,
+    time_recorded timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+-- build.trove_stats
+-- Aggregated phase durations per trove, flavor and worker. Unlike the rest of
+-- the build schema this is not tied to any particular job.
+CREATE TABLE trove_stats (
+    source_name text NOT NULL,
+    build_flavor text NOT NULL,
+    worker text NOT NULL,
+    phase text NOT NULL,
+    samples integer NOT NULL,
+    total_duration double precision NOT NULL,
+    min_duration double precision NOT NULL,
+    max_duration double precision NOT NULL,
+    last_duration double precision NOT NULL,
+    time_updated timestamp with time zone DEFAULT now() NOT NULL,
+    PRIMARY KEY ( source_name, build_flavor, worker, phase )
+);
+CREATE INDEX trove_stats_name ON trove_stats ( source_name );
+
+
+-- build.trove_states
+-- Current state of each trove in a job. Rows are written as troves change
+-- state so that the frozen job in jobs.jobs only needs to be rewritten at
+-- phase boundaries.
+CREATE TABLE trove_states (
+    job_uuid uuid NOT NULL REFERENCES jobs.jobs ON UPDATE CASCADE ON DELETE CASCADE,
+    source_name text NOT NULL,
+    source_version text NOT NULL,
+    build_flavor text NOT NULL,
+    build_context text NOT NULL,
+    state integer NOT NULL,
+    status text NOT NULL,
+    time_updated timestamp with time zone DEFAULT now() NOT NULL,
+    PRIMARY KEY ( job_uuid, source_name, source_version, build_flavor,
+        build_context )
+);
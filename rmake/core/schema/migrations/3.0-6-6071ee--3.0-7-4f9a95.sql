@@ -0,0 +1,23 @@
+CREATE TABLE build.trove_timings (
+    timing_id bigserial PRIMARY KEY,
+    source_name text NOT NULL,
+    build_flavor text NOT NULL,
+    worker text NOT NULL,
+    phase text NOT NULL,
+    duration double precision NOT NULL,
+    time_recorded timestamp with time zone DEFAULT now() NOT NULL
+);
+CREATE TABLE build.trove_stats (
+    source_name text NOT NULL,
+    build_flavor text NOT NULL,
+    worker text NOT NULL,
+    phase text NOT NULL,
+    samples integer NOT NULL,
+    total_duration double precision NOT NULL,
+    min_duration double precision NOT NULL,
+    max_duration double precision NOT NULL,
+    last_duration double precision NOT NULL,
+    time_updated timestamp with time zone DEFAULT now() NOT NULL,
+    PRIMARY KEY ( source_name, build_flavor, worker, phase )
+);
+CREATE INDEX trove_stats_name ON build.trove_stats ( source_name );
@@ -0,0 +1,12 @@
+CREATE TABLE build.trove_states (
+    job_uuid uuid NOT NULL REFERENCES jobs.jobs ON UPDATE CASCADE ON DELETE CASCADE,
+    source_name text NOT NULL,
+    source_version text NOT NULL,
+    build_flavor text NOT NULL,
+    build_context text NOT NULL,
+    state integer NOT NULL,
+    status text NOT NULL,
+    time_updated timestamp with time zone DEFAULT now() NOT NULL,
+    PRIMARY KEY ( job_uuid, source_name, source_version, build_flavor,
+        build_context )
+);
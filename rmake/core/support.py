@@ -39,7 +39,7 @@ class DispatcherBusService(BusService):
     def messageReceived(self, msg):
         if isinstance(msg, message.TaskStatus):
             self.dispatcher.updateTask(msg.task)
-        elif isinstance(msg, message.Heartbeat):
+        elif isinstance(msg, (message.Heartbeat, message.HeartbeatDelta)):
             self.dispatcher.workerHeartbeat(msg.info.sender, msg)
         elif isinstance(msg, message.LogRecords):
             self.dispatcher.workerLogging(msg.records, msg.job_uuid,
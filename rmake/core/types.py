@@ -50,6 +50,10 @@ def freezify(cls, frameCount=1):
     cls._frozenType = frozenType
     frozenType._thawedType = cls
 
+    # Replace the generic converters with ones specialized for these fields.
+    cls.freeze, frozenType.thaw = _makeConverters(cls, frozenType)
+    _thawableTypes.add(frozenType)
+
     # Frozen types are always safe to unpickle.
     module = sys._getframe(frameCount).f_globals.get('__name__', '__main__')
     frozenType.__module__ = module
@@ -58,6 +62,84 @@ def freezify(cls, frameCount=1):
     return frozenType
 
 
+# Exact types of field values that freeze() can pass through as-is, and of
+# frozen values that thaw() must convert. Checking these by type is much
+# cheaper than the isinstance() checks they stand in for.
+_immutableTypes = set([type(None)])
+_thawableTypes = set()
+
+
+def _freezeField(name, value):
+    valueType = type(value)
+    if valueType in _immutableTypes:
+        return value
+    elif isinstance(value, IMMUTABLE_TYPES):
+        _immutableTypes.add(valueType)
+        return value
+    elif isinstance(value, SlotCompare):
+        return value.freeze()
+    else:
+        raise TypeError("Can't freeze field %r of type %r as it is "
+                "not a type known to be immutable" % (name, valueType.__name__))
+
+
+_convertTemplate = """\
+def freeze(self):
+%(freezeFields)s
+    return newTuple(frozenType, (%(names)s,))
+
+def thaw(self):
+    %(names)s, = self
+%(thawFields)s
+    ret = newObject(cls)
+%(assignFields)s
+    return ret
+"""
+
+_freezeFieldTemplate = """\
+    _%(name)s = self.%(name)s
+    if type(_%(name)s) not in immutableTypes:
+        _%(name)s = freezeField(%(name)r, _%(name)s)
+"""
+
+_thawFieldTemplate = """\
+    if type(_%(name)s) in thawableTypes:
+        _%(name)s = _%(name)s.thaw()
+"""
+
+
+def _makeConverters(cls, frozenType):
+    """Generate freeze() and thaw() methods specialized for the fields of the
+    given SlotCompare subclass and its frozen type.
+
+    Field values are held in locals prefixed with an underscore, which
+    namedtuple does not allow for field names, so they can't collide with the
+    names used by the generated code.
+    """
+    freezeFields, thawFields, assignFields = [], [], []
+    for name in cls.__slots__:
+        freezeFields.append(_freezeFieldTemplate % dict(name=name))
+        thawFields.append(_thawFieldTemplate % dict(name=name))
+        assignFields.append('    ret.%s = _%s\n' % (name, name))
+    source = _convertTemplate % dict(
+            names=', '.join('_' + name for name in cls.__slots__),
+            freezeFields=''.join(freezeFields),
+            thawFields=''.join(thawFields),
+            assignFields=''.join(assignFields),
+            )
+    namespace = dict(
+            cls=cls,
+            frozenType=frozenType,
+            newObject=object.__new__,
+            newTuple=tuple.__new__,
+            immutableTypes=_immutableTypes,
+            thawableTypes=_thawableTypes,
+            freezeField=_freezeField,
+            )
+    exec source in namespace
+    return namespace['freeze'], namespace['thaw']
+
+
 class SlotCompare(object):
     """Base class for types that can be easily compared using their slots.
 
@@ -100,21 +182,10 @@ class SlotCompare(object):
         return new
 
     def freeze(self):
-        if not self._frozenType:
-            raise TypeError("Object of type %s cannot be frozen" %
-                    reflect.qual(type(self)))
-        vals = {}
-        for name in self.__slots__:
-            value = getattr(self, name)
-            if value is None or isinstance(value, IMMUTABLE_TYPES):
-                vals[name] = value
-            elif isinstance(value, SlotCompare):
-                vals[name] = value.freeze()
-            else:
-                raise TypeError("Can't freeze field %r of type %r as it is "
-                        "not a type known to be immutable" % (name,
-                            type(value).__name__))
-        return self._frozenType(**vals)
+        # freezify() replaces this with a faster version specialized for the
+        # class, so this only runs for classes that were never freezified.
+        raise TypeError("Object of type %s cannot be frozen" %
+                reflect.qual(type(self)))
 
     def thaw(self):
         return self
@@ -128,12 +199,10 @@ class _Thawable(object):
         return self
 
     def thaw(self):
-        ret = object.__new__(self._thawedType)
-        for name, value in zip(self._fields, self):
-            if isinstance(value, _Thawable):
-                value = value.thaw()
-            setattr(ret, name, value)
-        return ret
+        # freezify() replaces this with a version specialized for each frozen
+        # type, so this only runs for types that weren't made by freezify().
+        raise TypeError("Object of type %s cannot be thawed" %
+                reflect.qual(type(self)))
 
 
 def slottype(name, attrs):
@@ -277,7 +346,12 @@ class CapabilitySet(object):
 
 
 class ThawedObject(namedtuple('ThawedObject', 'object')):
-    """Encapsulated object, which can be frozen into a FrozenObject."""
+    """Encapsulated object, which can be frozen into a FrozenObject.
+
+    The frozen form is cached after the first call to L{freeze}. Handing the
+    object out through L{getObject} discards the cached form, since the caller
+    may modify the object before it is frozen again.
+    """
 
     # Thawed API
 
@@ -286,6 +360,7 @@ class ThawedObject(namedtuple('ThawedObject', 'object')):
         return cls(obj)
 
     def getObject(self):
+        self.__dict__.pop('_frozen', None)
         return self.object
 
     # Frozen API
@@ -296,16 +371,30 @@ class ThawedObject(namedtuple('ThawedObject', 'object')):
     # Translation API
 
     def freeze(self):
-        return FrozenObject.fromObject(self.object)
+        frozen = self.__dict__.get('_frozen')
+        if frozen is None:
+            frozen = self._frozen = FrozenObject.fromObject(self.object)
+        return frozen
 
     def thaw(self):
         return self
 
+    def __getstate__(self):
+        # Don't pickle the cached frozen form.
+        return None
+
 chutney.register(ThawedObject)
 
 
 class FrozenObject(namedtuple('FrozenObject', 'data')):
-    """Encapsulated pickled object."""
+    """Encapsulated pickled object.
+
+    The pickle is decoded at most once; L{getObject} returns the same object
+    each time it is called. Callers that modify the object must store it again
+    with L{fromObject}, which produces a new FrozenObject, rather than expect
+    the change to be reflected in this one. L{thaw} always returns a private
+    copy.
+    """
 
     # Thawed API
 
@@ -314,7 +403,11 @@ class FrozenObject(namedtuple('FrozenObject', 'data')):
         return cls('pickle:' + chutney.dumps(obj))
 
     def getObject(self):
-        return self._thaw()
+        try:
+            return self.__dict__['_object']
+        except KeyError:
+            obj = self._object = self._thaw()
+            return obj
 
     def _thaw(self):
         idx = self.data.index(':')
@@ -335,7 +428,14 @@ class FrozenObject(namedtuple('FrozenObject', 'data')):
         return self
 
     def thaw(self):
-        return ThawedObject(self._thaw())
+        thawed = ThawedObject(self._thaw())
+        # Freezing the copy again is free until someone modifies it.
+        thawed._frozen = self
+        return thawed
+
+    def __getstate__(self):
+        # Don't pickle the decoded object.
+        return None
 
     def __deepcopy__(self, memo=None):
         return self
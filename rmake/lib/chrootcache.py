@@ -19,20 +19,32 @@
 Cache of chroots.
 """
 
+import cPickle
 import errno
+import fcntl
 import os
+import re
 import subprocess
 import tempfile
+import time
 
 from conary.lib import sha1helper, util
+
+from rmake import errors
 sha1ToString = sha1helper.sha1ToString
 
+# linux/fs.h: clone a whole file
+FICLONE = 0x40049409
+# Errors meaning the filesystem (or the pair of them) can't clone files
+_noReflinkErrors = set([errno.EOPNOTSUPP, errno.ENOTSUP, errno.EXDEV,
+    errno.EINVAL, errno.ENOTTY, errno.ENOSYS])
+
 class ChrootCacheInterface(object):
     """
     ChrootCacheInterface defines the standard interface for a chroot
     cache.  It should never be instantiated.
     """
-    def store(self, chrootFingerprint, root):
+    def store(self, chrootFingerprint, root, affinityKeys=()):
         """
         Store the chroot currently located at C{root} in the
         filesystem using the given chroot fingerprint.
@@ -42,6 +54,9 @@ class ChrootCacheInterface(object):
         @type chrootFingerprint: str of length 20
         @param root: The location of the chroot in the filesystem
         @type root: str
+        @param affinityKeys: Keys from L{getAffinityKeys} describing the
+        troves in the chroot
+        @type affinityKeys: sequence of str
         @return: None
         """
         raise NotImplementedError
@@ -56,7 +71,8 @@ class ChrootCacheInterface(object):
         @type chrootFingerprint: str of length 20
         @param root: The location to restore the chroot in the filesystem
         @type root: str
-        @return: None
+        @return: C{True} if the chroot was restored, C{False} if it was
+        removed from the cache since L{hasChroot} was called
         """
         raise NotImplementedError
 
@@ -80,21 +96,398 @@ class ChrootCacheInterface(object):
         """
         raise NotImplementedError
 
+    def listChroots(self):
+        """
+        Return usage information about each cached chroot.
+
+        @return: list of dicts with the keys C{fingerprint} (hex string),
+            C{size} (bytes), C{created}, C{last_used} (timestamps), C{age}
+            (seconds), C{hits}, C{misses} and C{hit_rate}
+        """
+        raise NotImplementedError
+
+    def listAffinityKeys(self):
+        """
+        Return the affinity keys of all cached chroots, for advertising to
+        the dispatcher.
+
+        @return: set of str
+        """
+        raise NotImplementedError
+
+    def getStats(self):
+        """
+        Return totals for the whole cache.
+
+        @return: dict with the keys C{entries}, C{size}, C{hits}, C{misses}
+            and C{hit_rate}
+        """
+        raise NotImplementedError
+
+
+
 
-class LocalChrootCache(ChrootCacheInterface):
+class ChrootCacheIndex(object):
     """
-    The LocalChrootCache class implements a chroot cache that uses the
-    local file system to store tar archive of chroots.
+    Usage records for a chroot cache directory.
+
+    The index is a small pickle next to the cached chroots. Every
+    read-modify-write happens under an exclusive lock on a separate lock
+    file, so several workers on one host can share a cache directory.
+
+    Misses are appended to a separate file instead, so that checking for a
+    chroot never waits for the index lock. L{takeMisses} collects them.
     """
+
     def __init__(self, cacheDir):
+        self.path = os.path.join(cacheDir, 'index')
+        self.lockPath = self.path + '.lock'
+        self.missPath = self.path + '.misses'
+        self.lockFile = None
+
+    def lock(self, mode=fcntl.LOCK_EX):
+        if self.lockFile is None:
+            util.mkdirChain(os.path.dirname(self.path))
+            self.lockFile = open(self.lockPath, 'a')
+        fcntl.flock(self.lockFile.fileno(), mode)
+
+    def unlock(self):
+        if self.lockFile is not None:
+            self.lockFile.close()
+            self.lockFile = None
+
+    def read(self):
+        try:
+            return cPickle.load(open(self.path, 'rb'))
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+        except (EOFError, cPickle.UnpicklingError):
+            # A corrupt index only loses usage history.
+            pass
+        return dict(hits=0, misses=0, entries={}, pending={})
+
+    def write(self, data):
+        fd, fn = tempfile.mkstemp('.tmp', 'index.', os.path.dirname(self.path))
+        try:
+            fobj = os.fdopen(fd, 'wb')
+            cPickle.dump(data, fobj, 2)
+            fobj.close()
+            os.rename(fn, self.path)
+        finally:
+            util.removeIfExists(fn)
+
+    def recordMiss(self, hexFingerprint):
+        util.mkdirChain(os.path.dirname(self.path))
+        fobj = open(self.missPath, 'a')
+        try:
+            fcntl.flock(fobj.fileno(), fcntl.LOCK_EX)
+            fobj.write(hexFingerprint + '\n')
+        finally:
+            fobj.close()
+
+    def takeMisses(self):
+        """Return and forget the fingerprints passed to L{recordMiss}."""
+        try:
+            fobj = open(self.missPath, 'r+')
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return []
+        try:
+            fcntl.flock(fobj.fileno(), fcntl.LOCK_EX)
+            misses = fobj.read().split()
+            fobj.truncate(0)
+        finally:
+            fobj.close()
+        return misses
+
+    def update(self, func, *args):
+        """
+        Call C{func(data, *args)} with the current index contents while
+        holding the lock, then save the (modified) index.
+        """
+        self.lock()
+        try:
+            data = self.read()
+            ret = func(data, *args)
+            self.write(data)
+            return ret
+        finally:
+            self.unlock()
+
+
+class IndexedChrootCache(ChrootCacheInterface):
+    """
+    Base class for chroot caches that keep one entry per fingerprint in
+    C{cacheDir}. Tracks hits, misses and the time of the last restore of
+    each entry in a L{ChrootCacheIndex}, and evicts the least recently used
+    entries when a store pushes the cache over C{maxSize} bytes or
+    C{maxEntries} entries.
+
+    Restores pin their entry with a shared lock on a per-entry lock file
+    (striped by the first two hex digits of the fingerprint) and eviction
+    skips pinned entries, so an entry can't disappear in the middle of a
+    restore. The index itself is only locked for quick updates.
+
+    Subclasses implement C{_storeEntry}, C{_restoreEntry}, C{_removeEntry},
+    C{_entrySize} and C{_fingerPrintToPath}, and set C{_entryPattern} to
+    match the names of entries in the cache directory.
+    """
+    _entryPattern = None
+    # Misses are remembered for fingerprints that are not cached yet, so that
+    # they can be attributed to the entry once it gets stored.
+    maxPending = 1000
+
+    def __init__(self, cacheDir, maxSize=None, maxEntries=None):
         """
-        Instanciate a LocalChrootCache object
         @param cacheDir: The base directory for the chroot cache files
         @type cacheDir: str
+        @param maxSize: Maximum total size of the cache in bytes, or None
+        @type maxSize: int
+        @param maxEntries: Maximum number of cached chroots, or None
+        @type maxEntries: int
         """
         self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.maxEntries = maxEntries
+        self.index = ChrootCacheIndex(cacheDir)
+
+    def store(self, chrootFingerprint, root, affinityKeys=()):
+        self._storeEntry(chrootFingerprint, root)
+        size = self._entrySize(chrootFingerprint)
+        trash = self._update(self._recordStore,
+                sha1ToString(chrootFingerprint), size, affinityKeys)
+        self._emptyTrash(trash)
+
+    def restore(self, chrootFingerprint, root):
+        hexFingerprint = sha1ToString(chrootFingerprint)
+        pin = self._pin(hexFingerprint, fcntl.LOCK_SH)
+        try:
+            if not os.path.exists(self._fingerPrintToPath(chrootFingerprint)):
+                # Evicted since hasChroot()
+                return False
+            self._restoreEntry(chrootFingerprint, root)
+        finally:
+            pin.close()
+        self._update(self._recordHit, hexFingerprint)
+        return True
+
+    def remove(self, chrootFingerprint):
+        # Wait for restores of this entry to finish first.
+        pin = self._pin(sha1ToString(chrootFingerprint), fcntl.LOCK_EX)
+        try:
+            trash = self._update(self._forget, chrootFingerprint)
+        finally:
+            pin.close()
+        self._emptyTrash(trash)
 
-    def store(self, chrootFingerprint, root):
+    def hasChroot(self, chrootFingerprint):
+        path = self._fingerPrintToPath(chrootFingerprint)
+        if os.path.exists(path):
+            return True
+        self.index.recordMiss(sha1ToString(chrootFingerprint))
+        return False
+
+    def listChroots(self):
+        data = self._update(self._reconcile)
+        now = time.time()
+        chroots = []
+        for hexFingerprint, entry in sorted(data['entries'].items()):
+            entry = dict(entry)
+            entry['fingerprint'] = hexFingerprint
+            entry['age'] = now - entry['created']
+            entry['hit_rate'] = _hitRate(entry['hits'], entry['misses'])
+            entry.pop('affinity', None)
+            chroots.append(entry)
+        return chroots
+
+    def listAffinityKeys(self):
+        self.index.lock(fcntl.LOCK_SH)
+        try:
+            data = self.index.read()
+        finally:
+            self.index.unlock()
+        keys = set()
+        for entry in data['entries'].itervalues():
+            keys.update(entry.get('affinity', ()))
+        return keys
+
+    def getStats(self):
+        data = self._update(self._reconcile)
+        entries = data['entries'].values()
+        return dict(
+                entries=len(entries),
+                size=sum(x['size'] for x in entries),
+                hits=data['hits'],
+                misses=data['misses'],
+                hit_rate=_hitRate(data['hits'], data['misses']),
+                )
+
+    def _update(self, func, *args):
+        """Update the index with C{func}, after adding any new misses."""
+        def update(data):
+            for hexFingerprint in self.index.takeMisses():
+                self._recordMiss(data, hexFingerprint)
+            return func(data, *args)
+        return self.index.update(update)
+
+    def _pin(self, hexFingerprint, mode):
+        """
+        Lock the entry for C{hexFingerprint} and return the open lock file,
+        or C{None} if C{mode} includes C{LOCK_NB} and the lock is held.
+        """
+        lockDir = os.path.join(self.cacheDir, 'locks')
+        util.mkdirChain(lockDir)
+        lockFile = open(os.path.join(lockDir, hexFingerprint[:2]), 'a')
+        try:
+            fcntl.flock(lockFile.fileno(), mode)
+        except IOError, err:
+            lockFile.close()
+            if err.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+        return lockFile
+
+    # Index updates, called with the index locked
+
+    def _reconcile(self, data):
+        """Sync the index with the entries actually present on disk."""
+        onDisk = set()
+        if os.path.isdir(self.cacheDir):
+            for name in os.listdir(self.cacheDir):
+                match = re.match(self._entryPattern, name)
+                if match:
+                    onDisk.add(match.group(1))
+        entries = data['entries']
+        for hexFingerprint in set(entries) - onDisk:
+            del entries[hexFingerprint]
+        for hexFingerprint in onDisk - set(entries):
+            # Stored by an older rMake, or the index was lost.
+            fingerprint = sha1helper.sha1FromString(hexFingerprint)
+            path = self._fingerPrintToPath(fingerprint)
+            mtime = os.lstat(path).st_mtime
+            entries[hexFingerprint] = dict(size=self._entrySize(fingerprint),
+                    created=mtime, last_used=mtime, hits=0, misses=0)
+        return data
+
+    def _recordStore(self, data, hexFingerprint, size, affinityKeys):
+        self._reconcile(data)
+        now = time.time()
+        entries = data['entries']
+        entries[hexFingerprint] = dict(size=size, created=now, last_used=now,
+                hits=0, misses=data['pending'].pop(hexFingerprint, 0),
+                affinity=list(affinityKeys))
+        return self._evict(data, keep=hexFingerprint)
+
+    def _recordHit(self, data, hexFingerprint):
+        data['hits'] += 1
+        entry = data['entries'].get(hexFingerprint)
+        if entry:
+            entry['hits'] += 1
+            entry['last_used'] = time.time()
+
+    def _recordMiss(self, data, hexFingerprint):
+        data['misses'] += 1
+        pending = data['pending']
+        if hexFingerprint not in pending and len(pending) >= self.maxPending:
+            pending.clear()
+        pending[hexFingerprint] = pending.get(hexFingerprint, 0) + 1
+
+    def _forget(self, data, chrootFingerprint):
+        data['entries'].pop(sha1ToString(chrootFingerprint), None)
+        return [self._removeEntry(chrootFingerprint)]
+
+    def _evict(self, data, keep):
+        """
+        Remove least recently used entries until the cache is within its
+        limits, skipping entries that are being restored. Returns the paths
+        from L{_removeEntry} to delete once the index is unlocked.
+        """
+        entries = data['entries']
+        totalSize = sum(x['size'] for x in entries.itervalues())
+        byAge = sorted((x['last_used'], y) for (y, x) in entries.iteritems()
+                if y != keep)
+        trash = []
+        for _, hexFingerprint in byAge:
+            if not ((self.maxSize and totalSize > self.maxSize)
+                    or (self.maxEntries and len(entries) > self.maxEntries)):
+                break
+            pin = self._pin(hexFingerprint, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if pin is None:
+                continue
+            try:
+                trash.append(self._removeEntry(
+                    sha1helper.sha1FromString(hexFingerprint)))
+            finally:
+                pin.close()
+            totalSize -= entries.pop(hexFingerprint)['size']
+        return trash
+
+    @staticmethod
+    def _emptyTrash(trash):
+        for path in trash:
+            if path:
+                util.rmtree(path, ignore_errors=True)
+
+    # Storage backend
+
+    def _storeEntry(self, chrootFingerprint, root):
+        raise NotImplementedError
+
+    def _restoreEntry(self, chrootFingerprint, root):
+        raise NotImplementedError
+
+    def _removeEntry(self, chrootFingerprint):
+        """
+        Take an entry out of the cache. Called with the index locked, so
+        backends that need a long time to delete an entry should move it
+        aside and return a path to be deleted after the lock is released.
+        """
+        raise NotImplementedError
+
+    def _entrySize(self, chrootFingerprint):
+        raise NotImplementedError
+
+    def _fingerPrintToPath(self, chrootFingerprint):
+        raise NotImplementedError
+
+
+def getAffinityKeys(jobList, crossJobList=()):
+    """
+    Return a pair of keys describing the troves installed into a chroot by
+    the given update jobs. The first key identifies the exact set of troves;
+    the second only their names, so chroots that differ only in trove
+    versions can be recognized as near matches.
+
+    Both the dispatcher and the workers compute these so builds can be sent
+    to workers that already have a suitable chroot cached.
+    """
+    troves, names = [], []
+    for prefix, jobs in (('', jobList), ('cross:', crossJobList)):
+        for name, _, (version, flavor), _ in jobs:
+            troves.append((prefix + name, version.freeze(), flavor.freeze()))
+            names.append(prefix + name)
+    troves.sort()
+    names.sort()
+    return (sha1helper.sha1String('\0'.join('='.join(x) for x in troves)),
+            sha1helper.sha1String('\0'.join(names)))
+
+
+def _hitRate(hits, misses):
+    if not hits + misses:
+        return None
+    return hits / float(hits + misses)
+
+
+class LocalChrootCache(IndexedChrootCache):
+    """
+    The LocalChrootCache class implements a chroot cache that uses the
+    local file system to store tar archive of chroots.
+    """
+    _entryPattern = r'^([0-9a-f]{40})\.tar\.gz$'
+
+    def _storeEntry(self, chrootFingerprint, root):
         path = self._fingerPrintToPath(chrootFingerprint)
         prefix = sha1ToString(chrootFingerprint) + '.'
         util.mkdirChain(self.cacheDir)
@@ -107,12 +500,12 @@ class LocalChrootCache(ChrootCacheInterface):
         finally:
             util.removeIfExists(fn)
 
-    def restore(self, chrootFingerprint, root):
+    def _restoreEntry(self, chrootFingerprint, root):
         path = self._fingerPrintToPath(chrootFingerprint)
         subprocess.call('zcat %s | tar xSpf - -C %s' %(path, root),
                         shell=True)
 
-    def remove(self, chrootFingerprint):
+    def _removeEntry(self, chrootFingerprint):
         path = self._fingerPrintToPath(chrootFingerprint)
         try:
             os.unlink(path)
@@ -120,10 +513,131 @@ class LocalChrootCache(ChrootCacheInterface):
             if err.errno != errno.ENOENT:
                 raise
 
-    def hasChroot(self, chrootFingerprint):
-        path = self._fingerPrintToPath(chrootFingerprint)
-        return os.path.isfile(path)
+    def _entrySize(self, chrootFingerprint):
+        return os.path.getsize(self._fingerPrintToPath(chrootFingerprint))
 
     def _fingerPrintToPath(self, chrootFingerprint):
         tar = sha1ToString(chrootFingerprint) + '.tar.gz'
         return os.path.join(self.cacheDir, tar)
+
+
+class SnapshotChrootCache(IndexedChrootCache):
+    """
+    The SnapshotChrootCache class keeps each cached chroot as an unpacked
+    "golden" tree under the cache directory. Restoring a chroot clones the
+    golden tree into the build root using reflinks (copy-on-write clones)
+    where the filesystem supports them, so no decompression or per-file data
+    copying is needed. On filesystems without reflink support the tree is
+    copied with an uncompressed tar pipeline instead.
+    """
+    _entryPattern = r'^([0-9a-f]{40})$'
+
+    def __init__(self, cacheDir, maxSize=None, maxEntries=None):
+        IndexedChrootCache.__init__(self, cacheDir, maxSize, maxEntries)
+        # None until the first copy tells us whether reflinks work between
+        # the cache and the chroot filesystem.
+        self.useReflink = None
+
+    def _storeEntry(self, chrootFingerprint, root):
+        path = self._fingerPrintToPath(chrootFingerprint)
+        if os.path.isdir(path):
+            return
+        prefix = sha1ToString(chrootFingerprint) + '.'
+        util.mkdirChain(self.cacheDir)
+        tmpDir = tempfile.mkdtemp('.tmp', prefix, self.cacheDir)
+        try:
+            self._copyTree(root, tmpDir)
+            os.rename(tmpDir, path)
+        except OSError, err:
+            util.rmtree(tmpDir, ignore_errors=True)
+            if err.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            # Another worker stored the same chroot first; keep theirs.
+        except:
+            util.rmtree(tmpDir, ignore_errors=True)
+            raise
+
+    def _restoreEntry(self, chrootFingerprint, root):
+        path = self._fingerPrintToPath(chrootFingerprint)
+        util.mkdirChain(root)
+        self._copyTree(path, root)
+
+    def _removeEntry(self, chrootFingerprint):
+        path = self._fingerPrintToPath(chrootFingerprint)
+        if not os.path.isdir(path):
+            return None
+        # Move the tree aside now and delete it once the index is unlocked.
+        prefix = sha1ToString(chrootFingerprint) + '.'
+        tmpDir = tempfile.mkdtemp('.del', prefix, self.cacheDir)
+        try:
+            os.rename(path, os.path.join(tmpDir, 'root'))
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                raise
+        return tmpDir
+
+    def _entrySize(self, chrootFingerprint):
+        size = 0
+        path = self._fingerPrintToPath(chrootFingerprint)
+        for dirPath, dirNames, fileNames in os.walk(path):
+            for name in dirNames + fileNames:
+                size += os.lstat(os.path.join(dirPath, name)).st_blocks * 512
+        return size
+
+    def _fingerPrintToPath(self, chrootFingerprint):
+        return os.path.join(self.cacheDir, sha1ToString(chrootFingerprint))
+
+    def _copyTree(self, source, dest):
+        if self.useReflink is not False:
+            rc = subprocess.call(['cp', '-a', '--reflink=always',
+                source + '/.', dest], stderr=open(os.devnull, 'w'))
+            if rc == 0:
+                self.useReflink = True
+                return
+            # Only give up on reflinks if the filesystems can't do them, not
+            # because of something like running out of space.
+            if dest.startswith(os.path.join(self.cacheDir, '')):
+                other = source
+            else:
+                other = dest
+            if self._canReflink(other):
+                raise errors.RmakeError("Failed to clone chroot tree %s "
+                        "into %s" % (source, dest))
+            self.useReflink = False
+        self._tarCopy(source, dest)
+
+    def _canReflink(self, otherDir):
+        """
+        Return C{True} if files in the cache directory can be cloned into
+        C{otherDir}, or C{False} if the filesystem does not support it. Other
+        errors are raised.
+        """
+        util.mkdirChain(self.cacheDir)
+        src = tempfile.NamedTemporaryFile(dir=self.cacheDir,
+                prefix='reflink.', suffix='.tmp')
+        dest = tempfile.NamedTemporaryFile(dir=otherDir,
+                prefix='.reflink.', suffix='.tmp')
+        try:
+            src.write('x')
+            src.flush()
+            try:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+            except IOError, err:
+                if err.errno in _noReflinkErrors:
+                    return False
+                raise
+            return True
+        finally:
+            src.close()
+            dest.close()
+
+    @staticmethod
+    def _tarCopy(source, dest):
+        reader = subprocess.Popen(['tar', 'cSpf', '-', '-C', source, '.'],
+                stdout=subprocess.PIPE)
+        writer = subprocess.Popen(['tar', 'xSpf', '-', '-C', dest],
+                stdin=reader.stdout)
+        reader.stdout.close()
+        if writer.wait() or reader.wait():
+            raise errors.RmakeError("Failed to copy chroot tree %s into %s"
+                    % (source, dest))
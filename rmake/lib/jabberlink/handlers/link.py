@@ -333,6 +333,10 @@ class Neighbor(object):
             d.addErrback(logFailure)
             self.out_seq_sent += 1
 
+    def getBacklog(self):
+        """Return the number of frames queued or awaiting an ack."""
+        return self.out_seq_new - self.out_seq_ackd
+
     def _ack_received(self, dummy, seq_num):
         if seq_num != self.out_seq_ackd:
             log.warning("Ignoring out-of-sequence ACK from %s",
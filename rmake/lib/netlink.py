@@ -122,6 +122,43 @@ class RoutingNetlink(object):
         return out
 
 
+class AddressMonitor(object):
+    """Watch for interface and address changes over a netlink socket.
+
+    The socket subscribes to the kernel's link and address notifications and
+    never blocks, so L{changed} is cheap enough to call on every heartbeat.
+    """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                nsp.NETLINK_ROUTE)
+        self.sock.bind((0, nsp.RTMGRP_LINK | nsp.RTMGRP_IPV4_IFADDR
+            | nsp.RTMGRP_IPV6_IFADDR))
+        self.sock.setblocking(False)
+
+    def changed(self):
+        """Drain pending notifications and return C{True} if there were any.
+        """
+        changed = False
+        while True:
+            try:
+                data = self.sock.recv(1000000)
+            except socket.error, err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return changed
+                elif err.errno == errno.ENOBUFS:
+                    # Notifications were dropped, so assume the worst.
+                    changed = True
+                    continue
+                raise
+            if not data:
+                return changed
+            changed = True
+
+    def close(self):
+        self.sock.close()
+
+
 def main():
     rtnl = RoutingNetlink()
     for family, address, prefix in sorted(rtnl.getAllAddresses()):
@@ -29,6 +29,11 @@ STRUCT_NLMSGHDR = 'IHHII'
 
 NETLINK_ROUTE           = 0
 
+# Multicast groups for NETLINK_ROUTE notifications
+RTMGRP_LINK             = 0x001
+RTMGRP_IPV4_IFADDR      = 0x010
+RTMGRP_IPV6_IFADDR      = 0x100
+
 # Core message types
 NLMSG_NOOP, NLMSG_ERROR, NLMSG_DONE, NLMSG_OVERRUN = range(1, 5)
 
@@ -32,6 +32,55 @@ def getStructSize(char):
 
 LENGTH_STRUCT = 'L'
 
+
+def frame(text):
+    """Prefix C{text} with its length, as read by L{PipeReader}."""
+    return struct.pack(LENGTH_STRUCT, len(text)) + text
+
+
+class FrameDecoder(object):
+    """
+    Incrementally split a stream of bytes into the length-prefixed frames
+    written by L{PipeWriter}, for readers that are handed data as it arrives
+    rather than reading it themselves.
+    """
+
+    def __init__(self):
+        self.sizeLength = getStructSize(LENGTH_STRUCT)
+        self.chunks = []
+        self.buffered = 0
+        self.length = None
+
+    def feed(self, data):
+        """Add C{data} to the stream and return a list of completed frames."""
+        self.chunks.append(data)
+        self.buffered += len(data)
+        frames = []
+        while True:
+            if self.length is None:
+                if self.buffered < self.sizeLength:
+                    break
+                buf = ''.join(self.chunks)
+                self.length = struct.unpack(LENGTH_STRUCT,
+                        buf[:self.sizeLength])[0]
+                self._setBuffer(buf[self.sizeLength:])
+            if self.buffered < self.length:
+                break
+            buf = ''.join(self.chunks)
+            frames.append(buf[:self.length])
+            self.length = None
+            self._setBuffer(buf[len(frames[-1]):])
+        return frames
+
+    def _setBuffer(self, buf):
+        self.chunks = buf and [buf] or []
+        self.buffered = len(buf)
+
+    def hasPartialFrame(self):
+        """Return True if the stream stopped in the middle of a frame."""
+        return self.length is not None or self.buffered > 0
+
+
 class PipeReader(object):
     def __init__(self, fd):
         self.fd = fd
@@ -134,9 +183,7 @@ class PipeWriter(object):
         return self.fd
 
     def send(self, text):
-        length = len(text)
-        length = struct.pack(LENGTH_STRUCT, length)
-        self.buf.extend((length + text))
+        self.buf.append(frame(text))
 
     def handle_write(self):
         if self.buf:
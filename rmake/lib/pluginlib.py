@@ -58,6 +58,9 @@ class Plugin(object):
             cfg.configLine(line)
         return cfg
 
+    def configFromOptions(self, cfgClass):
+        return self.populateConfigFromOptions(cfgClass())
+
 
 class PluginManager(object):
     """
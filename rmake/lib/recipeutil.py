@@ -16,10 +16,13 @@
 
 
 import copy
+import cPickle
+import errno
 import itertools
 import os
 import tempfile
 import traceback
+from StringIO import StringIO
 
 #conary
 from conary.build import cook,loadrecipe,lookaside,recipe,use
@@ -28,7 +31,9 @@ from conary import conarycfg
 from conary import conaryclient
 from conary.deps import deps
 from conary.lib import log,util
+from conary.lib import sha1helper
 from conary.deps.deps import Flavor
+from conary.repository import filecontents
 from conary.repository import trovesource
 
 #rmake
@@ -256,16 +261,44 @@ def _getLoadedSpecs(loader, recipeObj):
 def loadSourceTroves(job, repos, buildFlavor, troveList,
                      loadInstalledSource=None, installLabelPath=None,
                      groupRecipeSource=None, internalHostName=None, 
-                     total=0, count=0):
+                     total=0, count=0, loadCache=None,
+                     loadInstalledTroves=None):
     """
     Load the source troves associated with a set of build troves
     C{troveList}. Returns a mapping of C{(name, version, flavor,
     context)} to L{LoadTroveResult<rmake.build.buildtrove.LoadTroveResult>}
     indicating information loaded from the source such as packages
     and build requirements.
+
+    If C{loadCache} is given, troves that were loaded previously with the
+    same inputs are filled in from the cache and their recipes are not
+    executed. C{loadInstalledTroves} lists the job troves that
+    C{loadInstalledSource} can find; a cached result is only used if the
+    job troves its recipe loaded are still in the job at the same version.
     """
     if not total:
         total = len(troveList)
+    if loadCache:
+        cacheKeys = {}
+        needed = []
+        for buildTrove in troveList:
+            key = loadCache.getKey(buildTrove, buildFlavor, installLabelPath,
+                    job.getTroveConfig(buildTrove),
+                    internalHostName=internalHostName)
+            result = loadCache.get(repos, key,
+                    loadInstalledTroves=loadInstalledTroves)
+            if result is None:
+                cacheKeys[buildTrove] = key
+                needed.append(buildTrove)
+            else:
+                buildTrove.troveLoaded(result)
+        if len(needed) < len(troveList):
+            job.log('Loaded %s recipes from cache' % (
+                len(troveList) - len(needed)))
+        count += len(troveList) - len(needed)
+        troveList = needed
+        if not troveList:
+            return
     job.log('Downloading %s recipes...' % len(troveList))
     troveList = list(sorted(troveList, key=lambda x: x.getName()))
     troves = getRecipes(repos, [x.getNameVersionFlavor() for x in troveList])
@@ -303,6 +336,9 @@ def loadSourceTroves(job, repos, buildFlavor, troveList,
                 getattr(recipeObj, 'buildRequires', [])))
             buildTrove.setCrossRequirements(set(
                 getattr(recipeObj, 'crossRequires', [])))
+            if loadCache:
+                loadCache.put(cacheKeys[buildTrove],
+                        buildTrove.getLoadResult())
 
         except Exception, err:
             if isinstance(err, errors.RmakeError):
@@ -314,7 +350,8 @@ def loadSourceTroves(job, repos, buildFlavor, troveList,
             buildTrove.troveFailed(fail)
 
 
-def loadSourceTrovesForJob(job, troveList=None, repos=None, reposName=None):
+def loadSourceTrovesForJob(job, troveList=None, repos=None, reposName=None,
+        loadCache=None):
     cfg = job.getMainConfig()
     if repos:
         cacheDir = None
@@ -335,16 +372,18 @@ def loadSourceTrovesForJob(job, troveList=None, repos=None, reposName=None):
         if reposName is None:
             reposName = cfg.reposName
 
-        tupList = sorted(x.getNameVersionFlavor() for x in troveList)
-
         # create fake "packages" for all the troves we're building so that
-        # they can be found for loadInstalled.
+        # they can be found for loadInstalled. That includes troves in the
+        # rest of the job when only part of it is being loaded here.
+        tupList = sorted(set(job.getLoadInstalledTroveList()) | set(
+            x.getNameVersionFlavor() for x in troveList))
         if not cfg.isolateTroves:
             buildTrovePackages = [ (x[0].split(':')[0], x[1], x[2])
                 for x in tupList ]
             buildTroveSource = RemoveHostSource(trovesource.SimpleTroveSource(
                 buildTrovePackages), reposName)
         else:
+            buildTrovePackages = None
             buildTroveSource = None
 
         # don't search the internal repository explicitly for loadRecipe
@@ -385,12 +424,140 @@ def loadSourceTrovesForJob(job, troveList=None, repos=None, reposName=None):
                 buildCfg.buildFlavor, contextTroves, total=total, count=count,
                 loadInstalledSource=loadInstalledSource,
                 installLabelPath=buildCfg.installLabelPath,
-                internalHostName=reposName)
+                internalHostName=reposName, loadCache=loadCache,
+                loadInstalledTroves=buildTrovePackages)
             count += len(contextTroves)
     finally:
         if cacheDir:
             util.rmtree(cacheDir)
 
+class LoadedRecipeCache(object):
+    """
+        Persistent cache of the information loaded from recipes.
+
+        Entries are keyed on the source trove, the requested flavor and the
+        build configuration. Recipes that load other troves, such as
+        superclasses or loadInstalled targets, are only reused while each of
+        those troves would still be found: a trove taken from the job must
+        still be in the current job at the same version, and any other
+        trove must still be the latest version on its branch.
+
+        The cache is shared by all workers on a node and the least recently
+        used entries are removed once it grows past C{maxSize} bytes.
+    """
+    cacheVersion = 3
+
+    def __init__(self, cacheDir, maxSize=None):
+        util.mkdirChain(cacheDir)
+        self.store = repocache.IndexedDataStore(cacheDir, maxSize=maxSize)
+
+    def getKey(self, buildTrove, buildFlavor, installLabelPath, cfg,
+            internalHostName=None):
+        n, v, f = buildTrove.getNameVersionFlavor()
+        parts = [str(self.cacheVersion), n, v.freeze(), f.freeze()]
+        if buildFlavor is not None:
+            parts.append(buildFlavor.freeze())
+        else:
+            parts.append('')
+        parts.append(' '.join(x.asString() for x in installLabelPath or ()))
+        # The build label depends on whether the source is on the internal
+        # repository.
+        parts.append(internalHostName or '')
+        # Recipes get a copy of the whole conary config.
+        out = StringIO()
+        cfg.storeConaryCfg(out)
+        parts.append(out.getvalue())
+        parts.append(cfg.getMacros())
+        for troveTups in cfg.resolveTroveTups:
+            parts.append(' '.join(sorted('%s=%s[%s]' % (x[0], x[1].freeze(),
+                x[2].freeze()) for x in troveTups)))
+        parts.append(str(bool(cfg.isolateTroves)))
+        digest = sha1helper.sha1String('\0'.join(parts))
+        return sha1helper.sha1ToString(digest)
+
+    def get(self, repos, key, loadInstalledTroves=None):
+        """Return the cached result for C{key}, or C{None} if there is no
+        entry or the entry is out of date.
+
+        C{loadInstalledTroves} lists the job troves that loadInstalled can
+        find when loading the recipe now.
+        """
+        result = self._get(repos, key, loadInstalledTroves)
+        if result is None:
+            self.store.index.recordMisses(1)
+        else:
+            self.store.index.recordHits([key])
+        return result
+
+    def _get(self, repos, key, loadInstalledTroves):
+        if not self.store.hasFile(key):
+            return None
+        try:
+            result = cPickle.loads(self.store.openFile(key).read())
+        except (IOError, OSError), err:
+            # Evicted by another worker since the check above
+            if err.errno != errno.ENOENT:
+                raise
+            return None
+        except (EOFError, ValueError, ImportError, AttributeError,
+                cPickle.UnpicklingError):
+            log.warning('Discarding unreadable loaded recipe cache entry %s'
+                    % key)
+            return None
+        if not isinstance(result, buildtrove.LoadTroveResult):
+            log.warning('Discarding unreadable loaded recipe cache entry %s'
+                    % key)
+            return None
+        repoTroves = self._checkJobTroves(result.loadedTroves,
+                loadInstalledTroves)
+        if repoTroves is None:
+            return None
+        if repoTroves and not self._isCurrent(repos, repoTroves):
+            return None
+        return result
+
+    def put(self, key, result):
+        self.store.addFile(StringIO(cPickle.dumps(result, 2)), key,
+                integrityCheck=False)
+
+    @staticmethod
+    def _checkJobTroves(loadedTroves, loadInstalledTroves):
+        """Match the troves a recipe loaded against the current job.
+
+        Returns the loaded troves that did not come from the job, which must
+        be checked against the repository, or C{None} if the job now has a
+        different version of one of them.
+        """
+        jobTroves = set((x[0].split(':')[0], x[1])
+                for x in loadInstalledTroves or ())
+        jobNames = set(x[0] for x in jobTroves)
+        repoTroves = []
+        for n, v, f in loadedTroves or ():
+            name = n.split(':')[0]
+            if (name, v) in jobTroves:
+                continue
+            if name in jobNames:
+                return None
+            repoTroves.append((n, v, f))
+        return repoTroves
+
+    @staticmethod
+    def _isCurrent(repos, troveTups):
+        query = {}
+        for n, v, f in troveTups:
+            query.setdefault(n, {})[v.branch()] = None
+        try:
+            leaves = repos.getTroveLeavesByBranch(query)
+        except Exception:
+            log.warning('Could not check loaded troves for recipe cache:\n%s'
+                    % traceback.format_exc())
+            return False
+        for n, v, f in troveTups:
+            if v not in leaves.get(n, {}):
+                return False
+        return True
+
+
 class RemoveHostRepos(object):
     def __init__(self, troveSource, host):
         self.troveSource = troveSource
@@ -446,6 +613,63 @@ class CachingSource(object):
     def findTrove(self, labelPath, troveTup, *args, **kw):
         return self.findTroves(labelPath, [troveTup], *args, **kw)[troveTup]
 
+class ContentsCachingSource(object):
+    """
+        Trovesource that keeps the contents of small files, such as recipes,
+        in memory.
+
+        The cache is shared by all instances in the process so that a worker
+        loading several jobs or job shards in a row only downloads each recipe
+        once.
+    """
+    maxFiles = 5000
+    maxFileSize = 256 * 1024
+
+    _contents = {}
+    _order = []
+
+    def __init__(self, troveSource):
+        self.troveSource = troveSource
+
+    def __getattr__(self, key):
+        return getattr(self.troveSource, key)
+
+    def getFileContents(self, fileList, callback=None, compressed=False,
+            **kwargs):
+        # Compressed and uncompressed contents are cached separately.
+        keys = [tuple(item[0:2]) + (compressed,) for item in fileList]
+        results = [None] * len(fileList)
+        needed = []
+        for idx, key in enumerate(keys):
+            data = self._contents.get(key)
+            if data is None:
+                needed.append(idx)
+            else:
+                results[idx] = filecontents.FromString(data)
+        if not needed:
+            return results
+
+        if compressed:
+            # Only pass this on when set, as not every trove source takes it.
+            kwargs['compressed'] = compressed
+        newContents = self.troveSource.getFileContents(
+                [fileList[x] for x in needed], callback=callback, **kwargs)
+        for idx, content in itertools.izip(needed, newContents):
+            data = content.get().read()
+            if len(data) <= self.maxFileSize:
+                self._store(keys[idx], data)
+            results[idx] = filecontents.FromString(data)
+        return results
+
+    @classmethod
+    def _store(cls, key, data):
+        if key not in cls._contents:
+            cls._order.append(key)
+        cls._contents[key] = data
+        while len(cls._order) > cls.maxFiles:
+            del cls._contents[cls._order.pop(0)]
+
+
 class RemoveHostSource(trovesource.SearchableTroveSource):
     def __init__(self, troveSource, host):
         self.troveSource = troveSource
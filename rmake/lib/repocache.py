@@ -19,9 +19,16 @@
 Cache of changesets.
 """
 from StringIO import StringIO
+import errno
+import fcntl
 import os
 import itertools
+import Queue
+import sqlite3
+import sys
 import tempfile
+import threading
+import time
 
 from conary import trove
 
@@ -34,12 +41,19 @@ from conary.repository import errors
 from conary.repository import filecontents
 
 
+# Changeset hashes being downloaded by some thread in this process
+_inFlight = {}
+_inFlightLock = threading.Lock()
+
+
 class CachingTroveSource:
-    def __init__(self, troveSource, cacheDir, readOnly=False, depsOnly=False):
+    def __init__(self, troveSource, cacheDir, readOnly=False, depsOnly=False,
+            maxSize=None):
         self._troveSource = troveSource
         util.mkdirChain(cacheDir)
         self._depsOnly = depsOnly
-        self._cache = RepositoryCache(cacheDir, readOnly=readOnly)
+        self._cache = RepositoryCache(cacheDir, readOnly=readOnly,
+                maxSize=maxSize)
 
     def __getattr__(self, key):
         return getattr(self._troveSource, key)
@@ -92,9 +106,16 @@ class RepositoryCache(object):
         We cache changeset files by component.  When conary is fixed, we'll
         be able to combine the download of these troves.
     """
-    def __init__(self, cacheDir, readOnly=False, depsOnly=False):
+    # Number of changesets downloaded at once when filling the cache
+    downloadThreads = 4
+
+    def __init__(self, cacheDir, readOnly=False, depsOnly=False,
+            maxSize=None):
         self.root = cacheDir
-        self.store = DataStore(cacheDir)
+        if readOnly:
+            self.store = DataStore(cacheDir)
+        else:
+            self.store = IndexedDataStore(cacheDir, maxSize=maxSize)
         self.readOnly = readOnly
         self.depsOnly = depsOnly
         self.fileCache = LazyFileCache(100)
@@ -133,24 +154,71 @@ class RepositoryCache(object):
 
     def getTroves(self, repos, troveList, withFiles=True,
                   withFileContents=False, callback=None):
-        csList = self.getChangeSetsForTroves(repos, troveList, withFiles,
-                                             withFileContents, callback)
+        if withFiles or self.readOnly:
+            troveCsList = self._getTroveChangeSets(repos, troveList,
+                    withFiles, withFileContents, callback)
+        else:
+            troveCsList = self._getIndexedTroveChangeSets(repos, troveList,
+                    withFileContents, callback)
         l = []
-        for cs, info in itertools.izip(csList, troveList):
-            if cs is None:
+        for troveCs in troveCsList:
+            if troveCs is None:
                 l.append(None)
                 continue
-            troveCs = cs.getNewTroveVersion(*info)
             # trove integrity checks don't work when file information is
             # excluded
             t = trove.Trove(troveCs, skipIntegrityChecks = not withFiles)
             l.append(t)
         return l
 
+    def _getTroveChangeSets(self, repos, troveList, withFiles,
+            withFileContents, callback):
+        csList = self.getChangeSetsForTroves(repos, troveList, withFiles,
+                                             withFileContents, callback)
+        l = []
+        for cs, info in itertools.izip(csList, troveList):
+            if cs is None:
+                l.append(None)
+            else:
+                l.append(cs.getNewTroveVersion(*info))
+        return l
+
+    def _getIndexedTroveChangeSets(self, repos, troveList, withFileContents,
+            callback):
+        """
+        Look up troves without file information, which is what dependency
+        resolution asks for, in the cache index first so that no changeset
+        files need to be opened.
+        """
+        hashes = [str(self.hashTrove(n, v, f, False, withFileContents))
+                for (n, v, f) in troveList]
+        frozen = self.store.index.getTroves(hashes)
+        l = [None] * len(troveList)
+        missing = []
+        for idx, csHash in enumerate(hashes):
+            if csHash in frozen:
+                l[idx] = trove.ThawTroveChangeSet(frozen[csHash])
+            else:
+                missing.append(idx)
+        if frozen:
+            self._recordHits(frozen.keys())
+        if missing:
+            found = self._getTroveChangeSets(repos,
+                    [troveList[x] for x in missing], False, withFileContents,
+                    callback)
+            new = []
+            for idx, troveCs in itertools.izip(missing, found):
+                l[idx] = troveCs
+                if troveCs is not None:
+                    new.append((hashes[idx], troveCs.freeze()))
+            self.store.index.addTroves(new)
+        return l
+
     def resolveDependenciesByGroups(self, repos, groupTroves, depList):
         allToFind = []
         allFound = []
         allMissing = []
+        hits = []
         for depSet in depList:
             d = {}
             toFind = deps.DependencySet()
@@ -166,10 +234,13 @@ class RepositoryCache(object):
                     outFile = self.store.openFile(depHash)
                     results = DependencyResultList(outFile.read()).get()
                     found.append(results)
+                    hits.append(depHash)
                 else:
                     toFind.addDep(depClass, dependency)
                     found.append(None)
                     missingIdx.append((idx, depHash))
+        if hits:
+            self._recordHits(hits)
         if [ x for x in allToFind if x]:
             allResults = repos.resolveDependenciesByGroups(groupTroves,
                                                            allToFind)
@@ -180,6 +251,7 @@ class RepositoryCache(object):
                     continue
                 iter = itertools.izip(missingIdx, toFind.iterDeps(sort=True), 
                                       allResults[toFind])
+                self._recordMisses(len(missingIdx))
                 for (idx, depHash), (depClass, dependency), resultList in iter:
                     found[idx] = resultList
                     if self.readOnly:
@@ -196,6 +268,8 @@ class RepositoryCache(object):
         return allResults
 
     def hasTroves(self, repos, troveList):
+        if not self.readOnly:
+            return self._hasIndexedTroves(repos, troveList)
         results = {}
         needed = []
         for troveTup in troveList:
@@ -217,8 +291,30 @@ class RepositoryCache(object):
         results.update(hasTroves)
         return results
 
+    def _hasIndexedTroves(self, repos, troveList):
+        hashes = {}
+        for troveTup in troveList:
+            n, v, f = troveTup
+            for withFiles in (False, True):
+                csHash = str(self.hashTrove(n, v, f, withFiles=withFiles,
+                                            withFileContents=False))
+                hashes[csHash] = troveTup
+        present = self.store.index.hasEntries(hashes.keys())
+        results = dict((hashes[x], True) for x in present)
+        needed = [x for x in troveList if x not in results]
+        if needed:
+            results.update(repos.hasTroves(needed))
+        return results
+
     def getChangeSets(self, repos, jobList, withFiles=True,
-                      withFileContents=True, callback=None):
+                      withFileContents=True, callback=None,
+                      reposFactory=None):
+        """
+        Return changesets for the install jobs in C{jobList}, downloading
+        the ones that aren't cached yet. If C{reposFactory} is given, it is
+        called for a separate repository client for each download thread;
+        otherwise downloads run one at a time through C{repos}.
+        """
         for job in jobList:
             if job[1][0]:
                 raise CacheError('can only cache install,'
@@ -228,51 +324,172 @@ class RepositoryCache(object):
 
         changesets = [None for x in jobList]
         needed = []
+        hits = []
         for idx, job in enumerate(jobList):
             csHash = str(self.hashTrove(job[0], job[2][0], job[2][1],
                                         withFiles, withFileContents))
             if self.store.hasFile(csHash):
-                outFile = self.fileCache.open(self.store.hashToPath(csHash))
-                #outFile = self.store.openRawFile(csHash)
-                changesets[idx] = changeset.ChangeSetFromFile(outFile)
+                changesets[idx] = self._openChangeSet(csHash)
+                hits.append(csHash)
             else:
                 needed.append((job, csHash, idx))
+        self._recordHits(hits)
+
+        if self.readOnly:
+            total = len(needed)
+            for idx, (job, csHash, csIndex) in enumerate(needed):
+                if callback:
+                    callback.setChangesetHunk(idx + 1, total)
+                changesets[csIndex] = repos.createChangeSet([job],
+                        recurse=False, callback=callback, withFiles=withFiles,
+                        withFileContents=withFileContents)
+            return changesets
+
+        self._fetchChangeSets(repos, needed, withFiles, withFileContents,
+                callback, reposFactory)
+        for job, csHash, csIndex in needed:
+            changesets[csIndex] = self._openChangeSet(csHash)
+        return changesets
 
+    def _recordHits(self, hashes):
+        if hashes and not self.readOnly:
+            self.store.index.recordHits(hashes)
 
-        total = len(needed)
-        for idx, (job, csHash, csIndex) in enumerate(needed):
-            if callback:
-                callback.setChangesetHunk(idx + 1, total)
+    def _recordMisses(self, count):
+        if count and not self.readOnly:
+            self.store.index.recordMisses(count)
 
-            cs = repos.createChangeSet([job], recurse=False,
-                                       callback=callback, withFiles=withFiles,
-                                       withFileContents=withFileContents)
-            if self.readOnly:
-                changesets[csIndex] = cs
-                continue
+    def _openChangeSet(self, csHash):
+        outFile = self.fileCache.open(self.store.hashToPath(csHash))
+        #outFile = self.store.openRawFile(csHash)
+        return changeset.ChangeSetFromFile(outFile)
 
-            hashPath = self.store.hashToPath(csHash)
-            self.store.makeDir(hashPath)
-            dirPath = os.path.dirname(hashPath)
-            fileName = os.path.basename(hashPath)
-            tmpFd, tmpName = tempfile.mkstemp(prefix=fileName, dir=dirPath)
-            os.close(tmpFd)
-            cs.writeToFile(tmpName)
-            del cs
-            # we could use this changeset, but 
-            # cs.reset() is not necessarily reliable,
-            # so instead we re-read from disk
-            self.store.addFileFromTemp(csHash, tmpName)
+    def _fetchChangeSets(self, repos, needed, withFiles, withFileContents,
+            callback, reposFactory=None):
+        """
+        Download the changesets for C{needed} into the store, running up to
+        C{downloadThreads} downloads at once so that round trips to the
+        repository overlap.
 
-            outFile = self.fileCache.open(self.store.hashToPath(csHash))
-            #outFile = self.store.openRawFile(csHash)
-            changesets[csIndex] = changeset.ChangeSetFromFile(outFile)
+        Repository clients aren't thread safe, so each thread gets its own
+        client from C{reposFactory}. Without one, only C{repos} is used and
+        downloads don't overlap.
+        """
+        if not needed:
+            return
+        if reposFactory:
+            clients = [reposFactory()
+                    for x in range(min(self.downloadThreads, len(needed)))]
+        else:
+            clients = [repos]
+        pending = list(needed)
+        pendingLock = threading.Lock()
+        done = Queue.Queue()
+
+        def worker(repos):
+            while True:
+                pendingLock.acquire()
+                try:
+                    if not pending:
+                        return
+                    job, csHash, _ = pending.pop(0)
+                finally:
+                    pendingLock.release()
+                try:
+                    self._fetchChangeSet(repos, job, csHash, withFiles,
+                            withFileContents)
+                except:
+                    done.put(sys.exc_info())
+                else:
+                    done.put(None)
 
-        return changesets
+        threads = []
+        for client in clients:
+            thread = threading.Thread(target=worker, args=(client,))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+
+        error = None
+        total = len(needed)
+        for idx in range(total):
+            result = done.get()
+            if result is not None and error is None:
+                error = result
+                # Let the running downloads finish, but don't start more.
+                pendingLock.acquire()
+                del pending[:]
+                pendingLock.release()
+            if callback:
+                callback.setChangesetHunk(idx + 1, total)
+            if error:
+                break
+        for thread in threads:
+            thread.join()
+        if error:
+            raise error[0], error[1], error[2]
+
+    def _fetchChangeSet(self, repos, job, csHash, withFiles,
+            withFileContents):
+        # Only one thread in this process downloads a given changeset; any
+        # others wait for it to land in the store.
+        _inFlightLock.acquire()
+        try:
+            event = _inFlight.get(csHash)
+            owner = event is None
+            if owner:
+                event = _inFlight[csHash] = threading.Event()
+        finally:
+            _inFlightLock.release()
+        if not owner:
+            event.wait()
+            if self.store.hasFile(csHash):
+                return
+        try:
+            # Other processes sharing the cache take the same lock.
+            lock = self.store.lockHash(csHash)
+            try:
+                if not self.store.hasFile(csHash):
+                    self._downloadChangeSet(repos, job, csHash, withFiles,
+                            withFileContents)
+            finally:
+                lock.close()
+        finally:
+            if owner:
+                _inFlightLock.acquire()
+                del _inFlight[csHash]
+                _inFlightLock.release()
+                event.set()
+
+    def _downloadChangeSet(self, repos, job, csHash, withFiles,
+            withFileContents):
+        hashPath = self.store.hashToPath(csHash)
+        self.store.makeDir(hashPath)
+        dirPath = os.path.dirname(hashPath)
+        fileName = os.path.basename(hashPath)
+        tmpFd, tmpName = tempfile.mkstemp(prefix=fileName, dir=dirPath)
+        os.close(tmpFd)
+        try:
+            if (withFiles and withFileContents
+                    and hasattr(repos, 'createChangeSetFile')):
+                # Stream straight to disk instead of assembling the
+                # changeset in memory first.
+                repos.createChangeSetFile([job], tmpName, recurse=False)
+            else:
+                cs = repos.createChangeSet([job], recurse=False,
+                        withFiles=withFiles,
+                        withFileContents=withFileContents)
+                cs.writeToFile(tmpName)
+                del cs
+            self.store.addFileFromTemp(csHash, tmpName)
+            self._recordMisses(1)
+        finally:
+            util.removeIfExists(tmpName)
 
     def getFileContents(self, repos, fileList, callback=None):
         contents = []
         needed = []
+        hits = []
         for idx, item in enumerate(fileList):
             fileId, fileVersion = item[0:2]
 
@@ -281,10 +498,14 @@ class RepositoryCache(object):
                 f = self.store.openFile(fileHash)
                 content = filecontents.FromFile(f)
                 contents.append(content)
+                hits.append(fileHash)
             else:
                 contents.append(None)
                 needed.append((idx, (fileId, fileVersion), fileHash))
 
+        self._recordHits(hits)
+        self._recordMisses(len(needed))
+
         total = len(needed)
         newContents = repos.getFileContents([x[1] for x in needed],
                                             callback=callback)
@@ -318,6 +539,256 @@ class DataStore(datastore.DataStore):
         assert(os.path.dirname(path) == os.path.dirname(tmpPath))
         os.rename(tmpPath, path)
 
+
+class IndexedDataStore(DataStore):
+    """
+    DataStore shared by several processes, which records every file in a
+    L{CacheIndex} so the least recently used files can be evicted when the
+    store grows past C{maxSize} bytes.
+    """
+    def __init__(self, topPath, maxSize=None):
+        DataStore.__init__(self, topPath)
+        self.root = topPath
+        self.index = CacheIndex(topPath, maxSize=maxSize)
+
+    def addFile(self, f, hash, *args, **kwargs):
+        DataStore.addFile(self, f, hash, *args, **kwargs)
+        self._added(hash)
+
+    def addFileFromTemp(self, hash, tmpPath):
+        DataStore.addFileFromTemp(self, hash, tmpPath)
+        self._added(hash)
+
+    def _added(self, hash):
+        size = os.stat(self.hashToPath(hash)).st_size
+        for victim in self.index.recordAdd(hash, size):
+            try:
+                os.unlink(self.hashToPath(victim))
+            except OSError, err:
+                if err.errno != errno.ENOENT:
+                    raise
+
+    def lockHash(self, hash):
+        """
+        Return an open file holding an exclusive lock that every process
+        fetching C{hash} into this store takes. Close it to release the lock.
+
+        Lock files are shared between hashes with the same first two hex
+        digits so that they never need to be cleaned up.
+        """
+        lockDir = os.path.join(self.root, 'locks')
+        util.mkdirChain(lockDir)
+        lockFile = open(os.path.join(lockDir, hash[:2]), 'a')
+        fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+        return lockFile
+
+
+class CacheIndex(object):
+    """
+    Size and last use time of each file in a datastore, plus hit and miss
+    counters, kept in SQLite so that all processes sharing the store see
+    the same records.
+
+    C{timeout} is how many seconds to wait for another process's write to
+    finish before giving up with C{sqlite3.OperationalError}.
+    """
+    # Files used more recently than this many seconds are never evicted, so
+    # a file can't disappear between a process finding it and opening it.
+    minAge = 600
+
+    def __init__(self, root, maxSize=None, timeout=60):
+        self.root = root
+        self.path = os.path.join(root, 'index.db')
+        self.maxSize = maxSize
+        self.timeout = timeout
+        # sqlite connections can't be shared between threads.
+        self._local = threading.local()
+
+    def _getCursor(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            util.mkdirChain(self.root)
+            db = sqlite3.connect(self.path, timeout=self.timeout,
+                    isolation_level=None)
+            # Losing the last few updates in a crash only affects eviction
+            # order, so don't pay for fsyncs.
+            db.execute("PRAGMA synchronous = OFF")
+            self._local.db = db
+            self._initialize(db.cursor())
+        return db.cursor()
+
+    def _initialize(self, cu):
+        cu.execute("BEGIN IMMEDIATE")
+        try:
+            cu.execute("SELECT name FROM sqlite_master "
+                    "WHERE type = 'table' AND name = 'entries'")
+            if not cu.fetchone():
+                cu.execute("""CREATE TABLE entries (
+                    hash        text PRIMARY KEY,
+                    size        integer NOT NULL,
+                    atime       real NOT NULL
+                    )""")
+                cu.execute("CREATE INDEX entries_atime ON entries (atime)")
+                cu.execute("""CREATE TABLE counters (
+                    name        text PRIMARY KEY,
+                    value       integer NOT NULL
+                    )""")
+                # Pick up files cached before the index existed.
+                cu.executemany("INSERT INTO entries VALUES (?, ?, ?)",
+                        self._scan())
+            cu.execute("""CREATE TABLE IF NOT EXISTS troves (
+                hash        text PRIMARY KEY,
+                trove       blob NOT NULL
+                )""")
+        except:
+            cu.execute("ROLLBACK")
+            raise
+        cu.execute("COMMIT")
+
+    def _scan(self):
+        for dirPath, dirNames, fileNames in os.walk(self.root):
+            prefix = dirPath[len(self.root):].replace(os.sep, '')
+            for name in fileNames:
+                # Skip temporary files from downloads in progress.
+                hash = prefix + name
+                if len(hash) != 40:
+                    continue
+                st = os.stat(os.path.join(dirPath, name))
+                yield hash, st.st_size, st.st_atime
+
+    def _count(self, cu, name, value):
+        cu.execute("INSERT OR IGNORE INTO counters VALUES (?, 0)", (name,))
+        cu.execute("UPDATE counters SET value = value + ? WHERE name = ?",
+                (value, name))
+
+    def recordHits(self, hashes):
+        cu = self._getCursor()
+        now = time.time()
+        cu.execute("BEGIN IMMEDIATE")
+        try:
+            cu.executemany("UPDATE entries SET atime = ? WHERE hash = ?",
+                    [(now, x) for x in hashes])
+            self._count(cu, 'hits', len(hashes))
+        except:
+            cu.execute("ROLLBACK")
+            raise
+        cu.execute("COMMIT")
+
+    def recordMisses(self, count):
+        """Count lookups that had to go to the repository."""
+        cu = self._getCursor()
+        cu.execute("BEGIN IMMEDIATE")
+        try:
+            self._count(cu, 'misses', count)
+        except:
+            cu.execute("ROLLBACK")
+            raise
+        cu.execute("COMMIT")
+
+    def recordAdd(self, hash, size):
+        """
+        Record a new file and return the hashes of files evicted to make
+        room for it, which the caller must delete.
+        """
+        cu = self._getCursor()
+        cu.execute("BEGIN IMMEDIATE")
+        try:
+            cu.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                    (hash, size, time.time()))
+            self._count(cu, 'bytes_fetched', size)
+            victims = self._evict(cu, keep=hash)
+        except:
+            cu.execute("ROLLBACK")
+            raise
+        cu.execute("COMMIT")
+        return victims
+
+    def _evict(self, cu, keep):
+        """
+        Drop the least recently used entries until the store fits in
+        C{maxSize}, and return their hashes so the files can be removed.
+        """
+        if not self.maxSize:
+            return []
+        cu.execute("SELECT sum(size) FROM entries")
+        total = cu.fetchone()[0] or 0
+        if total <= self.maxSize:
+            return []
+        cu.execute("SELECT hash, size FROM entries WHERE atime < ? "
+                "AND hash != ? ORDER BY atime", (time.time() - self.minAge,
+                    keep))
+        victims = []
+        for hash, size in cu.fetchall():
+            if total <= self.maxSize:
+                break
+            victims.append(str(hash))
+            total -= size
+        cu.executemany("DELETE FROM entries WHERE hash = ?",
+                [(x,) for x in victims])
+        cu.executemany("DELETE FROM troves WHERE hash = ?",
+                [(x,) for x in victims])
+        return victims
+
+    def _select(self, query, keys):
+        """
+        Run C{query}, which must end in an C{IN} clause, for C{keys} in
+        batches small enough for SQLite's parameter limit.
+        """
+        cu = self._getCursor()
+        rows = []
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start+500]
+            cu.execute(query + " (%s)" % ', '.join('?' * len(batch)), batch)
+            rows.extend(cu.fetchall())
+        return rows
+
+    def hasEntries(self, hashes):
+        """Return the subset of C{hashes} that are in the store."""
+        return set(str(x[0]) for x in self._select(
+            "SELECT hash FROM entries WHERE hash IN", hashes))
+
+    def getTroves(self, hashes):
+        """
+        Return a dict mapping those of C{hashes} whose changesets are
+        cached to the frozen trove changeset recorded by L{addTroves}.
+        """
+        return dict((str(x), str(y)) for (x, y) in self._select(
+            "SELECT troves.hash, trove FROM troves JOIN entries "
+            "ON entries.hash = troves.hash WHERE troves.hash IN", hashes))
+
+    def addTroves(self, troves):
+        """
+        Record frozen trove changesets, without file information, for the
+        cached changesets with the given hashes.
+        """
+        if not troves:
+            return
+        cu = self._getCursor()
+        cu.execute("BEGIN IMMEDIATE")
+        try:
+            cu.executemany("INSERT OR REPLACE INTO troves VALUES (?, ?)",
+                    [(x, sqlite3.Binary(y)) for (x, y) in troves])
+        except:
+            cu.execute("ROLLBACK")
+            raise
+        cu.execute("COMMIT")
+
+    def getStats(self):
+        """
+        Return a dict with the number of cache C{hits} and C{misses},
+        C{bytes_fetched} into the cache, and the current C{entries} and
+        C{size}.
+        """
+        cu = self._getCursor()
+        cu.execute("SELECT name, value FROM counters")
+        stats = dict(hits=0, misses=0, bytes_fetched=0)
+        stats.update((str(x), y) for (x, y) in cu.fetchall())
+        cu.execute("SELECT count(*), sum(size) FROM entries")
+        stats['entries'], stats['size'] = cu.fetchone()
+        stats['size'] = stats['size'] or 0
+        return stats
+
 class CacheError(Exception):
     pass
 
@@ -27,6 +27,9 @@ from twisted.web.server import NOT_DONE_YET
 
 log = logging.getLogger(__name__)
 
+# Method name of the envelope used to send a batch of calls in one request.
+MULTICALL = 'system.multicall'
+
 
 class PickleServerProxy(rpcproxy.GenericServerProxy):
 
@@ -48,6 +51,78 @@ class PickleServerProxy(rpcproxy.GenericServerProxy):
     def _filter_response(response):
         return chutney.loads(response.read())
 
+    def _batch(self):
+        """Return a context manager that collects calls and sends them in a
+        single request when the block exits.
+
+        Each call made through the batch returns a L{BatchedResult} whose
+        C{result} attribute holds the return value once the batch is sent::
+
+            with proxy._batch() as batch:
+                jobs = [batch.build.getJob(x) for x in jobIds]
+            jobs = [x.result for x in jobs]
+        """
+        return BatchProxy(self)
+
+
+class BatchedResult(object):
+    """The pending result of one call in a batch."""
+
+    def __init__(self, method):
+        self.method = method
+        self._done = False
+        self._ok = self._value = None
+
+    def _set(self, ok, value):
+        self._done = True
+        self._ok = ok
+        self._value = value
+
+    @property
+    def result(self):
+        """Return the call's value, or raise the error it failed with."""
+        if not self._done:
+            raise RuntimeError("Batch containing call to %s has not been "
+                    "sent" % self.method)
+        if self._ok:
+            return self._value
+        raise self._value
+
+    def __repr__(self):
+        return '<BatchedResult for %s>' % (self.method,)
+
+
+class BatchProxy(rpcproxy.BaseServerProxy):
+    """Collect calls for L{PickleServerProxy._batch}."""
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self._calls = []
+
+    def _request(self, method, args, kwargs):
+        result = BatchedResult(method)
+        self._calls.append(((method, args, kwargs), result))
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self._send()
+        return False
+
+    def _send(self):
+        calls, self._calls = self._calls, []
+        if not calls:
+            return
+        ok, results = self._proxy._marshal_call(MULTICALL,
+                ([x[0] for x in calls],), {})
+        if not ok:
+            raise results
+        for (call, pending), (ok, value) in zip(calls, results):
+            pending._set(ok, value)
+
 
 class PickleRPCResource(Resource):
 
@@ -62,20 +137,14 @@ class PickleRPCResource(Resource):
 
         def call_func():
             funcName, args, kwargs = chutney.load(request.content)
-            return self.methodstore._callMethod(funcName, callData, args,
-                    kwargs)
+            if funcName == MULTICALL:
+                return self._multicall(callData, *args, **kwargs)
+            d = defer.maybeDeferred(self.methodstore._callMethod, funcName,
+                    callData, args, kwargs)
+            d.addCallbacks(self._on_ok, self._on_error)
+            return d
         d = defer.maybeDeferred(call_func)
-
-        def on_ok(result):
-            return (True, result)
-        def on_error(failure):
-            if failure.check(errors.RmakeError):
-                return (False, failure.value)
-            else:
-                log.error("Unhandled exception in RPC method:\n%s",
-                        failure.getTraceback())
-                return (False, errors.InternalServerError())
-        d.addCallbacks(on_ok, on_error)
+        d.addErrback(self._on_error)
 
         @d.addCallback
         def do_render(result):
@@ -90,5 +159,31 @@ class PickleRPCResource(Resource):
 
         return NOT_DONE_YET
 
+    def _multicall(self, callData, calls):
+        """Run a batch of calls, all at once where they return Deferreds,
+        and return the outcome of each one in order."""
+        results = []
+        for funcName, args, kwargs in calls:
+            d = defer.maybeDeferred(self.methodstore._callMethod, funcName,
+                    callData, args, kwargs)
+            d.addCallbacks(self._on_ok, self._on_error)
+            results.append(d)
+        d = defer.gatherResults(results)
+        d.addCallback(self._on_ok)
+        return d
+
+    @staticmethod
+    def _on_ok(result):
+        return (True, result)
+
+    @staticmethod
+    def _on_error(failure):
+        if failure.check(errors.RmakeError):
+            return (False, failure.value)
+        else:
+            log.error("Unhandled exception in RPC method:\n%s",
+                    failure.getTraceback())
+            return (False, errors.InternalServerError())
+
     def _getCallData(self, request):
         return apirpc.CallData(auth=None, clientAddr=request.getClientIP())
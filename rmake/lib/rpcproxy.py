@@ -21,7 +21,11 @@ framework.
 """
 
 import base64
+import httplib
+import os
 import socket
+import threading
+import time
 import urlparse
 from conary.lib.util import rethrow
 from httplib import HTTPConnection
@@ -280,34 +284,119 @@ class Transport(object):
 
 
 class HTTPTransport(Transport):
+    """
+    HTTP/1.1 transport that keeps connections open between requests.
+
+    Idle connections are pooled per server address and reused until they
+    have been idle for C{idleTimeout} seconds. A request sent on a pooled
+    connection that the server has since closed is retried once on a fresh
+    connection.
+    """
     connectionClass = HTTPConnection
     userAgent = "rpath_xmlrpclib/%s (www.rpath.com)" % VERSION
 
-    def __init__(self, connectionClass=None, **kwargs):
+    # Seconds an idle connection is kept for reuse
+    idleTimeout = 30
+    # Idle connections kept per address
+    maxIdle = 4
+
+    def __init__(self, connectionClass=None, idleTimeout=None, **kwargs):
         super(HTTPTransport, self).__init__(**kwargs)
         if connectionClass:
             self.connectionClass = connectionClass
+        if idleTimeout is not None:
+            self.idleTimeout = idleTimeout
+        self._pool = {}
+        self._poolLock = threading.Lock()
+        self._poolPid = os.getpid()
 
     def request(self, address, contentType, request_body, response_filter):
-        try:
-            conn = self.make_connection(address)
-            self.send_request(conn, address)
-            self.send_host(conn, address)
-            self.send_user_agent(conn)
-            self.send_authorization(conn, address)
-            self.send_content(conn, contentType, request_body)
-        except socket.error, err:
-            rethrow(errors.OpenError("Error contacting server at %s: %s" %
-                (address, err)))
-
-        response = conn.getresponse()
+        key = self._poolKey(address)
+        conn = self._getConnection(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self.make_connection(address)
+            try:
+                self.send_request(conn, address)
+                self.send_host(conn, address)
+                self.send_user_agent(conn)
+                self.send_authorization(conn, address)
+                self.send_content(conn, contentType, request_body)
+                response = conn.getresponse()
+            except (socket.error, httplib.BadStatusLine), err:
+                self.close_connection(conn)
+                conn = None
+                if reused:
+                    # The server closed the idle connection; try again on
+                    # a new one.
+                    reused = False
+                    continue
+                rethrow(errors.OpenError("Error contacting server at %s: %s" %
+                    (address, err)))
+            break
+
         if response.status != 200:
+            self.close_connection(conn)
             raise ProtocolError(address, response.status, response.reason)
 
-        ret = response_filter(response)
-        self.close_connection(conn)
+        try:
+            ret = response_filter(response)
+        except:
+            self.close_connection(conn)
+            raise
+        self._releaseConnection(key, conn, response)
         return ret
 
+    @staticmethod
+    def _poolKey(address):
+        return address.host, address.port
+
+    def _getConnection(self, key):
+        """Return an idle connection to C{key}, or C{None}."""
+        now = time.time()
+        self._poolLock.acquire()
+        try:
+            if self._poolPid != os.getpid():
+                # Forked; the pooled sockets belong to the parent.
+                self._pool = {}
+                self._poolPid = os.getpid()
+            idle = self._pool.get(key, [])
+            while idle:
+                conn, lastUsed = idle.pop()
+                if now - lastUsed < self.idleTimeout:
+                    return conn
+                self.close_connection(conn)
+            return None
+        finally:
+            self._poolLock.release()
+
+    def _releaseConnection(self, key, conn, response):
+        """Return C{conn} to the pool if it can carry another request."""
+        if response.will_close or not response.isclosed():
+            self.close_connection(conn)
+            return
+        self._poolLock.acquire()
+        try:
+            idle = self._pool.setdefault(key, [])
+            if len(idle) < self.maxIdle:
+                idle.append((conn, time.time()))
+                return
+        finally:
+            self._poolLock.release()
+        self.close_connection(conn)
+
+    def close(self):
+        """Close all idle connections."""
+        self._poolLock.acquire()
+        try:
+            pool, self._pool = self._pool, {}
+        finally:
+            self._poolLock.release()
+        for idle in pool.values():
+            for conn, lastUsed in idle:
+                self.close_connection(conn)
+
     def make_connection(self, address):
         return self.connectionClass(address.host, address.port)
 
@@ -332,9 +421,9 @@ class HTTPTransport(Transport):
     def send_content(self, conn, contentType, request_body):
         conn.putheader('Content-type', contentType)
         conn.putheader('Content-length', str(len(request_body)))
-        conn.endheaders()
-        if request_body:
-            conn.send(request_body)
+        # Send the body in the same packet as the headers, otherwise Nagle's
+        # algorithm stalls every request on a kept-alive connection.
+        conn.endheaders(request_body)
 
     @staticmethod
     def close_connection(conn):
@@ -355,6 +444,10 @@ class ShimTransport(Transport):
 class UnixDomainMixin(object):
     connectionClass = UnixDomainHTTPConnection
 
+    @staticmethod
+    def _poolKey(address):
+        return address.path
+
     def make_connection(self, address):
         return self.connectionClass(address.path)
 
@@ -0,0 +1,141 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Event-driven readers for the length-prefixed marshal frames written by
+L{rmake.lib.pipereader.MarshalPipeWriter}.
+
+L{MarshalFrameProtocol} decodes frames as soon as their last byte arrives. It
+can be attached to a spawned child with
+L{rmake.lib.proc_pool.connector.ProcessConnector}, or to a pipe inherited
+from a plain C{fork()} with L{adoptPipe}.
+"""
+
+import marshal
+import os
+from twisted.internet import abstract
+from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet import fdesc
+from twisted.internet import protocol
+
+from rmake.lib import pipereader
+
+
+class TruncatedFrameError(RuntimeError):
+    pass
+
+
+class MarshalFrameProtocol(protocol.Protocol):
+    """
+    Receive marshalled objects, one per frame.
+
+    Subclasses implement L{frameReceived}. C{finished} fires with C{None} when
+    the writer closes its end of the pipe between frames, and fails if the
+    stream ends partway through a frame or the connection is lost abnormally.
+    """
+
+    def __init__(self):
+        self.decoder = pipereader.FrameDecoder()
+        self.finished = defer.Deferred()
+
+    def dataReceived(self, data):
+        for text in self.decoder.feed(data):
+            self.frameReceived(marshal.loads(text))
+
+    def frameReceived(self, obj):
+        raise NotImplementedError
+
+    def sendFrame(self, obj):
+        self.transport.write(pipereader.frame(marshal.dumps(obj)))
+
+    def connectionLost(self, reason):
+        if self.decoder.hasPartialFrame():
+            self.finished.errback(TruncatedFrameError(
+                "Pipe closed in the middle of a frame"))
+        elif reason.check(error.ConnectionDone, error.ProcessDone):
+            self.finished.callback(None)
+        else:
+            self.finished.errback(reason)
+
+
+class _Collector(protocol.Protocol):
+
+    def __init__(self):
+        self.data = []
+        self.finished = defer.Deferred()
+
+    def dataReceived(self, data):
+        self.data.append(data)
+
+    def connectionLost(self, reason):
+        self.finished.callback(''.join(self.data))
+
+
+class PipeReader(abstract.FileDescriptor):
+    """Read-only transport for an already open pipe."""
+
+    def __init__(self, fd, protocol, reactor=None):
+        abstract.FileDescriptor.__init__(self, reactor)
+        fdesc.setNonBlocking(fd)
+        fdesc._setCloseOnExec(fd)
+        self.fd = fd
+        self.protocol = protocol
+        self.connected = 1
+
+    def fileno(self):
+        return self.fd
+
+    def doRead(self):
+        return fdesc.readFromFD(self.fd, self.protocol.dataReceived)
+
+    def writeSomeData(self, data):
+        raise RuntimeError("Can't write to a pipe opened for reading")
+
+    def connectionLost(self, reason):
+        abstract.FileDescriptor.connectionLost(self, reason)
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.protocol.connectionLost(reason)
+
+    def getHost(self):
+        return ('pipe', self.fd)
+
+    def getPeer(self):
+        return ('pipe',)
+
+
+def adoptPipe(fd, protocol, reactor=None):
+    """
+    Attach C{protocol} to the read end of a pipe. The descriptor is owned by
+    the transport from now on and is closed when the writer goes away.
+    """
+    transport = PipeReader(fd, protocol, reactor)
+    protocol.makeConnection(transport)
+    transport.startReading()
+    return transport
+
+
+def readPipeToEnd(fd, reactor=None):
+    """
+    Return a deferred that fires with everything read from the pipe C{fd}
+    once the writer closes it. The descriptor is closed afterwards.
+    """
+    proto = _Collector()
+    adoptPipe(fd, proto, reactor)
+    return proto.finished
@@ -63,11 +63,13 @@ Typical usage:
 
 __author__ = 'Ka-Ping Yee <ping@zesty.ca>'
 
+import binascii
+
 RESERVED_NCS, RFC_4122, RESERVED_MICROSOFT, RESERVED_FUTURE = [
     'reserved for NCS compatibility', 'specified in RFC 4122',
     'reserved for Microsoft compatibility', 'reserved for future definition']
 
-class UUID(long):
+class UUID(str):
     """Instances of the UUID class represent UUIDs as specified in RFC 4122.
     UUID objects are immutable, hashable, and usable as dictionary keys.
     Converting a UUID to a string with str() yields something in the form
@@ -79,8 +81,12 @@ class UUID(long):
     argument named 'bytes', or a string of 16 bytes (with the first three
     fields in little-endian order) as an argument named 'bytes_le', or a
     single 128-bit integer as an argument named 'int'.
+
+    The UUID is stored as its 16 raw bytes, so hashing and comparisons are
+    done by the string type (which also caches the hash) and byte order
+    matches the numeric order of the old long-based representation. The
+    hexadecimal form is computed once, the first time it is needed.
     """
-    __slots__ = ()
 
     def __new__(cls, hex=None, bytes=None, bytes_le=None, fields=None,
                        int=None, version=None):
@@ -116,17 +122,16 @@ class UUID(long):
             hex = hex.strip('{}').replace('-', '')
             if len(hex) != 32:
                 raise ValueError('badly formed hexadecimal UUID string')
-            int = long(hex, 16)
+            try:
+                bytes = binascii.unhexlify(hex)
+            except TypeError:
+                raise ValueError('badly formed hexadecimal UUID string')
         if bytes_le is not None:
             if len(bytes_le) != 16:
                 raise ValueError('bytes_le is not a 16-char string')
             bytes = (bytes_le[3] + bytes_le[2] + bytes_le[1] + bytes_le[0] +
                      bytes_le[5] + bytes_le[4] + bytes_le[7] + bytes_le[6] +
                      bytes_le[8:])
-        if bytes is not None:
-            if len(bytes) != 16:
-                raise ValueError('bytes is not a 16-char string')
-            int = long(('%02x'*16) % tuple(map(ord, bytes)), 16)
         if fields is not None:
             if len(fields) != 6:
                 raise ValueError('fields is not a 6-tuple')
@@ -150,43 +155,67 @@ class UUID(long):
         if int is not None:
             if not 0 <= int < 1<<128L:
                 raise ValueError('int is out of range (need a 128-bit value)')
+            bytes = binascii.unhexlify('%032x' % int)
+        if len(bytes) != 16:
+            raise ValueError('bytes is not a 16-char string')
         if version is not None:
             if not 1 <= version <= 5:
                 raise ValueError('illegal version number')
-            # Set the variant to RFC 4122.
-            int &= ~(0xc000 << 48L)
-            int |= 0x8000 << 48L
-            # Set the version number.
-            int &= ~(0xf000 << 64L)
-            int |= version << 76L
-        return long.__new__(cls, int)
+            # Set the variant to RFC 4122, and the version number.
+            bytes = (bytes[:6]
+                    + chr((ord(bytes[6]) & 0x0f) | (version << 4))
+                    + bytes[7]
+                    + chr((ord(bytes[8]) & 0x3f) | 0x80)
+                    + bytes[9:])
+        return str.__new__(cls, bytes)
 
     def __repr__(self):
         return 'UUID(%r)' % str(self)
 
     def __str__(self):
-        hex = '%032x' % self
-        return '%s-%s-%s-%s-%s' % (
-            hex[:8], hex[8:12], hex[12:16], hex[16:20], hex[20:])
+        try:
+            return self.__dict__['_str']
+        except KeyError:
+            hex = self.hex
+            value = self._str = '%s-%s-%s-%s-%s' % (
+                hex[:8], hex[8:12], hex[12:16], hex[16:20], hex[20:])
+            return value
 
     @property
     def bytes(self):
-        bytes = ''
-        for shift in range(0, 128, 8):
-            bytes = chr((self>> shift) & 0xff) + bytes
-        return bytes
+        return str.__str__(self)
+
+    @property
+    def hex(self):
+        return binascii.hexlify(self)
+
+    @property
+    def int(self):
+        return long(self.hex, 16)
+
+    @property
+    def node(self):
+        return self.int & 0xffffffffffffL
 
     @property
     def short(self):
         return str(self)[24:]
 
+    def __long__(self):
+        return self.int
 
     def __copy__(self, memo=None):
         return self
     __deepcopy__ = __copy__
 
     def __getnewargs__(self):
-        return None, None, None, None, long(self), None
+        # Older versions pickled the integer form and accept the bytes form,
+        # so pickles can be exchanged with them in both directions.
+        return None, self.bytes
+
+    def __getstate__(self):
+        # Don't pickle the cached string form.
+        return None
 
 
 from rmake.lib import chutney
@@ -432,7 +461,7 @@ def uuid4():
         return UUID(bytes=os.urandom(16), version=4)
     except:
         import random
-        bytes = [chr(random.randrange(256)) for i in range(16)]
+        bytes = ''.join(chr(random.randrange(256)) for i in range(16))
         return UUID(bytes=bytes, version=4)
 
 def uuid5(namespace, name):
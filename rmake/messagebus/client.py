@@ -105,3 +105,8 @@ class BusClientService(_BaseService):
     def isConnected(self):
         neighbor = self.link._findNeighbor(self.targetJID)
         return neighbor and neighbor.isAuthenticated
+
+    def getTargetBacklog(self):
+        """Return the number of frames to the target not yet acknowledged."""
+        neighbor = self.link._findNeighbor(self.targetJID)
+        return neighbor and neighbor.getBacklog() or 0
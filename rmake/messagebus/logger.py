@@ -16,7 +16,7 @@
 
 
 import logging
-import time
+from collections import deque
 
 from rmake.messagebus.message import LogRecords
 
@@ -25,64 +25,126 @@ class LogRelay(object):
     """
     Relay log records to a message bus server.
 
-    Records will be sent at most once every 0.25 seconds.
+    Records will be sent at most once every 0.25 seconds, or sooner once
+    C{FLUSH_SIZE} bytes are waiting. If C{backlogFunc} is given it should
+    return the number of frames still waiting to be acknowledged by the
+    server; nothing more is sent while that exceeds C{MAX_BACKLOG}. While held
+    back, at most C{maxBuffered} bytes of records are kept. Records past that
+    are dropped, and a single record saying how many were lost is sent in
+    their place.
     """
 
     DEADLINE = 0.25
-
-    def __init__(self, sendFunc, task):
+    # Send as soon as this many bytes are buffered, and no more than this
+    # many bytes in a single message.
+    FLUSH_SIZE = 64 * 1024
+    # Stop sending while more than this many frames are unacknowledged.
+    MAX_BACKLOG = 8
+    # Rough allowance for the parts of a record other than its text.
+    RECORD_OVERHEAD = 256
+
+    def __init__(self, sendFunc, task, backlogFunc=None,
+            maxBuffered=4 * 1024 * 1024, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
         self.sendFunc = sendFunc
+        self.backlogFunc = backlogFunc
+        self.maxBuffered = maxBuffered
+        self.clock = clock
         self.task = task
-        self.buffered = []
+        self.buffered = deque()
+        self.buffered_size = 0
+        self.dropped = 0
         self.last_send = 0
         self.delayed_call = None
 
     def _formatException(self, ei):
         return logging._defaultFormatter.formatException(ei)
 
+    def _recordSize(self, record):
+        try:
+            size = len(record.getMessage())
+        except:
+            size = len(str(record.msg))
+        if record.exc_text:
+            size += len(record.exc_text)
+        return size + self.RECORD_OVERHEAD
+
     def emitMany(self, records):
         for record in records:
             # Don't send traceback objects over the wire if it can be helped.
             if record.exc_info and not record.exc_text:
                 record.exc_text = self._formatException(record.exc_info)
             record.exc_info = None
-            self.buffered.append(record)
+            size = self._recordSize(record)
+            if self.dropped or self.buffered_size + size > self.maxBuffered:
+                # Once records start being dropped, keep dropping until the
+                # buffer is sent so the log doesn't have holes in it.
+                self.dropped += 1
+                continue
+            self.buffered.append((record, size))
+            self.buffered_size += size
         self.maybeFlush()
 
     def emit(self, record):
         self.emitMany([record])
 
+    def _isBackedUp(self):
+        return (self.backlogFunc is not None
+                and self.backlogFunc() > self.MAX_BACKLOG)
+
     def maybeFlush(self):
-        if self.delayed_call or not self.buffered:
+        if self.delayed_call or not (self.buffered or self.dropped):
             # Nothing to do, or there's already a delayed call scheduled.
             return
         deadline = self.last_send + self.DEADLINE
-        now = time.time()
-        if now > deadline:
-            # It's been long enough so go ahead and send it immediately.
+        now = self.clock.seconds()
+        if ((now >= deadline or self.buffered_size >= self.FLUSH_SIZE)
+                and not self._isBackedUp()):
+            # It's been long enough, or enough has piled up, so go ahead and
+            # send it immediately.
             self.flush()
             return
 
-        # Not long enough to send immediately, so schedule a call.
-        from twisted.internet import reactor
-        delay = deadline - now
-        self.delayed_call = reactor.callLater(delay, self.flush)
+        # Not ready to send immediately, so schedule a call. If the server is
+        # falling behind this will keep checking back until it catches up.
+        delay = max(deadline - now, 0) or self.DEADLINE
+        self.delayed_call = self.clock.callLater(delay, self._delayedFlush)
 
-    def flush(self):
-        if not self.buffered:
-            return
+    def _delayedFlush(self):
+        self.delayed_call = None
+        self.maybeFlush()
 
-        # If there's a delayed flush in-flight (or if this *is* the delayed
-        # flush) then cancel and clear it.
+    def flush(self, force=False):
+        # If there's a delayed flush in-flight then cancel and clear it.
         if self.delayed_call:
             if self.delayed_call.active():
                 self.delayed_call.cancel()
             self.delayed_call = None
 
-        records, self.buffered = self.buffered, []
-        msg = LogRecords(records, self.task.job_uuid, self.task.task_uuid)
-        self.sendFunc(msg)
-        self.last_send = time.time()
+        while self.buffered or self.dropped:
+            records, size = [], 0
+            while self.buffered and size < self.FLUSH_SIZE:
+                record, recordSize = self.buffered.popleft()
+                records.append(record)
+                size += recordSize
+            self.buffered_size -= size
+            if not self.buffered and self.dropped:
+                records.append(self._droppedRecord())
+                self.dropped = 0
+            msg = LogRecords(records, self.task.job_uuid, self.task.task_uuid)
+            self.sendFunc(msg)
+            self.last_send = self.clock.seconds()
+            if not force and self._isBackedUp():
+                break
+        self.maybeFlush()
+
+    def _droppedRecord(self):
+        record = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                "%d log records dropped because the message bus could not "
+                "keep up", (self.dropped,), None)
+        return record
 
     def close(self):
-        self.flush()
+        # Whatever is left goes out now; the link will queue it.
+        self.flush(force=True)
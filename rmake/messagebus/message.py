@@ -159,7 +159,18 @@ class TaskStatus(Message):
 
 class Heartbeat(Message):
     messageType = 'heartbeat'
-    _payload_slots = ('caps', 'tasks', 'slots', 'addresses')
+    _payload_slots = ('caps', 'tasks', 'slots', 'addresses', 'affinity',
+            'stats')
+
+
+class HeartbeatDelta(Message):
+    """Heartbeat carrying only the fields that changed since the last one.
+
+    Unchanged fields are C{None}. Workers send a full L{Heartbeat}
+    periodically and whenever they (re)connect to the dispatcher.
+    """
+    messageType = 'heartbeat-delta'
+    _payload_slots = Heartbeat._payload_slots
 
 
 class LogRecords(Message):
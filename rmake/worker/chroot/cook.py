@@ -169,6 +169,49 @@ def getResults(results, pid, inF, csFile):
     if not gotResult:
         return None
 
+    errReason = []
+    if os.WIFEXITED(status) and os.WEXITSTATUS(status):
+        buffer = os.read(inF, 1024)
+        while buffer:
+            errReason.append(buffer)
+            buffer = os.read(inF, 1024)
+    os.close(inF)
+    return _setResults(results, status, ''.join(errReason), csFile)
+
+
+def watchResults(results, pid, inF, csFile, reactor=None):
+    """
+    Event-driven alternative to polling L{getResults}. Returns a deferred that
+    fires with the results once the cook process has closed its end of the
+    failure pipe and exited. Takes ownership of C{inF}.
+    """
+    from twisted.internet import defer
+    from rmake.lib.twisted_extras import framed_pipe
+    if reactor is None:
+        from twisted.internet import reactor
+
+    def cb_reap(errReason):
+        # The child closes the pipe immediately before exiting, so this will
+        # normally succeed on the first try.
+        d = defer.Deferred()
+        def check():
+            try:
+                gotResult, status = os.waitpid(pid, os.WNOHANG)
+            except:
+                d.errback()
+                return
+            if gotResult:
+                d.callback(_setResults(results, status, errReason, csFile))
+            else:
+                reactor.callLater(0.01, check)
+        check()
+        return d
+    d = framed_pipe.readPipeToEnd(inF, reactor)
+    d.addCallback(cb_reap)
+    return d
+
+
+def _setResults(results, status, errReason, csFile):
     if os.WIFSIGNALED(status):
         results.setExitSignal(os.WTERMSIG(status))
     else:
@@ -180,15 +223,8 @@ def getResults(results, pid, inF, csFile):
     elif results.getExitSignal():
         results.setFailureReason(BuildFailed('Build exited with signal %s' % results.getExitSignal()))
     else:
-        errReason = []
-        buffer = os.read(inF, 1024)
-        while buffer:
-            errReason.append(buffer)
-            buffer = os.read(inF, 1024)
-        errReason = ''.join(errReason)
         errTag, data = errReason.split('\002', 1)
         results.setFailureReason(thaw('FailureReason', (errTag, data)))
-    os.close(inF)
     return results
 
 def stopBuild(results, pid, inF, csFile):
@@ -21,6 +21,7 @@
     Uses the chroothelper program to do final processing and chrooting.
 """
 
+import cPickle
 import errno
 import fcntl
 import grp
@@ -30,11 +31,13 @@ import pwd
 import shutil
 import sys
 import stat
+import tempfile
 
 #conary
 from conary import conarycfg
 from conary import conaryclient
 from conary import callbacks
+from conary import versions
 from conary.deps import deps
 from conary.lib import util, openpgpkey, sha1helper
 
@@ -42,14 +45,70 @@ from conary.lib import util, openpgpkey, sha1helper
 from rmake import errors
 from rmake import compat
 from rmake import constants
+from rmake.lib import chrootcache
 from rmake.lib import flavorutil
 from rmake.lib import rootfactory
 
+# List of troves installed in the chroot, written next to the conary database
+# so old chroots can be compared with new build requirements without opening
+# their databases.
+MANIFEST_PATH = '/var/lib/conarydb/rmake-manifest'
+DB_PATH = '/var/lib/conarydb/conarydb'
+
+
 def _addModeBits(path, bits):
     s = os.lstat(path)
     if not stat.S_ISLNK(s.st_mode) and not (s.st_mode & bits == bits):
         os.chmod(path, stat.S_IMODE(s.st_mode) | bits)
 
+
+def writeManifest(root, troveTups):
+    """Record the (name, version, flavor) tuples installed in C{root}."""
+    path = root + MANIFEST_PATH
+    frozen = [(n, v.freeze(), f.freeze()) for (n, v, f) in troveTups]
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path),
+            prefix='rmake-manifest.')
+    try:
+        fobj = os.fdopen(fd, 'wb')
+        cPickle.dump(frozen, fobj, 2)
+        fobj.close()
+        os.rename(tmpPath, path)
+    finally:
+        util.removeIfExists(tmpPath)
+
+
+def getManifestStamp(root):
+    """
+    Return a value that changes whenever the manifest or the database of
+    C{root} is modified, or None if there is no manifest.
+    """
+    try:
+        manifestTime = os.stat(root + MANIFEST_PATH).st_mtime
+    except OSError:
+        return None
+    try:
+        dbTime = os.stat(root + DB_PATH).st_mtime
+    except OSError:
+        dbTime = None
+    return manifestTime, dbTime
+
+
+def readManifest(root):
+    """
+    Return the (name, version, flavor) tuples installed in C{root} according
+    to its manifest, or None if the manifest is missing or older than the
+    chroot's database.
+    """
+    stamp = getManifestStamp(root)
+    if stamp is None or stamp[1] > stamp[0]:
+        return None
+    try:
+        frozen = cPickle.load(open(root + MANIFEST_PATH, 'rb'))
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+    return [(n, versions.ThawVersion(v), deps.ThawFlavor(f))
+            for (n, v, f) in frozen]
+
 class ConaryBasedChroot(rootfactory.BasicChroot):
     """ 
         The root manages a root environment, creating and installing
@@ -69,6 +128,8 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
         self.chrootCache = chrootCache
         self.chrootFingerprint = None
         self.oldRoot = oldRoot
+        # Set when the root was moved over from an earlier build
+        self.reusedRoot = False
         if targetFlavor is not None:
             cfg.initializeFlavors()
             self.sysroot = flavorutil.getSysRootPath(targetFlavor)
@@ -106,6 +167,7 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
             self.logger.warning('Could not access database in old root %s: %s.  Removing old root' % (oldRoot, err))
             os.rename(newRoot, oldRoot)
             return False
+        self.reusedRoot = True
         return True
 
     def create(self, root):
@@ -115,9 +177,6 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
     def install(self):
         self.cfg.root = self.root
         self._lock(self.root, fcntl.LOCK_SH)
-        if self.oldRoot:
-            if self.serverCfg.reuseChroots:
-                self._moveOldRoot(self.oldRoot, self.root)
         if not self.jobList and not self.crossJobList:
             # should only be true in debugging situations
             return
@@ -131,12 +190,15 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
                         self.chrootFingerprint)
                 self.logger.info('restoring cached chroot with '
                         'fingerprint %s', strFingerprint)
-                self.chrootCache.restore(self.chrootFingerprint, self.cfg.root)
-                self.logger.info('chroot fingerprint %s '
-                         'restore done', strFingerprint)
-                return
-
-        def _install(jobList):
+                if self.chrootCache.restore(self.chrootFingerprint,
+                        self.cfg.root):
+                    self.logger.info('chroot fingerprint %s '
+                             'restore done', strFingerprint)
+                    return
+                self.logger.info('cached chroot with fingerprint %s was '
+                        'evicted before it could be restored', strFingerprint)
+
+        def _install(jobList, migrate=True):
             self.cfg.flavor = []
             openpgpkey.getKeyCache().setPublicPath(
                                      self.cfg.root + '/root/.gnupg/pubring.gpg')
@@ -146,9 +208,14 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
             client = conaryclient.ConaryClient(self.cfg)
             client.setUpdateCallback(self.callback)
             if self.csCache:
+                # The cache only holds install changesets; conary builds
+                # updates from them.
+                csJobs = [(x[0], (None, None), x[2], False) for x in jobList
+                        if x[2][0] is not None]
                 changeSetList = self.csCache.getChangeSets(client.getRepos(),
-                                                           jobList,
-                                                           callback=self.callback)
+                        csJobs, callback=self.callback,
+                        reposFactory=lambda: conaryclient.ConaryClient(
+                            self.cfg).getRepos())
             else:
                 changeSetList = []
 
@@ -157,7 +224,7 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
                     jobList, keepExisting=False, resolveDeps=False,
                     recurse=False, checkPathConflicts=False,
                     fromChangesets=changeSetList,
-                    migrate=True)
+                    migrate=migrate)
             except conaryclient.update.NoNewTrovesError:
                 # since we're migrating, this simply means there were no
                 # operations to be performed
@@ -167,6 +234,18 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
                 client.applyUpdate(updJob, replaceFiles=True,
                                    tagScript=self.cfg.root + '/root/tagscripts')
 
+        installed = None
+        if self.reusedRoot and not (self.bootstrapJobList
+                or self.crossJobList or self.cfg.rpmRequirements):
+            # A reused chroot still has the manifest of its previous build.
+            installed = readManifest(self.cfg.root)
+        if installed is not None:
+            if self._updateIncremental(_install, installed):
+                self._finishInstall()
+                return
+            self.logger.warning("Reused chroot does not match its build "
+                    "requirements after updating; migrating it instead")
+
         self._installRPM()
         self._touchShadow()
 
@@ -204,11 +283,95 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
             for filename in files:
                 _addModeBits(os.sep.join((root, filename)), 04)
 
+        self._finishInstall()
+
+    def _getIncrementalJobs(self, installed):
+        """
+        Return the jobs that turn the C{installed} troves into the build
+        requirements: updates from old to new versions of troves that are
+        still required, installs of new names and erasures of the rest.
+        """
+        installed = set(installed)
+        wanted = set((x[0], x[2][0], x[2][1]) for x in self.jobList)
+        byName = {}
+        for name, version, flavor in installed - wanted:
+            byName.setdefault(name, ([], []))[0].append((version, flavor))
+        for name, version, flavor in wanted - installed:
+            byName.setdefault(name, ([], []))[1].append((version, flavor))
+
+        jobList = []
+        for name, (old, new) in sorted(byName.items()):
+            # Pair up versions with the same flavor first, so that an
+            # update doesn't turn into a flavor change.
+            for newVF in new[:]:
+                for oldVF in old:
+                    if oldVF[1] == newVF[1]:
+                        jobList.append((name, oldVF, newVF, False))
+                        old.remove(oldVF)
+                        new.remove(newVF)
+                        break
+            for oldVF, newVF in itertools.izip_longest(old, new,
+                    fillvalue=(None, None)):
+                jobList.append((name, oldVF, newVF, False))
+        return jobList
+
+    def _updateIncremental(self, _install, installed):
+        """
+        Bring a reused chroot up to date by applying only the difference
+        between its manifest and the build requirements, then fix
+        permissions only on the files of the new troves.
+
+        Returns C{False} if the chroot still doesn't have exactly the
+        required troves afterwards.
+        """
+        wanted = set((x[0], x[2][0], x[2][1]) for x in self.jobList)
+        jobList = self._getIncrementalJobs(installed)
+        self.logger.info("Updating reused chroot: %d troves to update, "
+                "%d unchanged", len(jobList), len(wanted & set(installed)))
+        if not jobList:
+            return True
+        _install(jobList, migrate=False)
+
+        db = conaryclient.ConaryClient(self.cfg).db
+        if set(db.iterAllTroves()) != wanted:
+            return False
+
+        # directories must be traversable and files readable (RMK-1006)
+        dirs = set()
+        for name, _, (version, flavor), _ in jobList:
+            if version is None:
+                continue
+            for _, path, _, _ in db.iterFilesInTrove(name, version, flavor):
+                fullPath = self.cfg.root + path
+                try:
+                    mode = os.lstat(fullPath).st_mode
+                except OSError:
+                    # Excluded or replaced by another trove
+                    continue
+                if not stat.S_ISDIR(mode):
+                    _addModeBits(fullPath, 04)
+                    fullPath = os.path.dirname(fullPath)
+                while (len(fullPath) > len(self.cfg.root)
+                        and fullPath not in dirs):
+                    dirs.add(fullPath)
+                    fullPath = os.path.dirname(fullPath)
+        for path in dirs:
+            _addModeBits(path, 05)
+        return True
+
+    def _finishInstall(self):
+        # Written before caching so restored chroots carry it along.
+        db = conaryclient.ConaryClient(self.cfg).db
+        writeManifest(self.cfg.root, db.iterAllTroves())
+
         if self.chrootFingerprint:
             strFingerprint = sha1helper.sha1ToString(self.chrootFingerprint)
             self.logger.info('caching chroot with fingerprint %s',
                     strFingerprint)
-            self.chrootCache.store(self.chrootFingerprint, self.cfg.root)
+            affinityKeys = chrootcache.getAffinityKeys(self.jobList,
+                    self.crossJobList)
+            self.chrootCache.store(self.chrootFingerprint, self.cfg.root,
+                    affinityKeys)
             self.logger.info('caching chroot %s done',
                     strFingerprint)
 
@@ -43,11 +43,17 @@ class ChrootQueue(object):
         self.chroots = {}
         self.toRemove = {}  # chroots that are scheduled for removal
         self.badChroots = {}
+        # chrootPath -> (manifest stamp, frozenset of (name, label, flavor))
+        self.contents = {}
+        # (name, label, flavor) -> set of chrootPaths
+        self.chrootsByNLF = {}
 
     def reset(self):
         self.chroots = {}
         self.toRemove = {}
         self.badChroots = {}
+        self.contents = {}
+        self.chrootsByNLF = {}
 
     def listChroots(self):
         chroots = set(self.chroots)
@@ -129,19 +135,65 @@ class ChrootQueue(object):
                               key=lambda x: os.stat(x)[stat.ST_MTIME])[0]
         buildReqsByNLF = set([(x[0], x[1].trailingLabel(), x[2]) 
                              for x in buildReqs])
+        oldChroots = self.listOldChroots()
+        self._updateContents(oldChroots)
+        common = dict((x, 0) for x in oldChroots)
+        for nlf in buildReqsByNLF:
+            for chrootPath in self.chrootsByNLF.get(nlf, ()):
+                if chrootPath in common:
+                    common[chrootPath] += 1
         matches = {}
-        for chrootPath in self.listOldChroots():
-            db = database.Database(chrootPath, '/var/lib/conarydb')
-            chrootContents = db.iterAllTroves()
-            trovesByNLF = set([(x[0], x[1].trailingLabel(), x[2]) for x in chrootContents])
+        for chrootPath, count in common.iteritems():
+            extras = len(self.contents[chrootPath][1]) - count
             # matches = 2*matches - extras - so an empty chroot is better than 
             # a chroot with lots of wrong troves.
-            matches[chrootPath] = 2 * len(trovesByNLF.intersection(buildReqsByNLF)) - len(trovesByNLF.difference(buildReqsByNLF))
+            matches[chrootPath] = 2 * count - extras
         if matches:
             rank, best = sorted((x[1], x[0]) for x in matches.iteritems())[-1]
             if rank >= len(buildReqsByNLF) or not goodRootsOnly:
                 return best
 
+    def _updateContents(self, oldChroots):
+        """
+        Bring the index of chroot contents up to date for C{oldChroots},
+        reading manifests only for chroots that changed since last time.
+        """
+        for chrootPath in set(self.contents) - set(oldChroots):
+            if chrootPath not in self.chroots:
+                self._unindexChroot(chrootPath)
+        for chrootPath in oldChroots:
+            stamp = rootfactory.getManifestStamp(chrootPath)
+            cached = self.contents.get(chrootPath)
+            if cached and stamp is not None and cached[0] == stamp:
+                continue
+            troveTups = rootfactory.readManifest(chrootPath)
+            if troveTups is None:
+                # Chroot predates manifests or was modified since.
+                db = database.Database(chrootPath, '/var/lib/conarydb')
+                troveTups = list(db.iterAllTroves())
+                try:
+                    rootfactory.writeManifest(chrootPath, troveTups)
+                except (IOError, OSError):
+                    pass
+                stamp = rootfactory.getManifestStamp(chrootPath)
+            self._unindexChroot(chrootPath)
+            contents = frozenset((x[0], x[1].trailingLabel(), x[2])
+                    for x in troveTups)
+            self.contents[chrootPath] = (stamp, contents)
+            for nlf in contents:
+                self.chrootsByNLF.setdefault(nlf, set()).add(chrootPath)
+
+    def _unindexChroot(self, chrootPath):
+        cached = self.contents.pop(chrootPath, None)
+        if not cached:
+            return
+        for nlf in cached[1]:
+            paths = self.chrootsByNLF.get(nlf)
+            if paths:
+                paths.discard(chrootPath)
+                if not paths:
+                    del self.chrootsByNLF[nlf]
+
     def requestSlot(self, troveName, buildReqs, reuseChroots):
         if self.slots > 0 and len(self.chroots) >= self.slots:
             return None
@@ -178,7 +230,8 @@ class ChrootManager(object):
         cacheDir = serverCfg.getCacheDir()
         util.mkdirChain(cacheDir)
         if self.serverCfg.useCache:
-            self.csCache = repocache.RepositoryCache(cacheDir)
+            self.csCache = repocache.RepositoryCache(cacheDir,
+                    maxSize=self.serverCfg.cacheMaxSize * 1048576 or None)
         else:
             self.csCache = None
         self.chrootCache = serverCfg.getChrootCache()
@@ -194,6 +247,16 @@ class ChrootManager(object):
                 chroots.append('archive/' + name)
         return chroots
 
+    def listCachedChroots(self):
+        if not self.chrootCache:
+            return []
+        return self.chrootCache.listChroots()
+
+    def getChrootCacheStats(self):
+        if not self.chrootCache:
+            return None
+        return self.chrootCache.getStats()
+
     def chrootFinished(self, chrootPath):
         self.queue.chrootFinished(chrootPath)
 
@@ -130,17 +130,25 @@ class ChrootServer:#(apirpc.XMLApiServer):
         if (name, version, flavorList) in self._results:
             results = self._results[name, version, flavorList]
         else:
-            timeSpent = 0
+            deadline = time.time() + (wait or 0)
             buildInfo = self._buildInfo[name, version, flavorList]
+            inF = buildInfo[2]
             while True:
                 results = cook.getResults(*buildInfo)
                 if results:
                     break
-                elif wait and timeSpent < wait:
-                    time.sleep(.1)
-                    timeSpent += .1
-                else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
                     return ''
+                # The cook process closes the failure pipe as it exits, so
+                # wait for that rather than polling on a fixed interval.
+                try:
+                    ready = select.select([inF], [], [], remaining)[0]
+                except select.error:
+                    ready = True
+                if ready:
+                    # Give the process a moment to finish exiting.
+                    time.sleep(.01)
             del self._buildInfo[name, version, flavorList]
         return freeze(cook.CookResults, results)
 
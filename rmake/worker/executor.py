@@ -24,6 +24,7 @@ import cPickle
 import logging
 import os
 import sys
+from conary.lib import sha1helper
 from twisted.internet import defer
 from twisted.internet import error as ierror
 from twisted.protocols.basic import Int32StringReceiver
@@ -94,7 +95,9 @@ class WorkerParent(WorkerProtocol):
         """Snoop launch commands to keep track of the current task."""
         self.task = kwargs['task']
         self.launcher = kwargs.pop('launcher')
-        self.logRelay = LogRelay(self.launcher.bus.sendToTarget, self.task)
+        self.logRelay = LogRelay(self.launcher.bus.sendToTarget, self.task,
+                backlogFunc=self.launcher.bus.getTargetBacklog,
+                maxBuffered=self.launcher.cfg.logBufferSize)
 
         # Fail tasks that exited cleanly but didn't report success.
         def cb_checkResult(result):
@@ -135,12 +138,16 @@ class WorkerParent(WorkerProtocol):
             log.warning("Dropping worker status report for wrong task.")
             return
         self.task = task
+        # Send the task's logs first. A final status can finish the job,
+        # after which the dispatcher discards any more logs for it.
+        if self.logRelay:
+            self.logRelay.flush(force=True)
         self.launcher.forwardTaskStatus(task)
 
     def cmd_push_logs(self, ctr, records):
-        if not self.task:
+        if not self.logRelay:
             return
-        self.launcher.forwardTaskLogs(self.task, records)
+        self.logRelay.emitMany(records)
 
 
 class WorkerChild(WorkerProtocol):
@@ -214,12 +221,12 @@ class WorkerChild(WorkerProtocol):
         return d
 
     def cmd_startup(self, ctr, pluginDirs, disabledPlugins, pluginOptions,
-            cfgBlob):
+            cfgFile):
         self.plugins = pluginlib.PluginManager(pluginDirs, disabledPlugins,
                 supportedTypes=self.pluginTypes)
         self.plugins.loadPlugins()
         self.plugins.setOptions(pluginOptions)
-        self.cfg = cPickle.loads(cfgBlob)
+        self.cfg = self._loadConfig(*cfgFile)
 
         self.task_types = {}
         for plugin, tasks in self.plugins.p.worker.get_task_types().items():
@@ -228,6 +235,15 @@ class WorkerChild(WorkerProtocol):
 
         self.sendCommand(ctr, 'ack')
 
+    @staticmethod
+    def _loadConfig(path, digest):
+        """Load the config the launcher stored for its workers."""
+        blob = open(path, 'rb').read()
+        if sha1helper.sha1ToString(sha1helper.sha1String(blob)) != digest:
+            raise RuntimeError("Worker configuration at %s does not match "
+                    "the expected checksum" % (path,))
+        return cPickle.loads(blob)
+
     def cmd_shutdown(self, ctr):
         self.shutdown = True
         self.sendCommand(ctr, 'ack')
@@ -237,6 +253,10 @@ class WorkerChild(WorkerProtocol):
         task = task.thaw()
         task.times.ticks = self.task.times.ticks + 1
         self.task = task.freeze()
+        if self.logger:
+            # Send whatever the task logged before this update so the
+            # dispatcher sees the logs leading up to a status change.
+            self.logger.flush()
         self.sendCommand(None, 'status_update', task=self.task)
 
     def sendStatus(self, status):
@@ -255,10 +275,29 @@ class WorkerChild(WorkerProtocol):
 
 
 class ChildLogger(logging.Handler):
+    """Forward log records from the task thread to the launcher.
+
+    Records are buffered and sent in batches, so a chatty task wakes the
+    reactor once per batch rather than once per record. A batch is sent
+    C{flushDelay} seconds after its first record arrives, or as soon as
+    C{maxBatch} records are waiting, whichever comes first.
+    """
 
-    def __init__(self, sendFunc):
+    flushDelay = 0.1
+    maxBatch = 1000
+
+    def __init__(self, sendFunc, reactor=None):
         logging.Handler.__init__(self, logging.NOTSET)
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
         self.sendFunc = sendFunc
+        # These are protected by the handler lock.
+        self.pending = []
+        self.flushScheduled = False
+        self.flushForced = False
+        # Only touched from the reactor thread.
+        self.delayedFlush = None
 
     def emit(self, record):
         if not self.sendFunc:
@@ -269,11 +308,42 @@ class ChildLogger(logging.Handler):
         record.exc_info = None
 
         # All logging is going to be happening in the worker thread, but all IO
-        # needs to happen in the main thread.
-        from twisted.internet import reactor
-        reactor.callFromThread(self.sendFunc, [record])
+        # needs to happen in the main thread. The handler lock is held here,
+        # so the buffer can be updated safely.
+        self.pending.append(record)
+        if not self.flushScheduled:
+            self.flushScheduled = True
+            self.reactor.callFromThread(self._scheduleFlush)
+        elif len(self.pending) >= self.maxBatch and not self.flushForced:
+            self.flushForced = True
+            self.reactor.callFromThread(self.flush)
+
+    def _scheduleFlush(self):
+        if self.flushScheduled and self.delayedFlush is None:
+            self.delayedFlush = self.reactor.callLater(self.flushDelay,
+                    self.flush)
+
+    def flush(self):
+        # Must be called from the reactor thread.
+        if self.delayedFlush is not None:
+            if self.delayedFlush.active():
+                self.delayedFlush.cancel()
+            self.delayedFlush = None
+        self.acquire()
+        try:
+            records, self.pending = self.pending, []
+            self.flushScheduled = self.flushForced = False
+        finally:
+            self.release()
+        if not self.sendFunc:
+            return
+        for n in range(0, len(records), self.maxBatch):
+            self.sendFunc(records[n:n + self.maxBatch])
 
     def close(self):
+        # Called from the reactor thread once the task is done, so anything
+        # still buffered can be sent right away.
+        self.flush()
         self.sendFunc = None
         logging.Handler.close(self)
 
@@ -25,10 +25,18 @@ into the worker process.
 """
 
 import cPickle
+import errno
+import glob
 import logging
+import os
+import tempfile
+import time
 from conary.lib import cfgtypes
+from conary.lib import sha1helper
+from conary.lib import util
 from twisted.application.internet import TimerService
 from twisted.application.service import MultiService
+from twisted.internet import threads
 
 from rmake.core import types
 from rmake.core.types import JobStatus, TaskCapability
@@ -42,7 +50,8 @@ from rmake.worker import executor
 log = logging.getLogger(__name__)
 
 # Protocol versions of the dispatcher that are supported by the launcher
-PROTOCOL_VERSIONS = set([3])
+# 4 - heartbeat-delta messages
+PROTOCOL_VERSIONS = set([3, 4])
 
 
 class LauncherService(MultiService):
@@ -53,7 +62,15 @@ class LauncherService(MultiService):
         self.debug = debug
         self.bus = None
         self.caps = set()
+        # Callables returning sets of opaque keys that are advertised to the
+        # dispatcher so job handlers can prefer this worker for tasks that
+        # benefit from local state, e.g. a cached chroot.
+        self.affinityProviders = []
+        # Callables returning dicts of statistics to report in heartbeats.
+        # They are called in a thread and may block.
+        self.statsProviders = []
         self.pool = None
+        self.cfgPath = None
         self.plugins = plugin_mgr
         self.plugins.p.launcher.pre_setup(self)
         self._set_caps()
@@ -73,7 +90,8 @@ class LauncherService(MultiService):
     def _start_bus(self):
         self.bus = LauncherBusService(self.cfg)
         self.bus.setServiceParent(self)
-        HeartbeatService(self).setServiceParent(self)
+        self.heartbeat = HeartbeatService(self)
+        self.heartbeat.setServiceParent(self)
 
     def _start_pool(self):
         # The elusive double pickle: even though parent-child communication
@@ -84,11 +102,68 @@ class LauncherService(MultiService):
                     pluginDirs=self.plugins.pluginDirs,
                     disabledPlugins=self.plugins.disabledPlugins,
                     pluginOptions=self.cfg.pluginOption,
-                    cfgBlob=cPickle.dumps(self.cfg, 2),
                     ),
                 debug=self.debug)
         self.pool.setServiceParent(self)
 
+    def _storeConfig(self):
+        """Pickle the config once and store it in a private file.
+
+        Every worker process the pool starts reads the config from this file
+        instead of having its own copy sent down the pipe. Returns the path
+        and the SHA-1 of the contents, which the worker checks so it can't
+        pick up a config from a different launcher.
+        """
+        blob = cPickle.dumps(self.cfg, 2)
+        digest = sha1helper.sha1ToString(sha1helper.sha1String(blob))
+        util.mkdirChain(self.cfg.lockDir)
+        fd, path = tempfile.mkstemp(dir=self.cfg.lockDir,
+                prefix='rmake-worker-%d-' % os.getpid(), suffix='.cfg')
+        fObj = os.fdopen(fd, 'wb')
+        try:
+            fObj.write(blob)
+        finally:
+            fObj.close()
+        self.cfgPath = path
+        return path, digest
+
+    def _removeStaleConfigs(self):
+        """Remove config files left behind by launchers that have died."""
+        for path in glob.glob(os.path.join(self.cfg.lockDir,
+                'rmake-worker-*.cfg')):
+            try:
+                pid = int(os.path.basename(path).split('-')[2])
+            except ValueError:
+                continue
+            try:
+                os.kill(pid, 0)
+            except OSError, err:
+                if err.errno != errno.ESRCH:
+                    continue
+            else:
+                continue
+            log.debug("Removing stale worker config %s", path)
+            util.removeIfExists(path)
+
+    def startService(self):
+        # This runs after the daemon has forked and dropped privileges, so
+        # the file is owned by the user the workers run as.
+        self._removeStaleConfigs()
+        self.pool.args['cfgFile'] = self._storeConfig()
+        MultiService.startService(self)
+
+    def stopService(self):
+        d = MultiService.stopService(self)
+        def bb_cleanup(result):
+            if self.cfgPath:
+                try:
+                    os.unlink(self.cfgPath)
+                except OSError:
+                    pass
+                self.cfgPath = None
+            return result
+        return d.addBoth(bb_cleanup)
+
     def launch(self, msg):
         task = msg.task
         log.info("Task %s starting: job %s, task '%s'", task.task_uuid.short,
@@ -116,14 +191,6 @@ class LauncherService(MultiService):
         msg = message.TaskStatus(task.freeze())
         self.bus.sendToTarget(msg)
 
-    def forwardTaskLogs(self, task, records):
-        msg = message.LogRecords(
-                records=records,
-                job_uuid=task.job_uuid,
-                task_uuid=task.task_uuid,
-                )
-        self.bus.sendToTarget(msg)
-
 
 class LauncherBusService(BusClientService):
 
@@ -139,6 +206,9 @@ class LauncherBusService(BusClientService):
         if jid.userhost() != self.cfg.dispatcherJID.userhost():
             return
         log.info("Connected to dispatcher")
+        # The dispatcher may have restarted and forgotten about us, so start
+        # over with a full heartbeat.
+        self.parent.heartbeat.resync()
         # Call up to the daemon instance so it can set the process title.
         self.parent.parent.targetConnected(self.jid, jid)
 
@@ -149,19 +219,110 @@ class LauncherBusService(BusClientService):
 
 
 class HeartbeatService(TimerService):
+    """Periodically report the worker's state to the dispatcher.
+
+    Most heartbeats are L{message.HeartbeatDelta}s carrying only what changed
+    since the previous beat. A full L{message.Heartbeat} goes out every
+    C{snapshotInterval} beats and after L{resync} is called.
+
+    Statistics are collected in a thread so that slow providers can't hold
+    up the heartbeat; each beat reports the most recently collected values.
+    """
+
+    # Send a full snapshot every this many heartbeats. Dispatchers that only
+    # speak protocol 3 drop deltas and expire a worker after 4 missed checks
+    # 5 seconds apart, so snapshots must come well within that window.
+    snapshotInterval = 3
+    # Rescan interface addresses at least this often (in seconds), even if
+    # netlink didn't report a change.
+    addressInterval = 300
 
     def __init__(self, launcher, interval=5):
         self.launcher = launcher
         TimerService.__init__(self, interval, self.heartbeat)
         self.sent_hello = False
         self.netlink = netlink.RoutingNetlink()
+        self.monitor = netlink.AddressMonitor()
+        self.addresses = None
+        self.addressesScanned = None
+        self.last = None
+        self.beats = 0
+        self.stats = {}
+        self.collecting = False
+
+    def stopService(self):
+        self.monitor.close()
+        return TimerService.stopService(self)
+
+    def resync(self):
+        """Make the next heartbeat a full snapshot."""
+        self.last = None
+
+    def getAddresses(self):
+        now = time.time()
+        if (self.monitor.changed() or self.addresses is None
+                or now - self.addressesScanned >= self.addressInterval):
+            self.addresses = frozenset(x[1]
+                    for x in self.netlink.getAllAddresses())
+            self.addressesScanned = now
+        return self.addresses
+
+    def collectStats(self):
+        """
+        Start collecting statistics unless that is already running, and
+        return a L{Deferred} that fires when they are in, or C{None}.
+        """
+        if self.collecting or not self.launcher.statsProviders:
+            return None
+        self.collecting = True
+        d = threads.deferToThread(self._collectStats,
+                list(self.launcher.statsProviders), dict(self.stats))
+        def collected(stats):
+            self.collecting = False
+            self.stats = stats
+        d.addCallback(collected)
+        return d
+
+    @staticmethod
+    def _collectStats(providers, stats):
+        # Providers that fail keep their previous values.
+        for provider in providers:
+            try:
+                stats.update(provider())
+            except:
+                log.exception("Error collecting worker statistics:")
+        return stats
 
     def heartbeat(self):
-        tasks = self.launcher.pool.getTaskList()
-        slots = self.launcher.cfg.getSlots()
-        addresses = set(x[1] for x in self.netlink.getAllAddresses())
-        msg = message.Heartbeat(caps=self.launcher.caps, tasks=tasks,
-                slots=slots, addresses=addresses)
+        affinity = set()
+        for provider in self.launcher.affinityProviders:
+            try:
+                affinity.update(provider())
+            except:
+                log.exception("Error collecting worker affinity keys:")
+        stats = self.stats
+        self.collectStats()
+        state = dict(
+                caps=frozenset(self.launcher.caps),
+                tasks=self.launcher.pool.getTaskList(),
+                slots=self.launcher.cfg.getSlots(),
+                addresses=self.getAddresses(),
+                affinity=affinity,
+                stats=stats,
+                )
+
+        self.beats += 1
+        if self.last is None or self.beats >= self.snapshotInterval:
+            self.beats = 0
+            msg = message.Heartbeat(**state)
+        else:
+            delta = {}
+            for key, value in state.items():
+                if value == self.last[key]:
+                    value = None
+                delta[key] = value
+            msg = message.HeartbeatDelta(**delta)
+        self.last = state
         self.launcher.bus.sendToTarget(msg)
 
 
@@ -190,6 +351,9 @@ class PoolService(pool.ProcessPool):
 class WorkerConfig(BusClientConfig):
     lockDir             = (cfgtypes.CfgPath, '/var/lock')
     logDir              = (cfgtypes.CfgPath, '/var/log/rmake')
+    # Bytes of log records to hold per task while the dispatcher is slow to
+    # accept them. Records past this are dropped.
+    logBufferSize       = (cfgtypes.CfgInt, 4 * 1024 * 1024)
     slots               = (cfgtypes.CfgInt, 2)
     slotsByType         = cfgtypes.CfgDict(cfgtypes.CfgInt)
     zone                = (cfgtypes.CfgList(cfgtypes.CfgString), [])
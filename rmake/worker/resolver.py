@@ -39,6 +39,7 @@ class ResolveResult(object):
         self.missingDeps = []
         self.inCycle = inCycle
         self.jobHash = None
+        self.depSolutions = None
 
     def getBuildReqs(self):
         assert(self.success)
@@ -87,6 +88,11 @@ class ResolveResult(object):
         d.update(bootstrapReqs=freeze('installJobList', self.bootstrapReqs))
         d.update(missingDeps=freeze('dependencyMissingList', 
                                     self.missingDeps))
+        depSolutions = d.pop('depSolutions', None)
+        if depSolutions is not None:
+            # Only hand back what this resolution added to the job's memo.
+            d.update(depSolutions=freeze('DependencySolutionMemo',
+                                         depSolutions.getAdded()))
         return d
 
     @classmethod
@@ -99,6 +105,9 @@ class ResolveResult(object):
         self.missingDeps = thaw('dependencyMissingList', self.missingDeps)
         self.missingBuildReqs = [(x[0], thaw('troveSpec', x[1])) 
                                  for x in self.missingBuildReqs]
+        if self.depSolutions is not None:
+            self.depSolutions = thaw('DependencySolutionMemo',
+                                     self.depSolutions)
         return self
 
 
@@ -129,8 +138,9 @@ class DependencyResolver(object):
             builtTroves = []
         else:
             builtTroves = self.repos.getTroves(builtTroveTups, withFiles=False)
+        memo = resolveJob.getDependencyMemo()
         builtTroveSource = resolvesource.BuiltTroveSource(builtTroves,
-                                                          self.repos)
+                                                          self.repos, memo)
         if builtTroves:
             # this makes sure that if someone searches for a buildreq on
             # :branch, and the only thing we have is on :branch/rmakehost,
@@ -141,7 +151,7 @@ class DependencyResolver(object):
         if cfg.resolveTroveTups:
             searchSource, resolveSource = self.getSourcesWithResolveTroves(cfg,
                                                     cfg.resolveTroveTups,
-                                                    builtTroveSource)
+                                                    builtTroveSource, memo)
         else:
             searchSource = resolvesource.DepHandlerSource(builtTroveSource,
                                                           [], self.repos,
@@ -149,13 +159,13 @@ class DependencyResolver(object):
             resolveSource = resolvesource.rMakeResolveSource(cfg,
                                                         builtTroveSource, [],
                                                         None,
-                                                        self.repos)
+                                                        self.repos, memo)
         if cross:
             resolveSource.removeFileDependencies = True
         return searchSource, resolveSource
 
     def getSourcesWithResolveTroves(self, cfg, resolveTroveTups,
-                                    builtTroveSource):
+                                    builtTroveSource, memo=None):
         resolveTroves = []
         searchSourceTroves = []
         allResolveTroveTups = list(itertools.chain(*cfg.resolveTroveTups))
@@ -182,7 +192,7 @@ class DependencyResolver(object):
                                                 builtTroveSource,
                                                 searchSource.resolveTroveSource,
                                                 searchSourceTroves,
-                                                self.repos)
+                                                self.repos, memo)
         return searchSource, resolveSource
 
     def resolve(self, resolveJob):
@@ -219,6 +229,7 @@ class DependencyResolver(object):
         self.logger.debug('attempting to resolve buildreqs for %s=%s[%s]' % resolveJob.getTrove().getNameVersionFlavor())
 
         resolveResult = ResolveResult(inCycle=resolveJob.inCycle)
+        resolveResult.depSolutions = resolveJob.getDependencyMemo()
 
         buildReqs = trv.getBuildRequirementSpecs()
         crossReqs = trv.getCrossRequirementSpecs()
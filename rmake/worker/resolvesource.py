@@ -17,12 +17,190 @@
 
 import itertools
 from conary.deps import deps
+from conary.lib import digestlib
 from conary.local import deptable
 
 from conary.conaryclient import resolve
 from conary.repository import trovesource
 
 from rmake.lib import flavorutil
+from rmake.lib.apiutils import freeze, thaw, register
+
+
+class DependencySolutionMemo(object):
+    """
+        Job-scoped memo of dependency solutions.
+
+        Entries are keyed on the fingerprint of the source that answered the
+        query and a single dependency, so solutions found while resolving
+        one trove can be reused by every other trove in the same job.  The
+        dispatcher hands the entries a resolve job can use (see
+        L{getMemoPrefixes}) out with it and merges back the entries added by
+        the worker.
+    """
+
+    def __init__(self):
+        self._solutions = {}
+        self._added = set()
+
+    def __len__(self):
+        return len(self._solutions)
+
+    def get(self, fingerprint, depKey):
+        return self._solutions.get((fingerprint, depKey))
+
+    def set(self, fingerprint, depKey, solutions):
+        key = fingerprint, depKey
+        self._solutions[key] = solutions
+        self._added.add(key)
+
+    def discard(self, prefix):
+        """Drop all entries whose source fingerprint starts with C{prefix}."""
+        for key in [x for x in self._solutions if x[0].startswith(prefix)]:
+            del self._solutions[key]
+            self._added.discard(key)
+
+    def update(self, other):
+        self._solutions.update(other._solutions)
+
+    def subset(self, prefixes):
+        """
+        Return a memo holding only the entries whose source fingerprint
+        starts with one of C{prefixes}.
+        """
+        prefixes = tuple(prefixes)
+        memo = DependencySolutionMemo()
+        for key, solutions in self._solutions.iteritems():
+            if key[0].startswith(prefixes):
+                memo._solutions[key] = solutions
+        return memo
+
+    def getAdded(self):
+        """Return a memo holding only the entries added since thawing."""
+        memo = DependencySolutionMemo()
+        for key in self._added:
+            if key in self._solutions:
+                memo._solutions[key] = self._solutions[key]
+        return memo
+
+    def __freeze__(self):
+        return [(fingerprint, depKey, freeze('troveTupleList', solutions))
+                for (fingerprint, depKey), solutions
+                in self._solutions.iteritems()]
+
+    @classmethod
+    def __thaw__(class_, frozen):
+        self = class_()
+        for fingerprint, depKey, solutions in frozen:
+            self._solutions[fingerprint, depKey] = thaw('troveTupleList',
+                                                        solutions)
+        return self
+register(DependencySolutionMemo)
+
+
+def _hashTroveTups(troveTups):
+    troves = sorted('%s=%s[%s]' % tuple(x) for x in troveTups)
+    return digestlib.sha1('\0'.join(troves)).hexdigest()
+
+
+def getBuiltFingerprint(troveTups):
+    """Memo fingerprint of a L{BuiltTroveSource} holding C{troveTups}."""
+    return 'built:' + _hashTroveTups(troveTups)
+
+
+def getGroupsPrefix(troveTups):
+    """Memo fingerprint prefix for repository queries by group."""
+    return 'repos:groups:%s' % _hashTroveTups(troveTups)
+
+
+def getLabelPrefix(label):
+    """Memo fingerprint prefix for repository queries on C{label}."""
+    return 'repos:%s:' % (label,)
+
+
+def getMemoPrefixes(cfg, label, builtTroves, crossTroves):
+    """
+        Return the memo fingerprint prefixes a resolve job can use, given its
+        build config, the label of the trove and the built troves it is sent
+        with.
+    """
+    builtSets = [[], builtTroves, list(crossTroves) + list(builtTroves)]
+    prefixes = [getBuiltFingerprint(x) + ':' for x in builtSets]
+    prefixes.extend(getGroupsPrefix(x) for x in cfg.resolveTroveTups)
+    labels = list(cfg.installLabelPath or []) + [label]
+    prefixes.extend(getLabelPrefix(x) for x in labels)
+    return prefixes
+
+
+def resolveWithMemo(memo, fingerprint, depList, resolveFn):
+    """
+        Answer C{depList} from C{memo} where possible, calling
+        C{resolveFn(depList)} once for whatever dependencies are left over
+        and recording the results.  Returns the usual suggestion map of
+        depSet -> list of solution lists in sorted dependency order.
+    """
+    allFound = []
+    allToFind = []
+    for depSet in depList:
+        found = []
+        toFind = deps.DependencySet()
+        missing = []
+        for idx, (depClass, dep) in enumerate(depSet.iterDeps(sort=True)):
+            single = deps.DependencySet()
+            single.addDep(depClass, dep)
+            depKey = single.freeze()
+            solutions = memo.get(fingerprint, depKey)
+            if solutions is None:
+                toFind.addDep(depClass, dep)
+                missing.append((idx, depKey))
+            found.append(solutions)
+        allFound.append((depSet, found, toFind, missing))
+        if not toFind.isEmpty():
+            allToFind.append(toFind)
+
+    if allToFind:
+        results = resolveFn(allToFind)
+        for depSet, found, toFind, missing in allFound:
+            if toFind.isEmpty():
+                continue
+            solListList = results.get(toFind)
+            if solListList is None:
+                solListList = [[] for x in missing]
+            for (idx, depKey), solutions in itertools.izip(missing,
+                                                           solListList):
+                memo.set(fingerprint, depKey, list(solutions))
+                found[idx] = solutions
+
+    return dict((depSet, [list(x) for x in found])
+                for depSet, found, toFind, missing in allFound)
+
+
+class MemoizingTroveSource(object):
+    """
+        Wraps a repository trove source so that dependency queries are
+        answered from a L{DependencySolutionMemo} where possible.
+    """
+
+    def __init__(self, troveSource, memo):
+        self._troveSource = troveSource
+        self._memo = memo
+
+    def __getattr__(self, key):
+        return getattr(self._troveSource, key)
+
+    def resolveDependencies(self, label, depList, *args, **kw):
+        fingerprint = '%s%r:%r' % (getLabelPrefix(label), args,
+                                   sorted(kw.items()))
+        return resolveWithMemo(self._memo, fingerprint, depList,
+                lambda x: self._troveSource.resolveDependencies(label, x,
+                                                                *args, **kw))
+
+    def resolveDependenciesByGroups(self, groupTroves, depList):
+        fingerprint = getGroupsPrefix(x.getNameVersionFlavor()
+                                      for x in groupTroves)
+        return resolveWithMemo(self._memo, fingerprint, depList,
+                lambda x: self._troveSource.resolveDependenciesByGroups(
+                                                            groupTroves, x))
 
 
 class TroveSourceMesh(trovesource.SearchableTroveSource):
@@ -360,12 +538,14 @@ class BuiltTroveSource(trovesource.SimpleTroveSource):
         Trove source that is used for dep resolution and buildreq satisfaction 
         only - it does not contain references to the changesets that are added
     """
-    def __init__(self, troves, repos):
+    def __init__(self, troves, repos, memo=None):
         self.depDb = deptable.DependencyDatabase()
         trovesource.SimpleTroveSource.__init__(self)
         self.setFlavorPreferenceList(repos._flavorPreferences)
         self.idMap = []
         self.idx = 0
+        self.memo = memo
+        self._fingerprint = None
         for trove in troves:
             self.addTrove(trove.getNameVersionFlavor(), trove.getProvides(),
                           trove.getRequires())
@@ -383,6 +563,16 @@ class BuiltTroveSource(trovesource.SimpleTroveSource):
         self.idMap.append(troveTuple)
         self.depDb.add(self.idx, provides, requires)
         self.idx += 1
+        if self._fingerprint is not None:
+            # Solutions memoized against the old set of troves are stale.
+            if self.memo is not None:
+                self.memo.discard(self._fingerprint + ':')
+            self._fingerprint = None
+
+    def getFingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = getBuiltFingerprint(self.idMap)
+        return self._fingerprint
 
     def addChangeSet(self, cs):
         for idx, trvCs in enumerate(cs.iterNewTroveList()):
@@ -390,6 +580,15 @@ class BuiltTroveSource(trovesource.SimpleTroveSource):
                           trvCs.getRequires())
 
     def resolveDependencies(self, label, depList, leavesOnly=False):
+        if self.memo is not None:
+            fingerprint = '%s:%s:%s' % (self.getFingerprint(), label,
+                                        self._allowNoLabel)
+            return resolveWithMemo(self.memo, fingerprint, depList,
+                                   lambda x: self._resolveDependencies(label,
+                                                                       x))
+        return self._resolveDependencies(label, depList)
+
+    def _resolveDependencies(self, label, depList):
         suggMap = self.depDb.resolve(label, depList)
         for depSet, solListList in suggMap.iteritems():
             newSolListList = []
@@ -566,7 +765,9 @@ class rMakeResolveSource(ResolutionMesh):
     """
 
     def __init__(self, cfg, builtTroveSource, resolveTroveSource,
-                 troveLists, repos):
+                 troveLists, repos, memo=None):
+        if memo is not None:
+            repos = MemoizingTroveSource(repos, memo)
         self.removeFileDependencies = False
         self.builtTroveSource = builtTroveSource
         self.troveLists = troveLists
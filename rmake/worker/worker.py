@@ -171,6 +171,12 @@ class Worker(server.Server):
     def listChrootsWithHost(self):
         return [('_local_', x) for x in self.chrootManager.listChroots()]
 
+    def listCachedChroots(self):
+        return self.chrootManager.listCachedChroots()
+
+    def getChrootCacheStats(self):
+        return self.chrootManager.getChrootCacheStats()
+
     def _checkForResults(self):
         return self._serveLoopHook()
 
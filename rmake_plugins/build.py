@@ -28,12 +28,14 @@ from rmake.build import server
 from rmake.build import servercfg
 from rmake.build import worker
 from rmake.core import plug_dispatcher
+from rmake.lib import repocache
 from rmake.worker import plug_worker
 
 log = logging.getLogger(__name__)
 
 
-class BuildPlugin(plug_dispatcher.DispatcherPlugin, plug_worker.WorkerPlugin):
+class BuildPlugin(plug_dispatcher.DispatcherPlugin, plug_worker.WorkerPlugin,
+        plug_worker.LauncherPlugin):
 
     cfg = None
 
@@ -45,6 +47,7 @@ class BuildPlugin(plug_dispatcher.DispatcherPlugin, plug_worker.WorkerPlugin):
         self.cfg = self.configFromOptions(servercfg.rMakeConfiguration)
         self.server = server.BuildServer(dispatcher, self.cfg)
         dispatcher._addChild('build', self.server)
+        server.TroveStatsAggregator(self.server).setServiceParent(dispatcher)
 
     def dispatcher_post_setup(self, dispatcher):
         from twisted.internet import reactor
@@ -62,6 +65,25 @@ class BuildPlugin(plug_dispatcher.DispatcherPlugin, plug_worker.WorkerPlugin):
             log.exception("Error starting server:")
             reactor.stop()
 
+    # Launcher
+
+    def launcher_post_setup(self, launcher):
+        # Advertise cached chroots so builds are sent where a restore is free.
+        nodeCfg = self.configFromOptions(nodecfg.NodeConfiguration)
+        chrootCache = nodeCfg.getChrootCache()
+        if chrootCache:
+            launcher.affinityProviders.append(chrootCache.listAffinityKeys)
+            launcher.statsProviders.append(lambda: dict(
+                ('chroot_cache_' + x, y)
+                for (x, y) in chrootCache.getStats().iteritems()))
+        if nodeCfg.useCache:
+            # Don't hold up the stats of other providers for long if a
+            # big cache update has the index locked.
+            index = repocache.CacheIndex(nodeCfg.getCacheDir(), timeout=5)
+            launcher.statsProviders.append(lambda: dict(
+                ('changeset_cache_' + x, y)
+                for (x, y) in index.getStats().iteritems()))
+
     # Worker
 
     def worker_get_task_types(self):
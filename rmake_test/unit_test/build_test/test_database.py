@@ -0,0 +1,207 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+import re
+import sqlite3
+import time
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from rmake.build import database
+from rmake.core import database as core_database
+
+
+def _translate(statement, args):
+    """Convert a psycopg2-style query to sqlite's parameter style."""
+    if isinstance(args, dict):
+        return re.sub(r'%\((\w+)\)s', r':\1', statement), args
+    parts = statement.split('%s')
+    out, params = parts[0], []
+    for arg, part in zip(args or (), parts[1:]):
+        if isinstance(arg, tuple):
+            out += '(' + ', '.join('?' * len(arg)) + ')'
+            params.extend(arg)
+        else:
+            out += '?'
+            params.append(arg)
+        out += part
+    return out, params
+
+
+class _Cursor(object):
+
+    def __init__(self, conn):
+        self.cu = conn.cursor()
+
+    def execute(self, statement, args=None):
+        self.cu.execute(*_translate(statement, args))
+        return defer.succeed(self)
+
+    def fetchone(self):
+        return self.cu.fetchone()
+
+    def fetchall(self):
+        return self.cu.fetchall()
+
+
+class SqlitePool(object):
+    """Stand-in for the database pool that runs the queries on sqlite.
+
+    Tables are created from the build schema with the PostgreSQL-only bits
+    stripped, so the statements run against the real column layout.
+    """
+
+    def __init__(self, tables):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("ATTACH ':memory:' AS build")
+        self.conn.create_function('now', 0,
+                lambda: time.strftime('%Y-%m-%d %H:%M:%S'))
+        self.conn.create_function('least', -1, min)
+        self.conn.create_function('greatest', -1, max)
+        sql = open(os.path.join(os.path.dirname(core_database.__file__),
+            'schema', 'master', '20_build.sql')).read()
+        for table in tables:
+            body = re.search(r'CREATE TABLE %s \((.*?)\n\);' % table, sql,
+                    re.S).group(1)
+            body = re.sub(r'REFERENCES \S+ ON UPDATE CASCADE ON DELETE '
+                    'CASCADE', '', body)
+            body = body.replace('bigserial PRIMARY KEY',
+                    'integer PRIMARY KEY AUTOINCREMENT')
+            body = body.replace('timestamp with time zone DEFAULT now()',
+                    'timestamp DEFAULT CURRENT_TIMESTAMP')
+            self.conn.execute('CREATE TABLE build.%s (%s)' % (table, body))
+
+    def runQuery(self, statement, args=None):
+        return defer.succeed(
+                self.conn.execute(*_translate(statement, args)).fetchall())
+
+    def runOperation(self, statement, args=None):
+        self.conn.execute(*_translate(statement, args))
+        self.conn.commit()
+        return defer.succeed(None)
+
+    def runInteraction(self, func, *args, **kwargs):
+        d = defer.maybeDeferred(func, _Cursor(self.conn), *args, **kwargs)
+        def cb_commit(result):
+            self.conn.commit()
+            return result
+        def eb_rollback(reason):
+            self.conn.rollback()
+            return reason
+        d.addCallbacks(cb_commit, eb_rollback)
+        return d
+
+
+class TroveStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SqlitePool(['trove_timings', 'trove_stats'])
+        self.db = database.JobStore(self.pool)
+
+    def _stats(self, *args):
+        d = self.db.getTroveStats(*args)
+        d.addCallback(lambda rows: dict(
+            ((x['source_name'], x['worker'], x['phase']),
+                (x['samples'], x['mean_duration'], x['min_duration'],
+                    x['max_duration'], x['last_duration']))
+            for x in rows))
+        return self.successResultOf(d)
+
+    def _add(self, name, duration, worker='w1', phase='build'):
+        self.successResultOf(self.db.addTroveTiming(name, 'is: x86', worker,
+            phase, duration))
+
+    def _aggregate(self):
+        self.successResultOf(self.db.aggregateTroveStats())
+        self.assertEqual(self.pool.conn.execute(
+            "SELECT count(*) FROM build.trove_timings").fetchone()[0], 0)
+
+    def test_aggregate(self):
+        """Repeated passes merge new samples into the existing rows."""
+        self._aggregate()
+        self.assertEqual(self._stats(), {})
+
+        self._add('foo', 10)
+        self._add('foo', 20)
+        self._add('foo', 3, phase='resolve')
+        self._add('bar', 5, worker='w2')
+        self._aggregate()
+        self.assertEqual(self._stats(), {
+            ('foo', 'w1', 'build'): (2, 15, 10, 20, 20),
+            ('foo', 'w1', 'resolve'): (1, 3, 3, 3, 3),
+            ('bar', 'w2', 'build'): (1, 5, 5, 5, 5),
+            })
+
+        self._add('foo', 30)
+        self._add('foo', 4)
+        self._add('baz', 1)
+        self._aggregate()
+        self.assertEqual(self._stats(), {
+            ('foo', 'w1', 'build'): (4, 16, 4, 30, 4),
+            ('foo', 'w1', 'resolve'): (1, 3, 3, 3, 3),
+            ('bar', 'w2', 'build'): (1, 5, 5, 5, 5),
+            ('baz', 'w1', 'build'): (1, 1, 1, 1, 1),
+            })
+
+        # Nothing new, nothing changes.
+        self._aggregate()
+        self.assertEqual(len(self._stats()), 4)
+
+    def test_filter(self):
+        self._add('foo', 10)
+        self._add('foo', 3, phase='resolve')
+        self._add('bar', 5)
+        self._aggregate()
+        self.assertEqual(sorted(self._stats(['foo', 'baz'])),
+                [('foo', 'w1', 'build'), ('foo', 'w1', 'resolve')])
+        self.assertEqual(sorted(self._stats(None, 'build')),
+                [('bar', 'w1', 'build'), ('foo', 'w1', 'build')])
+        self.assertEqual(sorted(self._stats(['bar'], 'resolve')), [])
+
+
+class TroveStatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SqlitePool(['trove_states'])
+        self.db = database.JobStore(self.pool)
+
+    def _states(self, job_uuid):
+        rows = self.successResultOf(self.db.getTroveStates(job_uuid))
+        return sorted((x['source_name'], x['build_context'], x['state'],
+            x['status']) for x in rows)
+
+    def test_upsert(self):
+        """Rows are inserted the first time and updated after that."""
+        self.successResultOf(self.db.updateTroveStates('job1', [
+            ('foo:source', '/a@b:c/1-1', '', '', 1, ''),
+            ('bar:source', '/a@b:c/1-1', '', '', 1, ''),
+            ]))
+        self.successResultOf(self.db.updateTroveStates('job2', [
+            ('foo:source', '/a@b:c/1-1', '', '', 1, ''),
+            ]))
+        self.successResultOf(self.db.updateTroveStates('job1', [
+            ('foo:source', '/a@b:c/1-1', '', '', 2, 'Building'),
+            ('foo:source', '/a@b:c/1-1', '', 'x86', 1, ''),
+            ]))
+        self.assertEqual(self._states('job1'), [
+            ('bar:source', '', 1, ''),
+            ('foo:source', '', 2, 'Building'),
+            ('foo:source', 'x86', 1, ''),
+            ])
+        self.assertEqual(self._states('job2'), [('foo:source', '', 1, '')])
@@ -0,0 +1,178 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import cPickle
+import random
+from conary import versions
+from conary.deps import deps
+from testutils import mock
+from twisted.trial import unittest
+
+from rmake.build import dephandler
+from rmake.worker import resolvesource
+
+
+def _tup(name, label='localhost@rpl:linux'):
+    return (name, versions.VersionFromString('/%s/1.0-1-1' % label),
+            deps.parseFlavor(''))
+
+
+class DependencyMemoTest(unittest.TestCase):
+
+    def tearDown(self):
+        mock.unmockAll()
+
+    def test_troveBuilt(self):
+        """Built troves invalidate queries on the labels they went to."""
+        dh = dephandler.DependencyHandler.__new__(
+                dephandler.DependencyHandler)
+        dh.depState = mock.MockObject()
+        dh._delayed = {}
+        dh._possibleDuplicates = {}
+        dh._depMemo = memo = resolvesource.DependencySolutionMemo()
+        built = versions.Label('rmakehost@local:linux')
+        other = versions.Label('localhost@rpl:linux')
+        for fingerprint in ['built:a:x', resolvesource.getLabelPrefix(built),
+                resolvesource.getLabelPrefix(other), 'repos:groups:a']:
+            memo.set(fingerprint, 'dep', [])
+
+        dh.troveBuilt(None, [_tup('foo', str(built))])
+        self.assertEqual(sorted(x[0] for x in memo._solutions),
+                sorted([resolvesource.getLabelPrefix(other),
+                    'repos:groups:a']))
+
+
+class _OldNodeData(object):
+    """Stands in for the node table of conary's DirectedGraph."""
+
+    def __init__(self, data):
+        self.data = data
+        self.hashedData = dict((x, idx) for (idx, x) in enumerate(data)
+                if x is not None)
+
+
+class DependencyGraphTest(unittest.TestCase):
+    """Compare the graph with a brute force model on random graphs."""
+
+    def _randomGraph(self, rand, size):
+        graph = dephandler.DependencyGraph()
+        edges = {}
+        nodes = set()
+        names = ['n%d' % x for x in range(size)]
+        for x in range(size * 3):
+            action = rand.random()
+            fromNode, toNode = rand.choice(names), rand.choice(names)
+            if action < 0.8:
+                value = (False, (rand.choice('ab'), None, None))
+                graph.addEdge(fromNode, toNode, value)
+                nodes.update([fromNode, toNode])
+                edges[fromNode, toNode] = value
+            elif action < 0.9:
+                graph.delete(fromNode)
+                nodes.discard(fromNode)
+                for edge in list(edges):
+                    if fromNode in edge:
+                        del edges[edge]
+            else:
+                graph.deleteEdges(fromNode)
+                for edge in list(edges):
+                    if edge[0] == fromNode:
+                        del edges[edge]
+        return graph, nodes, edges
+
+    def _reachable(self, nodes, edges):
+        """Map each node to the nodes reachable from it, itself included."""
+        reach = dict((x, set([x])) for x in nodes)
+        changed = True
+        while changed:
+            changed = False
+            for fromNode, toNode in edges:
+                new = reach[toNode] - reach[fromNode]
+                if new:
+                    reach[fromNode].update(new)
+                    changed = True
+        return reach
+
+    def _check(self, graph, nodes, edges):
+        self.assertEqual(set(graph), nodes)
+        self.assertEqual(len(graph), len(nodes))
+        for node in nodes:
+            assert node in graph
+            self.assertEqual(sorted(graph.getChildren(node, withEdges=True)),
+                    sorted((y, v) for ((x, y), v) in edges.items()
+                        if x == node))
+            self.assertEqual(sorted(graph.getParents(node, withEdges=True)),
+                    sorted((x, v) for ((x, y), v) in edges.items()
+                        if y == node))
+        self.assertEqual(sorted(graph.getLeaves()),
+                sorted(x for x in nodes if not [y for y in edges
+                    if y[0] == x]))
+
+        reach = self._reachable(nodes, edges)
+        components = graph.getStronglyConnectedComponents()
+        self.assertEqual(sorted(sum([list(x) for x in components], [])),
+                sorted(nodes))
+        for component in components:
+            for node in nodes:
+                member = iter(component).next()
+                self.assertEqual(node in component,
+                        node in reach[member] and member in reach[node])
+
+        sccGraph = graph.getStronglyConnectedGraph()
+        sccEdges = set()
+        for fromNode, toNode in edges:
+            fromComp = [x for x in components if fromNode in x][0]
+            toComp = [x for x in components if toNode in x][0]
+            if fromComp != toComp:
+                sccEdges.add((fromComp, toComp))
+        self.assertEqual(set((x, y) for x in sccGraph
+            for y in sccGraph.getChildren(x)), sccEdges)
+
+        starts, finishes, trees = graph.doDFS()
+        seen = set()
+        for root, tree in trees.items():
+            tree = set(graph.get(x) for x in tree)
+            assert not tree & seen
+            seen.update(tree)
+            assert tree <= reach[graph.get(root)]
+        self.assertEqual(seen, nodes)
+        for fromNode, toNode in edges:
+            # Children finish before their parents unless they are in a
+            # cycle together.
+            fromIdx, toIdx = graph.getIndex(fromNode), graph.getIndex(toNode)
+            if fromNode not in reach[toNode]:
+                assert finishes[toIdx] < finishes[fromIdx]
+
+    def test_random(self):
+        rand = random.Random(1234)
+        for x in range(200):
+            graph, nodes, edges = self._randomGraph(rand, rand.randint(1, 12))
+            self._check(graph, nodes, edges)
+            graph = cPickle.loads(cPickle.dumps(graph, 2))
+            self._check(graph, nodes, edges)
+
+    def test_old_state(self):
+        """Graphs pickled by the conary based implementation still load."""
+        value = (False, ('a', None, None))
+        state = {
+                'data': _OldNodeData(['a', None, 'c', 'd']),
+                'edges': {0: {2: value, 1: value}, 2: {3: value}, 3: {}},
+                }
+        graph = dephandler.DependencyGraph.__new__(
+                dephandler.DependencyGraph)
+        graph.__setstate__(state)
+        self._check(graph, set('acd'), {('a', 'c'): value, ('c', 'd'): value})
@@ -0,0 +1,263 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from conary import versions
+from conary.deps import deps
+from testutils import mock
+from twisted.internet import defer
+from twisted.internet import task as tw_task
+from twisted.trial import unittest
+
+from rmake.build import buildjob
+from rmake.build import buildtrove
+from rmake.build import constants as buildconst
+from rmake.build import disp_handler
+from rmake.core import types
+from rmake.lib import uuid
+
+
+def _troveTup(name, label='localhost@rpl:linux', context=''):
+    version = versions.VersionFromString('/%s/1.0-1' % label)
+    return (name + ':source', version, deps.parseFlavor(''), context)
+
+
+class LoadSplitTest(unittest.TestCase):
+
+    def setUp(self):
+        job = types.RmakeJob(uuid.uuid4(), 'build', 'spam',
+                data='ham').freeze()
+        self.handler = disp_handler.BuildHandler(mock.MockObject(), job, None)
+        self.handler.cfg = mock.MockObject()
+
+    def tearDown(self):
+        mock.unmockAll()
+
+    def _makeJob(self, troveTups):
+        job = buildjob.BuildJob(uuid.uuid4(), 1, 'spam')
+        self.publisher = object()
+        job.setPublisher(self.publisher)
+        for troveTup in troveTups:
+            job.addTrove(*troveTup)
+        return job
+
+    def test_split_small(self):
+        self.handler.cfg.loadTroveLimit = 10
+        troveTups = [_troveTup('foo'), _troveTup('bar')]
+        self.assertEqual(self.handler._split_load(troveTups), [troveTups])
+        # Zero disables splitting
+        self.handler.cfg.loadTroveLimit = 0
+        self.assertEqual(self.handler._split_load(troveTups), [troveTups])
+
+    def test_split_groups(self):
+        """Troves are grouped by context and label, then chunked."""
+        self.handler.cfg.loadTroveLimit = 2
+        a = [_troveTup(x) for x in 'abc']
+        b = [_troveTup(x, label='localhost@rpl:other') for x in 'de']
+        c = [_troveTup('f', context='x86')]
+        shards = self.handler._split_load(c + b + a)
+        self.assertEqual(sorted(shards),
+                sorted([a[:2], a[2:], b, c]))
+        self.assertEqual(sorted(sum(shards, [])), sorted(a + b + c))
+
+    def test_subjob(self):
+        """Subjobs share troves without taking over their publisher."""
+        troveTups = [_troveTup(x) for x in 'abc']
+        job = self._makeJob(troveTups)
+        subJob = job.getSubJob(troveTups[1:])
+        self.assertEqual(sorted(subJob.iterTroveList(True)),
+                sorted(troveTups[1:]))
+        self.assertEqual(subJob.jobUUID, job.jobUUID)
+        for troveTup in troveTups:
+            trove = job.getTrove(*troveTup)
+            assert trove.getPublisher() is self.publisher
+
+    def test_merge(self):
+        """Load results from each shard are copied into the main job."""
+        troveTups = [_troveTup(x) for x in 'abc']
+        job = self._makeJob(troveTups)
+        subJobs = []
+        for shard in (troveTups[:2], troveTups[2:]):
+            subJob = buildjob.BuildJob(job.jobUUID, 1, 'spam')
+            for troveTup in shard:
+                # Shards come back from the worker as copies
+                trove = buildtrove.BuildTrove(None, *troveTup)
+                trove.setFlavor(deps.parseFlavor('is: x86'))
+                trove.setBuildRequirements(['%s-req:devel' % troveTup[0]])
+                subJob.troves[troveTup] = trove
+            subJobs.append(subJob)
+
+        self.handler._merge_load(job, subJobs)
+        for troveTup in troveTups:
+            trove = job.getTrove(*troveTup)
+            self.assertEqual(trove.getFlavor(), deps.parseFlavor('is: x86'))
+            self.assertEqual(list(trove.getBuildRequirements()),
+                    ['%s-req:devel' % troveTup[0]])
+
+
+class _FakeDB(object):
+
+    def __init__(self):
+        self.timings = []
+        self.states = []
+
+    def addTroveTiming(self, *args):
+        self.timings.append(args)
+        return defer.succeed(None)
+
+    def updateTroveStates(self, job_uuid, states):
+        self.states.append(sorted(states))
+        return defer.succeed(None)
+
+
+class TimingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = tw_task.Clock()
+        disp = mock.MockObject()
+        disp._mock.set(clock=self.clock)
+        job = types.RmakeJob(uuid.uuid4(), 'build', 'spam',
+                data='ham').freeze()
+        self.handler = disp_handler.BuildHandler(disp, job, None)
+        self.db = _FakeDB()
+        self.handler.build_plugin = mock.MockObject()
+        self.handler.build_plugin.server._mock.set(db=self.db)
+        name, version, flavor, context = _troveTup('foo')
+        self.trove = buildtrove.BuildTrove(None, name, version,
+                deps.parseFlavor('is: x86'))
+
+    def tearDown(self):
+        mock.unmockAll()
+
+    def _watch(self, phase=buildconst.PHASE_BUILD):
+        task = self.handler.newTask('build', buildconst.BUILD_TASK, 'data')
+        self.handler._watchTiming(task, self.trove, phase)
+        return task
+
+    def _update(self, task, node=None, code=None):
+        task = task.thaw()
+        if node:
+            task.node_assigned = node
+        if code:
+            task.status = types.JobStatus(code, 'status')
+        self.handler.taskUpdated(task.freeze())
+        return task
+
+    def test_completed(self):
+        """One sample is recorded per task, timed from its assignment."""
+        task = self._watch()
+        self.clock.advance(100)
+        task = self._update(task, node='w1', code=101)
+        self.clock.advance(5)
+        task = self._update(task, code=102)
+        self.clock.advance(10)
+        self._update(task, code=200)
+        task = self._watch(buildconst.PHASE_RESOLVE)
+        task = self._update(task, node='w2')
+        self.clock.advance(2)
+        self._update(task, code=200)
+        self.assertEqual(self.db.timings, [
+            ('foo:source', 'is: x86', 'w1', buildconst.PHASE_BUILD, 15),
+            ('foo:source', 'is: x86', 'w2', buildconst.PHASE_RESOLVE, 2),
+            ])
+
+    def test_failed(self):
+        task = self._watch()
+        task = self._update(task, node='w1')
+        self.clock.advance(5)
+        self._update(task, code=400)
+        task = self._watch()
+        self._update(task, code=400)
+        self.assertEqual(self.db.timings, [])
+
+    def test_reassigned(self):
+        """Only the run on the last worker a task was assigned to counts."""
+        task = self._watch()
+        task = self._update(task, node='w1')
+        self.clock.advance(50)
+        task = self._update(task, node='w2')
+        self.assertEqual(self.db.timings, [])
+        self.clock.advance(5)
+        self._update(task, code=200)
+        self.assertEqual(self.db.timings, [
+            ('foo:source', 'is: x86', 'w2', buildconst.PHASE_BUILD, 5),
+            ])
+
+
+class TroveStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = tw_task.Clock()
+        self.disp = mock.MockObject()
+        self.disp._mock.set(clock=self.clock)
+        job = types.RmakeJob(uuid.uuid4(), 'build', 'spam',
+                data='ham').freeze()
+        self.handler = disp_handler.BuildHandler(self.disp, job, None)
+        self.db = _FakeDB()
+        self.handler.build_plugin = mock.MockObject()
+        self.handler.build_plugin.server._mock.set(db=self.db)
+        self.troves = []
+        for name in ('foo', 'bar'):
+            name, version, flavor, context = _troveTup(name)
+            self.troves.append(buildtrove.BuildTrove(None, name, version,
+                flavor))
+
+    def tearDown(self):
+        mock.unmockAll()
+
+    def _row(self, trv, state, status=''):
+        return (trv.getName(), trv.getVersion().freeze(),
+                trv.getFlavor().freeze(), trv.getContext(), state, status)
+
+    def test_batch(self):
+        """Changes from one reactor pass are written together, and only for
+        the troves that changed."""
+        foo, bar = self.troves
+        self.handler._troveStateUpdated(foo, buildtrove.TroveState.BUILDABLE,
+                None)
+        self.handler._troveStateUpdated(bar, buildtrove.TroveState.BUILDABLE,
+                None)
+        self.handler._troveStateUpdated(foo, buildtrove.TroveState.BUILDING,
+                'Building')
+        self.assertEqual(self.db.states, [])
+        self.clock.advance(0)
+        self.assertEqual(self.db.states, [sorted([
+            self._row(foo, buildtrove.TroveState.BUILDING, 'Building'),
+            self._row(bar, buildtrove.TroveState.BUILDABLE),
+            ])])
+
+        self.handler._troveStateUpdated(bar, buildtrove.TroveState.BUILDING,
+                'Building')
+        self.clock.advance(0)
+        self.assertEqual(self.db.states[1:], [
+            [self._row(bar, buildtrove.TroveState.BUILDING, 'Building')],
+            ])
+        self.clock.advance(1)
+        self.assertEqual(len(self.db.states), 2)
+        # The frozen job is left for the next phase boundary.
+        self.assertEqual(self.handler.job.data, 'ham')
+
+    def test_flush(self):
+        """Flushing early writes pending changes and cancels the timer."""
+        foo = self.troves[0]
+        self.handler._troveStateUpdated(foo, buildtrove.TroveState.BUILT,
+                None)
+        self.handler._flushTroveStates()
+        self.assertEqual(self.db.states,
+                [[self._row(foo, buildtrove.TroveState.BUILT)]])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.handler._flushTroveStates()
+        self.assertEqual(len(self.db.states), 1)
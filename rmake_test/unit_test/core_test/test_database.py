@@ -0,0 +1,54 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from rmake.core import database
+from rmake.core import types
+from rmake.lib import uuid
+
+
+class _FakePool(object):
+
+    def __init__(self):
+        self.queries = []
+
+    def runQuery(self, statement, args=None):
+        self.queries.append(statement)
+        return defer.succeed([])
+
+
+class UpdateJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = _FakePool()
+        self.db = database.CoreDB(self.pool)
+        self.job = types.RmakeJob(uuid.uuid4(), 'test', 'spam',
+                data='ham')
+        self.job.times.ticks = 1
+
+    def test_data(self):
+        """The frozen data is only written when asked for."""
+        self.db.updateJob(self.job)
+        self.db.updateJob(self.job, withData=False)
+        withData, withoutData = self.pool.queries
+        assert 'frozen_data' in withData.statement
+        self.assertEqual(withData.args[5], buffer('ham'))
+        assert 'frozen_data' not in withoutData.statement
+        assert buffer('ham') not in withoutData.args
@@ -114,7 +114,7 @@ class DispatcherTest(unittest.TestCase):
     def test_updateJob_normal(self):
         job = self.job.thaw()
         job.status.code = 100
-        def db_updateJob(newJob, frozen_handler):
+        def db_updateJob(newJob, frozen_handler, withData=True):
             self.assertEquals(newJob.job_uuid, job.job_uuid)
             self.assertEquals(frozen_handler, None)
             return defer.succeed(newJob.freeze())
@@ -133,7 +133,7 @@ class DispatcherTest(unittest.TestCase):
     def test_updateJob_finished(self):
         job = self.job.thaw()
         job.status.code = 200
-        def db_updateJob(newJob, frozen_handler):
+        def db_updateJob(newJob, frozen_handler, withData=True):
             self.assertEquals(newJob.job_uuid, job.job_uuid)
             self.assertEquals(frozen_handler, None)
             return defer.succeed(newJob.freeze())
@@ -210,7 +210,7 @@ class DispatcherTest(unittest.TestCase):
             types.TaskCapability('task.1'),
             types.ZoneCapability('zone.1'),
             ] + list(self.caps),
-            tasks=[], addresses=[], slots={None: 1})
+            tasks=[], addresses=[], slots={None: 1}, affinity=[], stats={})
         # Assignable
         w.setCaps(msg)
         result, score = self.disp._scoreTask(types.RmakeTask('task',
@@ -239,7 +239,7 @@ class DispatcherTest(unittest.TestCase):
             types.TaskCapability('task.1'),
             types.ZoneCapability('zone.1'),
             ] + list(self.caps),
-            tasks=[], addresses=[], slots={None: 1})
+            tasks=[], addresses=[], slots={None: 1}, affinity=[], stats={})
         w.setCaps(msg)
         assert w.supports([types.TaskCapability('task.1')])
         assert w.supports([types.ZoneCapability('zone.1')])
@@ -249,6 +249,43 @@ class DispatcherTest(unittest.TestCase):
         assert not w.supports([types.TaskCapability('zone.1')])
         assert not w.supports([types.TaskCapability('task.2')])
 
+    def test_workerAffinity(self):
+        w = dispatcher.WorkerInfo(jid.JID('ham@spam/eggs'))
+        msg = message.Heartbeat(caps=list(self.caps), tasks=[], addresses=[],
+                slots={None: 1}, affinity=set(['key']), stats={})
+        w.setCaps(msg)
+        self.assertEqual(w.affinity, frozenset(['key']))
+        # Workers that don't send affinity keys
+        class h_msg(object):
+            caps = self.caps
+            tasks = {}
+            slots = {None: 0}
+            addresses = set()
+        w.setCaps(h_msg())
+        self.assertEqual(w.affinity, frozenset())
+
+    def test_workerHeartbeatDelta(self):
+        w = jid.JID('ham@spam/eggs')
+        delta = message.HeartbeatDelta(caps=None, tasks=None, slots=None,
+                addresses=None, affinity=None, stats={'load': 2})
+        # Deltas from unknown workers are ignored until a snapshot arrives
+        self.disp.workerHeartbeat(w, delta)
+        self.assertEqual(self.disp.workers, {})
+
+        full = message.Heartbeat(caps=list(self.caps), tasks=[],
+                addresses=set(['1.2.3.4']), slots={None: 1},
+                affinity=set(['key']), stats={'load': 1})
+        self.disp.workerHeartbeat(w, full)
+        info = self.disp.workers[w]
+        info.expiring = 3
+        self.disp.workerHeartbeat(w, delta)
+        self.assertEqual(info.expiring, 0)
+        self.assertEqual(info.stats, {'load': 2})
+        self.assertEqual(info.addresses, set(['1.2.3.4']))
+        self.assertEqual(info.slots, {None: 1})
+        self.assertEqual(info.affinity, frozenset(['key']))
+        assert info.active
+
     def test_zoneNames(self):
         w = dispatcher.WorkerInfo(jid.JID('ham@spam/eggs'))
         msg = message.Heartbeat(caps=[
@@ -256,7 +293,7 @@ class DispatcherTest(unittest.TestCase):
             types.ZoneCapability('zone.1'),
             types.ZoneCapability('zone.2'),
             ] + list(self.caps),
-            tasks=[], addresses=[], slots={None: 1})
+            tasks=[], addresses=[], slots={None: 1}, affinity=[], stats={})
         w.setCaps(msg)
         assert sorted(w.zoneNames) == [
                 'zone.1', 'zone.2']
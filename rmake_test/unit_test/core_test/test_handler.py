@@ -16,6 +16,8 @@
 
 
 from testutils import mock
+from twisted.internet import defer
+from twisted.internet import task as tw_task
 from twisted.python import failure as tw_failure
 from twisted.trial import unittest
 
@@ -100,3 +102,77 @@ class DispatcherTest(unittest.TestCase):
         # make sure, we've touched "success" once the last callback fires.
         assert success
         self._raisePostponed()
+
+
+class _FakeDispatcher(object):
+
+    def __init__(self):
+        self.clock = tw_task.Clock()
+        self.updates = []
+
+    def updateJob(self, job, frozen_handler=None, withData=True):
+        d = defer.Deferred()
+        self.updates.append((withData, d))
+        return d
+
+
+class UpdateJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.disp = _FakeDispatcher()
+        job = types.RmakeJob(uuid.uuid4(), 'test', 'spam', data='ham')
+        self.handler = rmk_handler.JobHandler(self.disp, job, None)
+
+    def _update(self):
+        """Start an update and return whether it writes the job data."""
+        d = self.handler._updateJob()
+        withData, dbDeferred = self.disp.updates[-1]
+        return withData, d, dbDeferred
+
+    def test_unchanged(self):
+        """Status changes only rewrite the data after it was replaced."""
+        for code in (100, 101):
+            self.handler.setStatus(code, 'status')
+        self.assertEqual([x[0] for x in self.disp.updates], [True, False])
+        self.disp.updates[0][1].callback(self.handler.job)
+        self.disp.updates[1][1].callback(self.handler.job)
+        self.handler.setStatus(102, 'status')
+        self.handler.setData('eggs')
+        self.handler.setStatus(103, 'status')
+        self.handler.setStatus(104, 'status')
+        self.assertEqual([x[0] for x in self.disp.updates],
+                [True, False, False, True, False])
+
+    def test_superseded(self):
+        """The data is written again if the update did not happen."""
+        withData, d, dbd = self._update()
+        assert withData
+        dbd.callback(None)
+        withData, d, dbd = self._update()
+        assert withData
+        dbd.callback(self.handler.job)
+        withData, d, dbd = self._update()
+        assert not withData
+
+    def test_failed(self):
+        withData, d, dbd = self._update()
+        dbd.errback(RuntimeError("oops"))
+        self.failureResultOf(d, RuntimeError)
+        withData, d, dbd = self._update()
+        assert withData
+
+    def test_overlapping(self):
+        """An older update failing doesn't undo a newer one's data."""
+        withData, d1, dbd1 = self._update()
+        self.handler.setData('eggs')
+        withData, d2, dbd2 = self._update()
+        assert withData
+        dbd1.callback(None)
+        withData, d3, dbd3 = self._update()
+        assert not withData
+
+        # The newer update is lost too, so it has to be written again.
+        dbd2.errback(RuntimeError("oops"))
+        self.failureResultOf(d2, RuntimeError)
+        withData, d4, dbd4 = self._update()
+        assert withData
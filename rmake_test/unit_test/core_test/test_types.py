@@ -0,0 +1,111 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from twisted.trial import unittest
+
+from rmake.core import types
+from rmake.lib import chutney
+
+
+class FrozenObjectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loads = 0
+        self.dumps = 0
+        self._loads, self._dumps = chutney.loads, chutney.dumps
+        def loads(data):
+            self.loads += 1
+            return self._loads(data)
+        def dumps(obj):
+            self.dumps += 1
+            return self._dumps(obj)
+        chutney.loads = loads
+        chutney.dumps = dumps
+
+    def tearDown(self):
+        chutney.loads = self._loads
+        chutney.dumps = self._dumps
+
+    def test_getObject(self):
+        frozen = types.FrozenObject.fromObject({'spam': ['ham']})
+        obj = frozen.getObject()
+        self.assertEquals(obj, {'spam': ['ham']})
+        self.failUnless(frozen.getObject() is obj)
+        self.assertEquals(self.loads, 1)
+
+    def test_thaw(self):
+        frozen = types.FrozenObject.fromObject({'spam': ['ham']})
+        thawed = frozen.thaw()
+        self.failIf(thawed.object is frozen.getObject())
+        # Unchanged copies freeze back to the original.
+        self.failUnless(thawed.freeze() is frozen)
+        self.assertEquals(self.dumps, 1)
+        # Handing the object out for modification invalidates that.
+        thawed.getObject()['spam'].append('eggs')
+        refrozen = thawed.freeze()
+        self.assertEquals(refrozen.getObject(), {'spam': ['ham', 'eggs']})
+        self.assertEquals(frozen.getObject(), {'spam': ['ham']})
+        self.assertEquals(self.dumps, 2)
+
+    def test_freeze(self):
+        thawed = types.ThawedObject.fromObject(['spam'])
+        frozen = thawed.freeze()
+        self.failUnless(thawed.freeze() is frozen)
+        self.assertEquals(str(thawed.asBuffer()), frozen.data)
+        self.assertEquals(self.dumps, 1)
+
+    def test_pickle(self):
+        frozen = types.FrozenObject.fromObject(['spam'])
+        frozen.getObject()
+        copied = chutney.loads(chutney.dumps(frozen))
+        self.assertEquals(copied, frozen)
+        self.failIf('_object' in copied.__dict__)
+
+
+class FreezifyTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        task = types.RmakeTask(None, types.uuid.uuid4(), 'spam', 'ham',
+                task_data=types.FrozenObject.fromObject('eggs'),
+                status=types.JobStatus(400, 'failed', 'traceback'))
+        frozen = task.freeze()
+        self.failUnless(isinstance(frozen, types.FrozenRmakeTask))
+        self.failUnless(isinstance(frozen.status, types.FrozenJobStatus))
+        self.assertEquals(frozen.task_name, 'spam')
+        self.assertEquals(frozen.status.code, 400)
+        self.failUnless(frozen.status.failed)
+        thawed = frozen.thaw()
+        self.failUnless(isinstance(thawed.status, types.JobStatus))
+        self.assertEquals(thawed, task)
+        self.assertEquals(thawed.freeze(), frozen)
+
+    def test_mutable_field(self):
+        status = types.JobStatus(100, ['spam'])
+        err = self.assertRaises(TypeError, status.freeze)
+        self.assertEquals(str(err), "Can't freeze field 'text' of type "
+                "'list' as it is not a type known to be immutable")
+
+    def test_not_freezable(self):
+        Spam = types.slottype('Spam', 'ham')
+        self.assertRaises(TypeError, Spam('eggs').freeze)
+        self.assertRaises(TypeError, types.JobStatus(100, Spam('eggs')).freeze)
+
+    def test_not_thawable(self):
+        class Spam(types._Thawable, tuple):
+            __slots__ = ()
+        err = self.assertRaises(TypeError, Spam().thaw)
+        assert str(err).startswith("Object of type ")
@@ -0,0 +1,166 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+import fcntl
+import os
+
+from twisted.trial import unittest
+
+from rmake.lib import chrootcache
+
+
+class SnapshotChrootCacheTest(unittest.TestCase):
+
+    fingerprint = '\x01' * 20
+
+    def _makeRoot(self):
+        root = self.mktemp()
+        os.makedirs(os.path.join(root, 'etc'))
+        open(os.path.join(root, 'etc', 'passwd'), 'w').write('root:x:0:0\n')
+        os.symlink('passwd', os.path.join(root, 'etc', 'link'))
+        return root
+
+    def test_store_restore(self):
+        """Restored chroots match the stored tree and are independent."""
+        cache = chrootcache.SnapshotChrootCache(self.mktemp())
+        cache.store(self.fingerprint, self._makeRoot())
+        assert cache.hasChroot(self.fingerprint)
+
+        for x in range(2):
+            root = self.mktemp()
+            cache.restore(self.fingerprint, root)
+            path = os.path.join(root, 'etc', 'passwd')
+            self.assertEqual(open(path).read(), 'root:x:0:0\n')
+            self.assertEqual(os.readlink(os.path.join(root, 'etc', 'link')),
+                    'passwd')
+            # Changes to a restored chroot must not leak into the cache.
+            open(path, 'a').write('nobody:x:99:99\n')
+        assert cache.useReflink is not None
+
+    def test_remove(self):
+        cache = chrootcache.SnapshotChrootCache(self.mktemp())
+        cache.store(self.fingerprint, self._makeRoot())
+        cache.remove(self.fingerprint)
+        assert not cache.hasChroot(self.fingerprint)
+        self.assertEqual(sorted(os.listdir(cache.cacheDir)),
+                ['index', 'index.lock', 'index.misses', 'locks'])
+
+    def test_lru_eviction(self):
+        """The least recently restored chroot is evicted first."""
+        cache = chrootcache.SnapshotChrootCache(self.mktemp(), maxEntries=2)
+        root = self._makeRoot()
+        first, second, third = '\x01' * 20, '\x02' * 20, '\x03' * 20
+        cache.store(first, root)
+        cache.store(second, root)
+        cache.restore(first, self.mktemp())
+        assert not cache.hasChroot(third)
+        cache.store(third, root)
+
+        assert cache.hasChroot(first)
+        assert not cache.hasChroot(second)
+        assert cache.hasChroot(third)
+        self.assertEqual([x['fingerprint'] for x in cache.listChroots()],
+                ['01' * 20, '03' * 20])
+        stats = cache.getStats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_reflink_errors(self):
+        """Reflinks are only disabled if the filesystem can't do them."""
+        cache = chrootcache.SnapshotChrootCache(self.mktemp())
+        self.patch(chrootcache.subprocess, 'call', lambda *a, **k: 1)
+        self.patch(cache, '_canReflink', lambda otherDir: True)
+        self.assertRaises(chrootcache.errors.RmakeError,
+                cache.store, self.fingerprint, self._makeRoot())
+        self.assertEqual(cache.useReflink, None)
+        self.assertEqual(os.listdir(cache.cacheDir), [])
+
+        self.patch(cache, '_canReflink', lambda otherDir: False)
+        cache.store(self.fingerprint, self._makeRoot())
+        self.assertEqual(cache.useReflink, False)
+        assert cache.hasChroot(self.fingerprint)
+
+    def test_canReflink(self):
+        cache = chrootcache.SnapshotChrootCache(self.mktemp())
+        other = self.mktemp()
+        os.mkdir(other)
+        assert cache._canReflink(other) in (True, False)
+        self.assertEqual(os.listdir(other), [])
+
+    def test_store_race(self):
+        """A chroot stored by someone else in the meantime is kept."""
+        cache = chrootcache.SnapshotChrootCache(self.mktemp())
+        copyTree = cache._copyTree
+        def racingCopy(source, dest):
+            copyTree(source, dest)
+            theirs = cache._fingerPrintToPath(self.fingerprint)
+            os.mkdir(theirs)
+            open(os.path.join(theirs, 'theirs'), 'w').close()
+        self.patch(cache, '_copyTree', racingCopy)
+        cache.store(self.fingerprint, self._makeRoot())
+        self.assertEqual(os.listdir(
+            cache._fingerPrintToPath(self.fingerprint)), ['theirs'])
+        self.assertEqual(sorted(os.listdir(cache.cacheDir)),
+                ['01' * 20, 'index', 'index.lock'])
+
+    def test_restore_pinned(self):
+        """Restores don't hold the index lock, and pin their entry."""
+        cache = chrootcache.SnapshotChrootCache(self.mktemp(), maxEntries=1)
+        root = self._makeRoot()
+        first, second = '\x01' * 20, '\x02' * 20
+        cache.store(first, root)
+        restoreEntry = cache._restoreEntry
+        def slowRestore(chrootFingerprint, dest):
+            # Other workers can check, store and evict in the meantime
+            cache.index.lock(fcntl.LOCK_EX | fcntl.LOCK_NB)
+            cache.index.unlock()
+            assert not cache.hasChroot(second)
+            cache.store(second, root)
+            restoreEntry(chrootFingerprint, dest)
+        self.patch(cache, '_restoreEntry', slowRestore)
+        dest = self.mktemp()
+        self.assertEqual(cache.restore(first, dest), True)
+        assert os.path.exists(os.path.join(dest, 'etc', 'passwd'))
+        # The pinned entry survived, and goes next time
+        assert cache.hasChroot(first)
+        assert cache.hasChroot(second)
+        cache.store('\x03' * 20, root)
+        assert not cache.hasChroot(first)
+
+    def test_restore_evicted(self):
+        cache = chrootcache.SnapshotChrootCache(self.mktemp())
+        cache.store(self.fingerprint, self._makeRoot())
+        assert cache.hasChroot(self.fingerprint)
+        cache.remove(self.fingerprint)
+        self.assertEqual(cache.restore(self.fingerprint, self.mktemp()),
+                False)
+        self.assertEqual(cache.getStats()['hits'], 0)
+
+    def test_misses(self):
+        """Misses are logged without the index lock and counted later."""
+        cache = chrootcache.SnapshotChrootCache(self.mktemp())
+        cache.index.lock(fcntl.LOCK_EX)
+        try:
+            assert not cache.hasChroot(self.fingerprint)
+            assert not cache.hasChroot(self.fingerprint)
+        finally:
+            cache.index.unlock()
+        self.assertEqual(cache.getStats()['misses'], 2)
+        self.assertEqual(cache.index.takeMisses(), [])
+        self.assertEqual(cache.getStats()['misses'], 2)
@@ -0,0 +1,123 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+import time
+from twisted.internet import defer
+from twisted.python import log
+from twisted.trial import unittest
+
+from rmake.lib import pipereader
+from rmake.lib.twisted_extras import framed_pipe
+
+
+class _Receiver(framed_pipe.MarshalFrameProtocol):
+
+    def __init__(self):
+        framed_pipe.MarshalFrameProtocol.__init__(self)
+        self.frames = []
+        self.waiting = None
+
+    def frameReceived(self, obj):
+        self.frames.append(obj)
+        if self.waiting:
+            d, self.waiting = self.waiting, None
+            d.callback(obj)
+
+    def waitForFrame(self):
+        self.waiting = defer.Deferred()
+        return self.waiting
+
+
+class FramedPipeTest(unittest.TestCase):
+
+    def test_decoder(self):
+        data = ''.join(pipereader.frame(x) for x in ['spam', '', 'ham' * 100])
+        decoder = pipereader.FrameDecoder()
+        frames = []
+        for char in data:
+            frames.extend(decoder.feed(char))
+        self.assertEquals(frames, ['spam', '', 'ham' * 100])
+        self.failIf(decoder.hasPartialFrame())
+        self.assertEquals(decoder.feed(data[:-1]), ['spam', ''])
+        self.failUnless(decoder.hasPartialFrame())
+
+    def test_eof(self):
+        inF, outF = pipereader.makePipes()
+        proto = _Receiver()
+        framed_pipe.adoptPipe(inF, proto)
+        writer = pipereader.MarshalPipeWriter(outF)
+        writer.send({'spam': 1})
+        writer.send(['ham'])
+        writer.flush()
+        writer.close()
+        def cb_done(result):
+            self.assertEquals(proto.frames, [{'spam': 1}, ['ham']])
+        return proto.finished.addCallback(cb_done)
+
+    def test_truncated(self):
+        inF, outF = pipereader.makePipes()
+        proto = _Receiver()
+        framed_pipe.adoptPipe(inF, proto)
+        os.write(outF, pipereader.frame('spam')[:-1])
+        os.close(outF)
+        return self.assertFailure(proto.finished,
+                framed_pipe.TruncatedFrameError)
+
+    def test_roundtrip(self):
+        """Echo frames through a forked child and time the round trips."""
+        toChild, fromParent = os.pipe()
+        toParent, fromChild = os.pipe()
+        pid = os.fork()
+        if not pid:
+            try:
+                os.close(fromParent)
+                os.close(toParent)
+                reader = pipereader.MarshalPipeReader(toChild)
+                writer = pipereader.MarshalPipeWriter(fromChild)
+                for obj in reader.readUntilClosed():
+                    writer.send(obj)
+                    writer.flush()
+            finally:
+                os._exit(0)
+        os.close(toChild)
+        os.close(fromChild)
+        proto = _Receiver()
+        framed_pipe.adoptPipe(toParent, proto)
+        count = 100
+        times = []
+
+        @defer.inlineCallbacks
+        def run():
+            for n in range(count):
+                start = time.time()
+                os.write(fromParent,
+                        pipereader.frame(pipereader.marshal.dumps(n)))
+                result = yield proto.waitForFrame()
+                times.append(time.time() - start)
+                self.assertEquals(result, n)
+            os.close(fromParent)
+            yield proto.finished
+            os.waitpid(pid, 0)
+        def cb_check(result):
+            average = sum(times) / count
+            log.msg("Average round trip took %.2fms" % (average * 1000))
+            # Polling at 0.1 second intervals would average at least 50ms.
+            # Leave the rest as headroom for a slow or busy machine.
+            self.failUnless(average < 0.05,
+                    "average round trip took %.1fms" % (average * 1000))
+        return run().addCallback(cb_check)
@@ -15,6 +15,8 @@
 #
 
 
+import errno
+import socket
 from twisted.trial import unittest
 
 from rmake.lib import netlink
@@ -42,3 +44,45 @@ class NetlinkTest(unittest.TestCase):
                 assert address[:2] != '\xfe\x80'
             else:
                 self.fail("Invalid family " + family)
+
+
+class _FakeSocket(object):
+
+    def __init__(self, results):
+        self.results = results
+
+    def recv(self, size):
+        if not self.results:
+            raise socket.error(errno.EAGAIN, "Resource temporarily unavailable")
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class AddressMonitorTest(unittest.TestCase):
+
+    def _monitor(self, *results):
+        monitor = netlink.AddressMonitor.__new__(netlink.AddressMonitor)
+        monitor.sock = _FakeSocket(list(results))
+        return monitor
+
+    def test_changed(self):
+        """All pending notifications are drained at once."""
+        monitor = self._monitor('spam', 'ham')
+        assert monitor.changed()
+        self.assertEqual(monitor.sock.results, [])
+        assert not monitor.changed()
+
+    def test_unchanged(self):
+        assert not self._monitor().changed()
+        assert not self._monitor('').changed()
+
+    def test_overflow(self):
+        """Dropped notifications count as a change."""
+        monitor = self._monitor(socket.error(errno.ENOBUFS, "No buffer"))
+        assert monitor.changed()
+
+    def test_error(self):
+        monitor = self._monitor(socket.error(errno.EBADF, "Bad fd"))
+        self.assertRaises(socket.error, monitor.changed)
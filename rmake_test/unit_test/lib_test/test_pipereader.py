@@ -0,0 +1,51 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+from twisted.trial import unittest
+
+from rmake.lib import pipereader
+
+
+class PipeReaderTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        reader, writer = pipereader.makeMarshalPipes()
+        writer.send({'spam': 1})
+        writer.send('')
+        writer.send(['ham'] * 100)
+        writer.flush()
+        writer.close()
+        self.assertEquals(list(reader.readUntilClosed()),
+                [{'spam': 1}, '', ['ham'] * 100])
+
+    def test_whole_frames(self):
+        """Each frame is written with a single write, not byte by byte."""
+        writes = []
+        def write(fd, data):
+            writes.append(data)
+            return len(data)
+        self.patch(pipereader.os, 'write', write)
+        inF, outF = pipereader.makePipes()
+        self.addCleanup(os.close, inF)
+        writer = pipereader.PipeWriter(outF)
+        writer.send('spam')
+        writer.send('ham')
+        writer.flush()
+        writer.close()
+        self.assertEquals(writes,
+                [pipereader.frame('spam'), pipereader.frame('ham')])
@@ -0,0 +1,260 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import cPickle
+import os
+from conary import versions
+from conary.deps import deps
+from conary.repository import filecontents
+from twisted.trial import unittest
+
+from rmake.build import buildjob
+from rmake.build import buildtrove
+from rmake.lib import recipeutil
+from rmake.lib import repocache
+
+
+class _FakeSource(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def getFileContents(self, fileList, callback=None, **kwargs):
+        self.calls.append((list(fileList), kwargs))
+        out = []
+        for fileId, fileVersion in fileList:
+            data = '%s %s' % (fileId, fileVersion)
+            if kwargs.get('compressed'):
+                data = 'z ' + data
+            out.append(filecontents.FromString(data))
+        return out
+
+
+class ContentsCachingSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(recipeutil.ContentsCachingSource, '_contents', {})
+        self.patch(recipeutil.ContentsCachingSource, '_order', [])
+
+    def _read(self, contents):
+        return [x.get().read() for x in contents]
+
+    def test_cached(self):
+        """Contents are fetched once and shared between instances."""
+        repos = _FakeSource()
+        source = recipeutil.ContentsCachingSource(repos)
+        self.assertEqual(self._read(source.getFileContents([('a', '1')])),
+                ['a 1'])
+        source = recipeutil.ContentsCachingSource(repos)
+        self.assertEqual(self._read(source.getFileContents(
+            [('a', '1'), ('b', '1')])), ['a 1', 'b 1'])
+        self.assertEqual(repos.calls, [
+            ([('a', '1')], {}),
+            ([('b', '1')], {}),
+            ])
+
+    def test_compressed(self):
+        """The compressed flag is forwarded and cached separately."""
+        repos = _FakeSource()
+        source = recipeutil.ContentsCachingSource(repos)
+        source.getFileContents([('a', '1')])
+        self.assertEqual(self._read(source.getFileContents([('a', '1')],
+            compressed=True)), ['z a 1'])
+        self.assertEqual(self._read(source.getFileContents([('a', '1')],
+            compressed=True)), ['z a 1'])
+        self.assertEqual(repos.calls, [
+            ([('a', '1')], {}),
+            ([('a', '1')], {'compressed': True}),
+            ])
+
+    def test_limit(self):
+        self.patch(recipeutil.ContentsCachingSource, 'maxFiles', 2)
+        repos = _FakeSource()
+        source = recipeutil.ContentsCachingSource(repos)
+        source.getFileContents([('a', '1'), ('b', '1'), ('c', '1')])
+        source.getFileContents([('a', '1')])
+        self.assertEqual(len(repos.calls), 2)
+
+
+class _FakeConfig(object):
+    isolateTroves = False
+
+    def __init__(self, conaryCfg='', macros=''):
+        self.conaryCfg = conaryCfg
+        self.macros = macros
+        self.resolveTroveTups = []
+
+    def storeConaryCfg(self, out):
+        out.write(self.conaryCfg)
+
+    def getMacros(self):
+        return self.macros
+
+
+class _FakeLeaves(object):
+
+    def __init__(self, leaves):
+        self.leaves = leaves
+        self.calls = 0
+
+    def getTroveLeavesByBranch(self, query):
+        self.calls += 1
+        return self.leaves
+
+
+class LoadedRecipeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        version = versions.VersionFromString('/localhost@rpl:linux/1.0-1')
+        self.trove = buildtrove.BuildTrove(None, 'foo:source', version,
+                deps.parseFlavor(''))
+        self.cfg = _FakeConfig()
+        self.cache = recipeutil.LoadedRecipeCache(self.mktemp())
+
+    def _key(self, **kwargs):
+        kwargs.setdefault('cfg', self.cfg)
+        return self.cache.getKey(self.trove, deps.parseFlavor('is: x86'),
+                None, **kwargs)
+
+    def _result(self, name='foo', loadedTroves=()):
+        return buildtrove.LoadTroveResult(deps.parseFlavor('is: x86'),
+                buildtrove.RecipeType.PACKAGE, [{}], list(loadedTroves),
+                set([name]), set(), set(['bar:devel']), set())
+
+    def test_key(self):
+        """Every input to loading changes the key."""
+        key = self._key()
+        self.assertEqual(self._key(), key)
+        others = [
+                self._key(internalHostName='rmakehost'),
+                self._key(cfg=_FakeConfig(conaryCfg='buildLabel a@b:c\n')),
+                self._key(cfg=_FakeConfig(macros="foo = 'bar'\n")),
+                ]
+        self.assertEqual(len(set(others + [key])), len(others) + 1)
+
+    def test_get_put(self):
+        key = self._key()
+        self.assertEqual(self.cache.get(None, key), None)
+        self.cache.put(key, self._result())
+        self.assertEqual(self.cache.get(None, key), self._result())
+        stats = self.cache.store.index.getStats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+    def test_loaded_troves(self):
+        """Entries are reused while the troves their recipe loaded are the
+        same, whether they came from the job or the repository."""
+        v1 = versions.VersionFromString('/localhost@rpl:linux/1.0-1')
+        v2 = versions.VersionFromString('/localhost@rpl:linux/1.0-2')
+        flavor = deps.parseFlavor('')
+        key = self._key()
+        self.cache.put(key, self._result(
+            loadedTroves=[('bar:source', v1, flavor)]))
+        repos = _FakeLeaves({'bar:source': {v1: [flavor]}})
+
+        # Other troves in the job don't matter.
+        for job in [
+                [('bar', v1, flavor)],
+                [('bar', v1, flavor), ('baz', v2, flavor)],
+                ]:
+            assert self.cache.get(None, key, loadInstalledTroves=job)
+        # Not in the job, so it was loaded from the repository.
+        assert self.cache.get(repos, key,
+                loadInstalledTroves=[('baz', v1, flavor)])
+        self.assertEqual(repos.calls, 1)
+
+        # The job now builds a different version.
+        self.assertEqual(self.cache.get(repos, key,
+            loadInstalledTroves=[('bar', v2, flavor)]), None)
+        # Gone from the job and no longer the latest in the repository.
+        repos.leaves = {'bar:source': {v2: [flavor]}}
+        self.assertEqual(self.cache.get(repos, key), None)
+        self.assertEqual(repos.calls, 2)
+
+    def test_corrupt(self):
+        """Unreadable entries are misses, other errors are not hidden."""
+        key = self._key()
+        self.cache.put(key, self._result())
+        open(self.cache.store.hashToPath(key), 'w').write('garbage')
+        self.assertEqual(self.cache.get(None, key), None)
+
+        self.cache.put(key, self._result())
+        def openFile(key):
+            raise RuntimeError("oops")
+        self.patch(self.cache.store, 'openFile', openFile)
+        self.assertRaises(RuntimeError, self.cache.get, None, key)
+
+    def test_size_limit(self):
+        """The least recently used entries are evicted."""
+        self.patch(repocache.CacheIndex, 'minAge', 0)
+        size = len(cPickle.dumps(self._result(), 2))
+        cache = recipeutil.LoadedRecipeCache(self.mktemp(),
+                maxSize=size * 2)
+        keys = [self._key(internalHostName=str(x)) for x in range(3)]
+        cache.put(keys[0], self._result())
+        cache.put(keys[1], self._result())
+        cache.get(None, keys[0])
+        cache.put(keys[2], self._result())
+        assert cache.get(None, keys[0])
+        assert cache.get(None, keys[1]) is None
+        assert not os.path.exists(cache.store.hashToPath(keys[1]))
+        assert cache.get(None, keys[2])
+
+
+class LoadShardTest(unittest.TestCase):
+
+    def _makeJob(self, names):
+        job = buildjob.BuildJob()
+        self.cfg = _FakeConfig()
+        self.cfg.reposName = 'rmakehost'
+        self.cfg.buildFlavor = deps.parseFlavor('')
+        self.cfg.installLabelPath = []
+        job.setMainConfig(self.cfg)
+        for name in names:
+            version = versions.VersionFromString(
+                    '/localhost@rpl:linux/1.0-1')
+            job.addTrove(name + ':source', version, deps.parseFlavor(''))
+        for trove in job.iterTroves():
+            trove.cfg = self.cfg
+        return job
+
+    def _loadInstalled(self, job):
+        """Return the job troves loadInstalled could find for each trove."""
+        found = {}
+        def loadSourceTroves(job, repos, buildFlavor, troveList,
+                loadInstalledTroves=None, **kwargs):
+            for trove in troveList:
+                found[trove.getName().split(':')[0]] = sorted(
+                        x[0] for x in loadInstalledTroves)
+        self.patch(recipeutil, 'loadSourceTroves', loadSourceTroves)
+        recipeutil.loadSourceTrovesForJob(job, repos=_FakeSource())
+        return found
+
+    def test_other_shard(self):
+        """A shard's recipes can loadInstalled troves from other shards."""
+        job = self._makeJob(['foo', 'bar', 'baz'])
+        everything = ['bar', 'baz', 'foo']
+        self.assertEqual(self._loadInstalled(job),
+                dict((x, everything) for x in everything))
+
+        troveTups = sorted(job.iterLoadableTroveList())
+        shardA = job.getSubJob(troveTups[:1])
+        shardB = job.getSubJob(troveTups[1:])
+        self.assertEqual(self._loadInstalled(shardA), {'bar': everything})
+        self.assertEqual(self._loadInstalled(shardB),
+                {'baz': everything, 'foo': everything})
@@ -0,0 +1,294 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+import sqlite3
+import threading
+import time
+from StringIO import StringIO
+from conary.repository import filecontents
+from twisted.trial import unittest
+
+from rmake.lib import repocache
+
+
+class _FakeChangeSet(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def writeToFile(self, path):
+        open(path, 'w').write(self.data)
+
+
+class _FakeRepos(object):
+    """Records which threads use it, and can hold downloads open."""
+
+    def __init__(self, gate=None):
+        self.threads = set()
+        self.jobs = []
+        self.gate = gate
+
+    def _fetch(self, jobList):
+        self.threads.add(threading.currentThread())
+        self.jobs.extend(jobList)
+        if self.gate:
+            self.gate.wait()
+        return 'cs for %s' % (jobList[0][0],)
+
+    def createChangeSetFile(self, jobList, path, recurse=True):
+        open(path, 'w').write(self._fetch(jobList))
+
+    def createChangeSet(self, jobList, recurse=True, withFiles=True,
+            withFileContents=True):
+        return _FakeChangeSet(self._fetch(jobList))
+
+    def getFileContents(self, fileList, callback=None):
+        self.jobs.extend(fileList)
+        return [filecontents.FromString('%s %s' % x) for x in fileList]
+
+
+class _BrokenRepos(_FakeRepos):
+
+    def createChangeSetFile(self, jobList, path, recurse=True):
+        open(path, 'w').write('partial')
+        raise RuntimeError("connection reset")
+
+
+class _FakeDepSet(object):
+
+    def __init__(self, *deps):
+        self.deps = deps
+
+    def iterDeps(self, sort=False):
+        return iter(self.deps)
+
+
+class _FakeResultList(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def get(self):
+        return self.data
+
+
+def _job(name):
+    return (name, (None, None), ('1.0', ''), False)
+
+
+class FetchChangeSetsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = repocache.RepositoryCache(
+                os.path.abspath(self.mktemp()))
+
+    def _needed(self, names):
+        return [(_job(x), '%02x' % idx + x * 38, idx)
+                for (idx, x) in enumerate(names)]
+
+    def _read(self, csHash):
+        return open(self.cache.store.hashToPath(csHash)).read()
+
+    def test_client_per_thread(self):
+        """Each download thread uses its own repository client."""
+        clients = []
+        def reposFactory():
+            clients.append(_FakeRepos())
+            return clients[-1]
+        needed = self._needed('abcdefgh')
+        self.cache._fetchChangeSets(None, needed, True, True, None,
+                reposFactory)
+        self.assertEqual(len(clients), self.cache.downloadThreads)
+        for client in clients:
+            assert len(client.threads) <= 1
+        self.assertEqual(sorted(sum([x.jobs for x in clients], [])),
+                sorted(x[0] for x in needed))
+        for job, csHash, _ in needed:
+            self.assertEqual(self._read(csHash), 'cs for %s' % job[0])
+
+    def test_shared_client(self):
+        """Without a factory, downloads don't overlap on one client."""
+        repos = _FakeRepos()
+        needed = self._needed('abc')
+        self.cache._fetchChangeSets(repos, needed, True, True, None)
+        self.assertEqual(len(repos.threads), 1)
+        self.assertEqual(len(repos.jobs), 3)
+
+    def test_streaming(self):
+        """Full changesets are streamed to a file, others written after."""
+        repos = _FakeRepos()
+        repos.createChangeSet = None
+        job, csHash, _ = self._needed('a')[0]
+        self.cache._downloadChangeSet(repos, job, csHash, True, True)
+        self.assertEqual(self._read(csHash), 'cs for a')
+
+        repos = _FakeRepos()
+        repos.createChangeSetFile = None
+        self.cache._downloadChangeSet(repos, job, csHash + 'x', True, False)
+        self.assertEqual(self._read(csHash + 'x'), 'cs for a')
+
+    def test_failed_download(self):
+        """Partial downloads don't end up in the store."""
+        job, csHash, _ = self._needed('a')[0]
+        self.assertRaises(RuntimeError, self.cache._fetchChangeSets,
+                _BrokenRepos(), [(job, csHash, 0)], True, True, None)
+        assert not self.cache.store.hasFile(csHash)
+        dirPath = os.path.dirname(self.cache.store.hashToPath(csHash))
+        self.assertEqual(os.listdir(dirPath), [])
+
+    def test_single_flight(self):
+        """Threads wanting the same changeset download it once."""
+        gate = threading.Event()
+        repos = _FakeRepos(gate)
+        job, csHash, _ = self._needed('a')[0]
+        threads = [threading.Thread(target=self.cache._fetchChangeSet,
+            args=(repos, job, csHash, True, True)) for x in range(3)]
+        for thread in threads:
+            thread.start()
+        gate.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(repos.jobs, [job])
+        self.assertEqual(self._read(csHash), 'cs for a')
+
+    def test_single_flight_processes(self):
+        """Another process's download is waited for through the store."""
+        job, csHash, _ = self._needed('a')[0]
+        # A second cache stands in for another process; only the lock file
+        # is shared.
+        lock = repocache.IndexedDataStore(self.cache.root).lockHash(csHash)
+        repos = _FakeRepos()
+        thread = threading.Thread(target=self.cache._fetchChangeSet,
+                args=(repos, job, csHash, True, True))
+        thread.start()
+        thread.join(0.1)
+        assert thread.isAlive()
+        self.cache.store.addFile(StringIO('theirs'), csHash)
+        lock.close()
+        thread.join()
+        self.assertEqual(repos.jobs, [])
+        self.assertEqual(self._read(csHash), 'theirs')
+
+
+class CacheIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(repocache.CacheIndex, 'minAge', 0)
+        self.root = os.path.abspath(self.mktemp())
+
+    def _add(self, store, name, size):
+        store.addFile(StringIO('x' * size), name * 40)
+        # Keep last use times apart
+        time.sleep(0.01)
+
+    def test_entries(self):
+        index = repocache.CacheIndex(self.root)
+        self.assertEqual(index.recordAdd('a' * 40, 10), [])
+        self.assertEqual(index.recordAdd('b' * 40, 20), [])
+        self.assertEqual(index.hasEntries(['a' * 40, 'c' * 40]),
+                set(['a' * 40]))
+        index.addTroves([('a' * 40, 'frozen a'), ('c' * 40, 'frozen c')])
+        # Troves are only returned while their changeset is cached
+        self.assertEqual(index.getTroves(['a' * 40, 'c' * 40]),
+                {'a' * 40: 'frozen a'})
+        stats = index.getStats()
+        self.assertEqual((stats['entries'], stats['size']), (2, 30))
+
+    def test_scan(self):
+        """Files stored before the index existed are picked up."""
+        store = repocache.DataStore(self.root)
+        store.addFile(StringIO('x' * 5), 'a' * 40)
+        store.addFile(StringIO('x' * 5), 'b' * 40 + '.tmp')
+        index = repocache.CacheIndex(self.root)
+        self.assertEqual(index.hasEntries(['a' * 40]), set(['a' * 40]))
+        self.assertEqual(index.getStats()['entries'], 1)
+
+    def test_lru_eviction(self):
+        store = repocache.IndexedDataStore(self.root, maxSize=25)
+        self._add(store, 'a', 10)
+        self._add(store, 'b', 10)
+        store.index.recordHits(['a' * 40])
+        self._add(store, 'c', 10)
+        assert store.hasFile('a' * 40)
+        assert not store.hasFile('b' * 40)
+        assert store.hasFile('c' * 40)
+        self.assertEqual(store.index.hasEntries(['a' * 40, 'b' * 40]),
+                set(['a' * 40]))
+
+    def test_recently_used(self):
+        """Files in use are not evicted even if the store is too big."""
+        self.patch(repocache.CacheIndex, 'minAge', 60)
+        store = repocache.IndexedDataStore(self.root, maxSize=15)
+        self._add(store, 'a', 10)
+        self._add(store, 'b', 10)
+        assert store.hasFile('a' * 40)
+        self.assertEqual(store.index.getStats()['size'], 20)
+
+    def test_stats(self):
+        """Only lookups that go to the repository are misses."""
+        cache = repocache.RepositoryCache(self.root)
+        repos = _FakeRepos()
+        fileList = [('f1', 'v1'), ('f2', 'v1')]
+        cache.getFileContents(repos, fileList)
+        cache.getFileContents(repos, fileList)
+        cache._fetchChangeSets(repos, [(_job('a'), '01' + 'a' * 38, 0)],
+                True, True, None)
+        # Adding a file that is already there isn't another miss
+        cache.store.addFile(StringIO('f1 v1'), cache.hashFile('f1', 'v1'))
+        stats = cache.store.index.getStats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 3)
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(len(repos.jobs), 3)
+
+    def test_dependency_hits(self):
+        """Cached dependency results are recorded as used in one write."""
+        cache = repocache.RepositoryCache(self.root)
+        self.patch(cache, 'hashGroupDeps',
+                lambda groupTroves, depClass, dependency: dependency * 40)
+        self.patch(repocache, 'DependencyResultList', _FakeResultList)
+        for name in 'abc':
+            cache.store.addFile(StringIO('result ' + name), name * 40)
+        calls = []
+        recordHits = cache.store.index.recordHits
+        def recordHitsAndCount(hashes):
+            calls.append(sorted(hashes))
+            recordHits(hashes)
+        self.patch(cache.store.index, 'recordHits', recordHitsAndCount)
+        depList = [_FakeDepSet((None, 'a'), (None, 'b')),
+                _FakeDepSet((None, 'c'))]
+        results = cache.resolveDependenciesByGroups(None, [], depList)
+        self.assertEqual(results, {depList[0]: ['result a', 'result b'],
+            depList[1]: ['result c']})
+        self.assertEqual(calls, [['a' * 40, 'b' * 40, 'c' * 40]])
+        self.assertEqual(cache.store.index.getStats()['hits'], 3)
+
+    def test_timeout(self):
+        """Readers with a short timeout give up on a locked index."""
+        index = repocache.CacheIndex(self.root)
+        index.recordAdd('a' * 40, 10)
+        db = sqlite3.connect(index.path, isolation_level=None)
+        db.execute("BEGIN EXCLUSIVE")
+        try:
+            reader = repocache.CacheIndex(self.root, timeout=0.1)
+            start = time.time()
+            self.assertRaises(sqlite3.OperationalError, reader.getStats)
+            assert time.time() - start < 10
+        finally:
+            db.execute("ROLLBACK")
+        self.assertEqual(reader.getStats()['entries'], 1)
@@ -0,0 +1,113 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from rmake import errors
+from rmake.lib import rpc_pickle
+
+
+class _MethodStore(object):
+
+    def __init__(self):
+        self.pending = {}
+
+    def _callMethod(self, funcName, callData, args, kwargs):
+        funcName = funcName.split('.')[-1]
+        if funcName == 'echo':
+            return args[0]
+        elif funcName == 'fail':
+            raise errors.RmakeError("no such job")
+        elif funcName == 'crash':
+            raise ValueError("oops")
+        elif funcName == 'later':
+            d = self.pending[args[0]] = defer.Deferred()
+            return d
+        raise AssertionError(funcName)
+
+
+class _LoopbackProxy(object):
+    """Send batches straight to a resource instead of over HTTP."""
+
+    def __init__(self, resource):
+        self.resource = resource
+        self.sent = []
+
+    def _marshal_call(self, method, args, kwargs):
+        self.sent.append((method, args, kwargs))
+        assert method == rpc_pickle.MULTICALL
+        results = []
+        d = self.resource._multicall(None, *args, **kwargs)
+        d.addCallback(results.append)
+        return results[0]
+
+
+class MulticallTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = _MethodStore()
+        self.resource = rpc_pickle.PickleRPCResource(self.store)
+        self.proxy = _LoopbackProxy(self.resource)
+
+    def test_mixed(self):
+        """Faults in a batch don't affect the other calls."""
+        with rpc_pickle.BatchProxy(self.proxy) as batch:
+            one = batch.echo(1)
+            fail = batch.fail()
+            crash = batch.crash()
+            two = batch.build.echo(2)
+        self.assertEqual(len(self.proxy.sent), 1)
+        self.assertEqual([x[0] for x in self.proxy.sent[0][1][0]],
+                ['echo', 'fail', 'crash', 'build.echo'])
+        self.assertEqual(one.result, 1)
+        self.assertEqual(two.result, 2)
+        self.assertRaises(errors.RmakeError, lambda: fail.result)
+        self.assertRaises(errors.InternalServerError, lambda: crash.result)
+
+    def test_deferreds(self):
+        """Deferred calls run at once and results keep the call order."""
+        d = self.resource._multicall(None, [('later', ('a',), {}),
+            ('echo', ('b',), {}), ('later', ('c',), {})])
+        results = []
+        d.addCallback(results.append)
+        # Both slow calls were started before either finished.
+        self.assertEqual(sorted(self.store.pending), ['a', 'c'])
+        self.store.pending['c'].callback('C')
+        self.assertEqual(results, [])
+        self.store.pending['a'].errback(errors.RmakeError("gone"))
+        ok, values = results[0]
+        assert ok
+        self.assertEqual(values[1:], [(True, 'b'), (True, 'C')])
+        self.assertEqual(values[0][0], False)
+        assert isinstance(values[0][1], errors.RmakeError)
+
+    def test_result_before_send(self):
+        batch = rpc_pickle.BatchProxy(self.proxy)
+        pending = batch.echo(1)
+        self.assertRaises(RuntimeError, lambda: pending.result)
+        batch._send()
+        self.assertEqual(pending.result, 1)
+
+    def test_exception_in_block(self):
+        """Nothing is sent if the block raises."""
+        def run():
+            with rpc_pickle.BatchProxy(self.proxy) as batch:
+                pending = batch.echo(1)
+                raise KeyError("oops")
+        self.assertRaises(KeyError, run)
+        self.assertEqual(self.proxy.sent, [])
@@ -0,0 +1,93 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import BaseHTTPServer
+import threading
+from twisted.trial import unittest
+
+from rmake.lib import rpcproxy
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write, as twisted.web does
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-length']))
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header('Content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.dropIdle:
+            # Hang up without telling the client, like a server whose idle
+            # timeout expired.
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(BaseHTTPServer.HTTPServer):
+    allow_reuse_address = True
+    connections = requests = 0
+    dropIdle = False
+
+
+class HTTPTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        host, port = self.server.server_address
+        self.address = rpcproxy.HTTPAddress(host, port, '/')
+        self.transport = rpcproxy.HTTPTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _call(self, body):
+        return self.transport.request(self.address, 'text/plain', body,
+                lambda response: response.read())
+
+    def test_keepalive(self):
+        for n in range(5):
+            self.assertEquals(self._call('ping %d' % n), 'ping %d' % n)
+        self.assertEquals(self.server.requests, 5)
+        self.assertEquals(self.server.connections, 1)
+
+    def test_idle_timeout(self):
+        self.transport.idleTimeout = 0
+        self._call('one')
+        self._call('two')
+        self.assertEquals(self.server.connections, 2)
+
+    def test_stale_retry(self):
+        self.server.dropIdle = True
+        self.assertEquals(self._call('one'), 'one')
+        self.assertEquals(self._call('two'), 'two')
+        self.assertEquals(self.server.requests, 2)
+        self.assertEquals(self.server.connections, 2)
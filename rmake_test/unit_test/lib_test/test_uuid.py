@@ -0,0 +1,75 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import copy
+from twisted.trial import unittest
+
+from rmake.lib import chutney
+from rmake.lib import uuid
+
+HEX = '12345678-1234-5678-1234-567812345678'
+# A UUID pickled by the long-based implementation.
+OLD_PICKLE = ('\x80\x02crmake.lib.uuid\nUUID\nq\x01(NNNN\x8a\x10xV4\x12xV4'
+        '\x12xV4\x12xV4\x12Nt\x81q\x02.')
+
+
+class UUIDTest(unittest.TestCase):
+
+    def test_forms(self):
+        expected = uuid.UUID(HEX)
+        self.assertEquals(str(expected), HEX)
+        self.assertEquals(repr(expected), 'UUID(%r)' % HEX)
+        self.assertEquals(expected.short, '567812345678')
+        self.assertEquals(expected.bytes, '\x12\x34\x56\x78' * 4)
+        self.assertEquals(expected.int, 0x12345678123456781234567812345678)
+        for other in [
+                uuid.UUID('{%s}' % HEX),
+                uuid.UUID('urn:uuid:' + HEX),
+                uuid.UUID(bytes='\x12\x34\x56\x78' * 4),
+                uuid.UUID(bytes_le='\x78\x56\x34\x12\x34\x12\x78\x56'
+                    '\x12\x34\x56\x78\x12\x34\x56\x78'),
+                uuid.UUID(fields=(0x12345678, 0x1234, 0x5678, 0x12, 0x34,
+                    0x567812345678)),
+                uuid.UUID(int=0x12345678123456781234567812345678),
+                ]:
+            self.assertEquals(other, expected)
+            self.assertEquals(hash(other), hash(expected))
+        self.assertRaises(ValueError, uuid.UUID, 'spam')
+        self.assertRaises(ValueError, uuid.UUID, 'x' * 32)
+
+    def test_version(self):
+        value = uuid.uuid5(uuid.NAMESPACE_DNS, 'python.org')
+        self.assertEquals(str(value), '886313e1-3b8a-5372-9b90-0c9aee199e5d')
+        value = uuid.uuid3(uuid.NAMESPACE_DNS, 'python.org')
+        self.assertEquals(str(value), '6fa459ea-ee8a-3ca4-894e-db77e160355e')
+        value = uuid.UUID(int=0, version=4)
+        self.assertEquals(str(value), '00000000-0000-4000-8000-000000000000')
+
+    def test_ordering(self):
+        values = [uuid.UUID(int=x) for x in (1 << 120, 255, 256, 1)]
+        self.assertEquals([x.int for x in sorted(values)],
+                [1, 255, 256, 1 << 120])
+
+    def test_pickle(self):
+        value = uuid.UUID(HEX)
+        str(value)
+        copied = chutney.loads(chutney.dumps(value))
+        self.assertEquals(type(copied), uuid.UUID)
+        self.assertEquals(copied, value)
+        self.failIf(copied.__dict__)
+        self.assertEquals(chutney.loads(OLD_PICKLE), value)
+        self.failUnless(copy.deepcopy(value) is value)
@@ -0,0 +1,128 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import logging
+from twisted.internet import task as tw_task
+from twisted.trial import unittest
+
+from rmake.core import types
+from rmake.lib import uuid
+from rmake.messagebus import logger
+
+
+class SlowBus(object):
+    """Fake message bus whose messages are only acknowledged on demand."""
+
+    def __init__(self):
+        self.sent = []
+        self.unacked = 0
+
+    def sendToTarget(self, msg):
+        self.sent.append(msg)
+        self.unacked += 1
+
+    def getBacklog(self):
+        return self.unacked
+
+    def ack(self):
+        self.unacked = 0
+
+    def records(self):
+        return [x.getMessage() for msg in self.sent for x in msg.records]
+
+
+def relay_size(count):
+    """Buffer size that fits C{count} of the records made by the tests."""
+    return count * (len('line 00') + logger.LogRelay.RECORD_OVERHEAD)
+
+
+class LogRelayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = tw_task.Clock()
+        self.clock.advance(1000)
+        self.bus = SlowBus()
+        self.task = types.RmakeTask(None, uuid.uuid4(), 'spam', 'ham')
+        self.counter = 0
+
+    def _relay(self, **kwargs):
+        return logger.LogRelay(self.bus.sendToTarget, self.task,
+                backlogFunc=self.bus.getBacklog, clock=self.clock, **kwargs)
+
+    def _records(self, count, size=0):
+        out = []
+        for n in range(count):
+            out.append(logging.LogRecord('test', logging.INFO, __file__, 0,
+                'line %d' + ' ' * size, (self.counter,), None))
+            self.counter += 1
+        return out
+
+    def test_deadline(self):
+        relay = self._relay()
+        relay.emitMany(self._records(1))
+        self.assertEquals(len(self.bus.sent), 1)
+        relay.emitMany(self._records(2))
+        self.assertEquals(len(self.bus.sent), 1)
+        self.clock.advance(relay.DEADLINE)
+        self.assertEquals(len(self.bus.sent), 2)
+        self.assertEquals(self.bus.records(), ['line 0', 'line 1', 'line 2'])
+        self.assertEquals(self.bus.sent[1].task_uuid, self.task.task_uuid)
+
+    def test_size_flush(self):
+        relay = self._relay()
+        relay.emitMany(self._records(1))
+        # Enough data goes out right away, in messages no bigger than
+        # FLUSH_SIZE.
+        relay.emitMany(self._records(10, size=relay.FLUSH_SIZE / 4))
+        self.assertEquals(len(self.bus.sent), 4)
+        self.assertEquals([len(x.records) for x in self.bus.sent], [1, 4, 4, 2])
+
+    def test_backpressure(self):
+        relay = self._relay()
+        self.bus.unacked = relay.MAX_BACKLOG + 1
+        relay.emitMany(self._records(5))
+        self.clock.advance(relay.DEADLINE * 10)
+        self.assertEquals(self.bus.sent, [])
+        self.bus.ack()
+        self.clock.advance(relay.DEADLINE)
+        self.assertEquals(len(self.bus.records()), 5)
+
+    def test_drop(self):
+        relay = self._relay(maxBuffered=relay_size(10))
+        self.bus.unacked = relay.MAX_BACKLOG + 1
+        relay.emitMany(self._records(15))
+        relay.emitMany(self._records(5))
+        self.assertEquals(len(relay.buffered), 10)
+        self.bus.ack()
+        self.clock.advance(relay.DEADLINE)
+        records = self.bus.records()
+        self.assertEquals(records[:10], ['line %d' % n for n in range(10)])
+        self.assertEquals(records[10:], ['10 log records dropped because '
+            'the message bus could not keep up'])
+        self.assertEquals(relay.buffered_size, 0)
+        # Records are accepted again once the buffer drains.
+        relay.emitMany(self._records(1))
+        relay.close()
+        self.assertEquals(self.bus.records()[-1], 'line 20')
+
+    def test_close(self):
+        relay = self._relay()
+        self.bus.unacked = relay.MAX_BACKLOG + 1
+        relay.emitMany(self._records(3))
+        relay.close()
+        self.assertEquals(len(self.bus.records()), 3)
+        self.failIf(self.clock.getDelayedCalls())
@@ -0,0 +1,156 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import logging
+from twisted.internet import task
+from twisted.trial import unittest
+
+from rmake.lib import uuid
+from rmake.messagebus.logger import LogRelay
+from rmake.worker import executor
+
+
+class _FakeReactor(task.Clock):
+    """Clock that queues calls from the "task thread" until run by hand."""
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.fromThread = []
+
+    def callFromThread(self, func, *args):
+        self.fromThread.append((func, args))
+
+    def runFromThread(self):
+        calls, self.fromThread = self.fromThread, []
+        for func, args in calls:
+            func(*args)
+
+
+class ChildLoggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = _FakeReactor()
+        self.sent = []
+        self.logger = executor.ChildLogger(self.sent.append,
+                reactor=self.reactor)
+
+    def _log(self, msg):
+        self.logger.handle(logging.makeLogRecord({'msg': msg}))
+
+    def _messages(self):
+        return [[x.getMessage() for x in batch] for batch in self.sent]
+
+    def test_delay(self):
+        """A batch is sent flushDelay seconds after its first record."""
+        self._log('one')
+        self._log('two')
+        self.assertEqual(len(self.reactor.fromThread), 1)
+        self.reactor.runFromThread()
+        self.reactor.advance(self.logger.flushDelay / 2)
+        self._log('three')
+        self.assertEqual(self.reactor.fromThread, [])
+        self.assertEqual(self.sent, [])
+        self.reactor.advance(self.logger.flushDelay / 2)
+        self.assertEqual(self._messages(), [['one', 'two', 'three']])
+
+        # The next record starts a new batch.
+        self._log('four')
+        self.reactor.runFromThread()
+        self.reactor.advance(self.logger.flushDelay)
+        self.assertEqual(self._messages(), [['one', 'two', 'three'],
+            ['four']])
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_max_batch(self):
+        """A full batch is sent at once, without waiting for the timer."""
+        self.patch(self.logger, 'maxBatch', 3)
+        for n in range(4):
+            self._log(str(n))
+        self.assertEqual(len(self.reactor.fromThread), 2)
+        self.reactor.runFromThread()
+        self.assertEqual(self._messages(), [['0', '1', '2'], ['3']])
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+        # The timer was cancelled, so it won't send an empty batch later.
+        self.reactor.advance(self.logger.flushDelay)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_close(self):
+        """Closing sends whatever is still buffered, then drops records."""
+        self._log('one')
+        self.reactor.runFromThread()
+        self._log('two')
+        self.logger.close()
+        self.assertEqual(self._messages(), [['one', 'two']])
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+        self._log('three')
+        self.assertEqual(self.reactor.fromThread, [])
+        self.assertEqual(len(self.sent), 1)
+
+
+class _FakeTask(object):
+
+    class times(object):
+        ticks = 0
+
+    def thaw(self):
+        return self
+
+    def freeze(self):
+        return self
+
+
+class StatusTest(unittest.TestCase):
+
+    def test_flush_before_status(self):
+        """Buffered records are sent before a status update."""
+        reactor = _FakeReactor()
+        child = executor.WorkerChild()
+        commands = []
+        def sendCommand(ctr, command, **kwargs):
+            commands.append(command)
+        self.patch(child, 'sendCommand', sendCommand)
+        child.task = _FakeTask()
+        child.logger = executor.ChildLogger(child.sendLogs, reactor=reactor)
+        child.logger.handle(logging.makeLogRecord({'msg': 'spam'}))
+        child.sendTask(_FakeTask())
+        self.assertEqual(commands, ['push_logs', 'status_update'])
+        self.assertEqual(reactor.getDelayedCalls(), [])
+
+    def test_parent_flush(self):
+        """Logs held back by the parent go out before the status update."""
+        sent = []
+        class launcher(object):
+            @staticmethod
+            def forwardTaskStatus(task):
+                sent.append('status')
+        task = _FakeTask()
+        task.job_uuid = uuid.uuid4()
+        task.task_uuid = uuid.uuid4()
+        parent = executor.WorkerParent()
+        parent.task = task
+        parent.launcher = launcher
+        # The message bus is backed up, so nothing would be sent for now.
+        parent.logRelay = LogRelay(lambda msg: sent.append('logs'), task,
+                backlogFunc=lambda: LogRelay.MAX_BACKLOG + 1,
+                clock=_FakeReactor())
+        parent.cmd_push_logs(0, [logging.makeLogRecord({'msg': 'spam'})])
+        self.assertEqual(sent, [])
+        parent.cmd_status_update(1, task)
+        self.assertEqual(sent, ['logs', 'status'])
+        parent.cmd_status_update(2, task)
+        self.assertEqual(sent, ['logs', 'status', 'status'])
@@ -0,0 +1,204 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+from testutils import mock
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from rmake.core import support
+from rmake.messagebus import message
+from rmake.worker import executor
+from rmake.worker import launcher
+
+
+class _FakeNetlink(object):
+
+    addresses = [(2, '10.0.0.1')]
+
+    def getAllAddresses(self):
+        return self.addresses
+
+
+class _FakeMonitor(object):
+
+    def changed(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class HeartbeatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(launcher.netlink, 'RoutingNetlink', _FakeNetlink)
+        self.patch(launcher.netlink, 'AddressMonitor', _FakeMonitor)
+        self.sent = []
+        self.launcher = mock.MockObject()
+        self.launcher._mock.set(caps=set(), affinityProviders=[],
+                statsProviders=[])
+        self.launcher.pool.getTaskList._mock.setDefaultReturn(set())
+        self.launcher.cfg.getSlots._mock.setDefaultReturn({None: 2})
+        self.launcher.bus.sendToTarget._mock.setDefaultReturn(None)
+        self.launcher.bus._mock.set(sendToTarget=self.sent.append)
+        self.service = launcher.HeartbeatService(self.launcher)
+
+        # Run "threads" by hand
+        self.calls = []
+        def deferToThread(func, *args):
+            d = defer.Deferred()
+            self.calls.append((func, args, d))
+            return d
+        self.patch(launcher.threads, 'deferToThread', deferToThread)
+
+    def tearDown(self):
+        mock.unmockAll()
+
+    def _runThread(self):
+        func, args, d = self.calls.pop(0)
+        d.callback(func(*args))
+
+    def test_stats_off_thread(self):
+        """Stats are collected in a thread, one collection at a time."""
+        called = []
+        def provider():
+            called.append(True)
+            return {'hits': len(called)}
+        self.launcher.statsProviders.append(provider)
+        self.service.heartbeat()
+        self.service.heartbeat()
+        self.assertEqual(called, [])
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.sent[0].stats, {})
+
+        self._runThread()
+        self.service.resync()
+        self.service.heartbeat()
+        self.assertEqual(self.sent[-1].stats, {'hits': 1})
+        self.assertEqual(len(self.calls), 1)
+
+    def test_stats_stale(self):
+        """A failing provider keeps reporting its previous values."""
+        results = [{'a': 1, 'b': 1}, None]
+        def flaky():
+            result = results.pop(0)
+            if result is None:
+                raise RuntimeError("database is locked")
+            return result
+        self.launcher.statsProviders.append(flaky)
+        self.launcher.statsProviders.append(lambda: {'b': 2})
+        self.service.collectStats()
+        self._runThread()
+        self.assertEqual(self.service.stats, {'a': 1, 'b': 2})
+        self.service.collectStats()
+        self._runThread()
+        self.assertEqual(self.service.stats, {'a': 1, 'b': 2})
+
+    def test_delta(self):
+        """Only changed fields are sent between full snapshots."""
+        tasks = set()
+        self.launcher.pool._mock.set(getTaskList=lambda: set(tasks))
+        self.patch(self.service, 'snapshotInterval', 3)
+        self.service.heartbeat()
+        assert isinstance(self.sent[-1], message.Heartbeat)
+        self.assertEqual(self.sent[-1].addresses, frozenset(['10.0.0.1']))
+
+        self.service.heartbeat()
+        msg = self.sent[-1]
+        assert isinstance(msg, message.HeartbeatDelta)
+        self.assertEqual([getattr(msg, x) for x in msg._payload_slots],
+                [None] * len(msg._payload_slots))
+
+        tasks.add('spam')
+        self.service.heartbeat()
+        msg = self.sent[-1]
+        assert isinstance(msg, message.HeartbeatDelta)
+        self.assertEqual(msg.tasks, set(['spam']))
+        self.assertEqual(msg.caps, None)
+
+        # Every snapshotInterval beats, and after a resync, send everything.
+        self.service.heartbeat()
+        msg = self.sent[-1]
+        assert isinstance(msg, message.Heartbeat)
+        self.assertEqual(msg.tasks, set(['spam']))
+        self.service.heartbeat()
+        assert isinstance(self.sent[-1], message.HeartbeatDelta)
+        self.service.resync()
+        self.service.heartbeat()
+        assert isinstance(self.sent[-1], message.Heartbeat)
+
+    def test_snapshot_interval(self):
+        """Dispatchers that drop deltas see a snapshot before expiring us."""
+        assert (launcher.HeartbeatService.snapshotInterval
+                < support.WorkerChecker.threshold)
+
+    def test_addresses(self):
+        """Addresses are rescanned only when netlink reports a change."""
+        changed = []
+        self.patch(self.service.monitor, 'changed',
+                lambda: bool(changed and changed.pop()))
+        self.assertEqual(self.service.getAddresses(),
+                frozenset(['10.0.0.1']))
+        self.patch(self.service.netlink, 'addresses', [(2, '10.0.0.2')])
+        self.assertEqual(self.service.getAddresses(),
+                frozenset(['10.0.0.1']))
+        changed.append(True)
+        self.assertEqual(self.service.getAddresses(),
+                frozenset(['10.0.0.2']))
+
+
+class _FakeConfig(object):
+
+    def __init__(self, lockDir):
+        self.lockDir = lockDir
+
+
+class ConfigFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lockDir = os.path.abspath(self.mktemp())
+        self.service = launcher.LauncherService.__new__(
+                launcher.LauncherService)
+        self.service.cfg = _FakeConfig(self.lockDir)
+
+    def _deadPid(self):
+        pid = os.fork()
+        if not pid:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        return pid
+
+    def test_store(self):
+        path, digest = self.service._storeConfig()
+        self.assertEqual(os.path.dirname(path), self.lockDir)
+        assert os.path.basename(path).startswith(
+                'rmake-worker-%d-' % os.getpid())
+        cfg = executor.WorkerChild._loadConfig(path, digest)
+        self.assertEqual(cfg.lockDir, self.lockDir)
+
+    def test_stale(self):
+        """Only files belonging to launchers that are gone are removed."""
+        mine, digest = self.service._storeConfig()
+        stale = os.path.join(self.lockDir,
+                'rmake-worker-%d-abc.cfg' % self._deadPid())
+        other = os.path.join(self.lockDir, 'rmake-worker-spam.cfg')
+        for path in (stale, other):
+            open(path, 'w').close()
+        self.service._removeStaleConfigs()
+        self.assertEqual(sorted(os.listdir(self.lockDir)),
+                sorted(os.path.basename(x) for x in (mine, other)))
@@ -0,0 +1,98 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from conary import versions
+from conary.deps import deps
+from testutils import mock
+from twisted.trial import unittest
+
+from rmake.worker import resolvesource
+
+
+def _tup(name, label='localhost@rpl:linux'):
+    return (name, versions.VersionFromString('/%s/1.0-1-1' % label),
+            deps.parseFlavor(''))
+
+
+class _FakeTrove(object):
+
+    def __init__(self, troveTup):
+        self.troveTup = troveTup
+
+    def getNameVersionFlavor(self):
+        return self.troveTup
+
+
+class DependencySolutionMemoTest(unittest.TestCase):
+
+    def tearDown(self):
+        mock.unmockAll()
+
+    def _memo(self, fingerprints):
+        memo = resolvesource.DependencySolutionMemo()
+        for fingerprint in fingerprints:
+            memo.set(fingerprint, 'dep', [_tup('foo')])
+        return memo
+
+    def test_subset(self):
+        memo = self._memo(['built:a:x', 'built:b:x', 'repos:l1:()',
+            'repos:l2:()'])
+        subset = memo.subset(['built:a:', 'repos:l1:'])
+        self.assertEqual(len(subset), 2)
+        assert subset.get('built:a:x', 'dep')
+        assert subset.get('repos:l1:()', 'dep')
+        # Only entries added after handing out a subset come back.
+        self.assertEqual(len(subset.getAdded()), 0)
+
+    def test_discard(self):
+        memo = self._memo(['built:a:x', 'repos:l1:()', 'repos:l2:()'])
+        memo.discard('repos:l1:')
+        memo.discard('built:')
+        self.assertEqual(len(memo), 1)
+        assert memo.get('repos:l2:()', 'dep')
+
+    def test_prefixes(self):
+        """Entries made by each source of a resolve job are handed out."""
+        fingerprints = []
+        def resolveWithMemo(memo, fingerprint, depList, resolveFn):
+            fingerprints.append(fingerprint)
+            return {}
+        self.patch(resolvesource, 'resolveWithMemo', resolveWithMemo)
+
+        label = versions.Label('localhost@rpl:linux')
+        otherLabel = versions.Label('localhost@rpl:other')
+        group = [_tup('group-dist')]
+        built = [_tup('foo', 'rmakehost@local:linux')]
+        cfg = mock.MockObject(resolveTroveTups=[group],
+                installLabelPath=[otherLabel])
+        memo = resolvesource.DependencySolutionMemo()
+        source = resolvesource.MemoizingTroveSource(None, memo)
+        source.resolveDependencies(label, [], True)
+        source.resolveDependencies(otherLabel, [])
+        source.resolveDependenciesByGroups([_FakeTrove(x) for x in group],
+                [])
+        fingerprints.append(resolvesource.getBuiltFingerprint(built) + ':x')
+
+        prefixes = tuple(resolvesource.getMemoPrefixes(cfg, label, built, []))
+        for fingerprint in fingerprints:
+            assert fingerprint.startswith(prefixes), fingerprint
+
+        # Other jobs' sources are left out.
+        prefixes = tuple(resolvesource.getMemoPrefixes(cfg, otherLabel, [],
+            []))
+        self.assertEqual([x for x in fingerprints
+            if x.startswith(prefixes)], fingerprints[1:3])
@@ -0,0 +1,120 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+from conary import versions
+from conary.deps import deps
+from testutils import mock
+from twisted.trial import unittest
+
+from rmake.worker.chroot import rootfactory
+
+
+def _tup(name, version='1.0-1-1', flavor=''):
+    return (name, versions.VersionFromString('/localhost@rpl:linux/'
+        + version), deps.parseFlavor(flavor))
+
+
+class _FakeDB(object):
+
+    def __init__(self, troves):
+        self.troves = troves
+        self.db = mock.MockObject(schemaVersion=20)
+
+    def iterAllTroves(self):
+        return iter(self.troves)
+
+    def iterFilesInTrove(self, name, version, flavor):
+        return iter([])
+
+
+class IncrementalUpdateTest(unittest.TestCase):
+
+    def tearDown(self):
+        mock.unmockAll()
+
+    def _makeChroot(self, wanted):
+        jobList = [(n, (None, None), (v, f), False) for (n, v, f) in wanted]
+        return rootfactory.ConaryBasedChroot(jobList, [], [],
+                mock.MockObject(), mock.MockObject())
+
+    def _mockDB(self, troves):
+        client = mock.MockObject()
+        client._mock.set(db=_FakeDB(troves))
+        self.patch(rootfactory.conaryclient, 'ConaryClient',
+                lambda cfg: client)
+
+    def test_jobs(self):
+        """Remaining names are updated in place, not installed alongside."""
+        chroot = self._makeChroot([_tup('foo', '2.0-1-1'), _tup('bar'),
+            _tup('new')])
+        jobs = chroot._getIncrementalJobs([_tup('foo'), _tup('bar'),
+            _tup('old')])
+        foo1, foo2, old, new = (_tup('foo'), _tup('foo', '2.0-1-1'),
+                _tup('old'), _tup('new'))
+        self.assertEqual(jobs, [
+            ('foo', foo1[1:], foo2[1:], False),
+            ('new', (None, None), new[1:], False),
+            ('old', old[1:], (None, None), False),
+            ])
+
+    def test_jobs_flavors(self):
+        """Versions of a multi-flavored trove are paired by flavor."""
+        wanted = [_tup('kernel', '2.0-1-1', 'is: x86'),
+                _tup('kernel', '2.0-1-1', 'is: x86_64')]
+        installed = [_tup('kernel', '1.0-1-1', 'is: x86_64'),
+                _tup('kernel', '1.0-1-1', 'is: x86'),
+                _tup('kernel', '1.0-1-1', 'is: ppc')]
+        jobs = self._makeChroot(wanted)._getIncrementalJobs(installed)
+        self.assertEqual(sorted(jobs), sorted([
+            ('kernel', installed[1][1:], wanted[0][1:], False),
+            ('kernel', installed[0][1:], wanted[1][1:], False),
+            ('kernel', installed[2][1:], (None, None), False),
+            ]))
+
+    def test_update_verified(self):
+        """The update fails if the chroot doesn't match afterwards."""
+        wanted = [_tup('foo', '2.0-1-1')]
+        chroot = self._makeChroot(wanted)
+        applied = []
+        def _install(jobList, migrate=True):
+            applied.append((jobList, migrate))
+
+        self._mockDB(wanted)
+        self.assertEqual(chroot._updateIncremental(_install, [_tup('foo')]),
+                True)
+        self.assertEqual(applied, [([('foo', _tup('foo')[1:], wanted[0][1:],
+            False)], False)])
+
+        self._mockDB(wanted + [_tup('foo')])
+        self.assertEqual(chroot._updateIncremental(_install, [_tup('foo')]),
+                False)
+
+        del applied[:]
+        self.assertEqual(chroot._updateIncremental(_install, wanted), True)
+        self.assertEqual(applied, [])
+
+    def test_moveOldRoot(self):
+        """Only a root moved over from an earlier build is reused."""
+        chroot = self._makeChroot([_tup('foo')])
+        assert not chroot.reusedRoot
+        self._mockDB([])
+        oldRoot, newRoot = self.mktemp(), self.mktemp()
+        os.mkdir(oldRoot)
+        assert chroot.moveOldRoot(oldRoot, newRoot)
+        assert chroot.reusedRoot
+        assert os.path.isdir(newRoot)